@@ -0,0 +1,55 @@
+"""Compare `Model.bulk_create` with looping `Model.save` on SQLite.
+
+    PYTHONPATH=. python benchmarks/bench_bulk.py [rows]
+"""
+import sys
+import time
+
+import peewee as pw
+
+from peeweext.model import Model
+
+db = pw.SqliteDatabase(':memory:')
+
+
+class Row(Model):
+    name = pw.CharField()
+    value = pw.IntegerField()
+
+    class Meta:
+        database = db
+
+
+def loop_save(rows):
+    with db.atomic():
+        for row in rows:
+            Row(**row).save()
+
+
+def bulk_create(rows):
+    Row.bulk_create(rows, batch_size=500)
+
+
+def bench(func, rows):
+    Row.create_table()
+    start = time.perf_counter()
+    func(rows)
+    elapsed = time.perf_counter() - start
+    assert Row.select().count() == len(rows)
+    Row.drop_table()
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rows = [{'name': 'row%d' % i, 'value': i} for i in range(n)]
+    db.connect()
+    for func in (loop_save, bulk_create):
+        elapsed = bench(func, rows)
+        print('{:<12} {:>8} rows {:>8.3f}s {:>10.0f} rows/s'.format(
+            func.__name__, n, elapsed, n / elapsed))
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Stored size and encode/decode throughput of `CompressedJSONField` and
+`CompressedBlobField` against plain `JSONCharField` text.
+
+    PYTHONPATH=. python benchmarks/bench_compressed.py [documents]
+"""
+import random
+import sys
+import time
+
+import peewee as pw
+
+from peeweext.fields import (
+    CompressedBlobField, CompressedJSONField, JSONCharField, compressors)
+from peeweext.model import Model
+
+
+WORDS = ('apple banana cherry delta echo foxtrot golf hotel india juliet '
+         'kilo lima mike november oscar papa quebec romeo sierra tango '
+         'uniform victor whiskey xray yankee zulu').split()
+
+
+def document(rnd, items):
+    """an API response like document, repeated keys and some free text"""
+    return {
+        'id': rnd.randrange(10 ** 9),
+        'user': {'id': rnd.randrange(10 ** 6), 'name': rnd.choice(WORDS),
+                 'roles': rnd.sample(WORDS, 3)},
+        'items': [{
+            'id': rnd.randrange(10 ** 9),
+            'sku': 'SKU-{:08d}'.format(rnd.randrange(10 ** 8)),
+            'title': ' '.join(rnd.choices(WORDS, k=rnd.randint(2, 8))),
+            'price': round(rnd.uniform(1, 500), 2),
+            'quantity': rnd.randint(1, 9),
+            'tags': rnd.sample(WORDS, rnd.randint(0, 4)),
+            'in_stock': rnd.random() > 0.2,
+        } for _ in range(items)],
+        'note': ' '.join(rnd.choices(WORDS, k=items * 5)),
+    }
+
+
+db = pw.SqliteDatabase(':memory:')
+
+
+class Plain(pw.Model):
+    body = JSONCharField(max_length=10 ** 7, codec='auto')
+
+    class Meta:
+        database = db
+
+
+class Packed(Model):
+    body = CompressedJSONField(threshold=256)
+    blob = CompressedBlobField(threshold=256)
+
+    class Meta:
+        database = db
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    rnd = random.Random(42)
+    plain = JSONCharField(max_length=10 ** 7, codec='auto')
+    plain.name = 'body'
+    for items in (2, 20, 200):
+        docs = [document(rnd, items) for _ in range(count)]
+        texts = [plain.db_value(d) for d in docs]
+        raw = sum(len(t.encode()) for t in texts)
+        print('{} documents of {} items, {:.1f} KB each as JSON text'.format(
+            count, items, raw / count / 1024))
+        print('  {:<12} {:>8.0f} MB/s encode {:>8.0f} MB/s decode'.format(
+            'json text', raw / 1e6 / timed(
+                lambda: [plain.db_value(d) for d in docs]),
+            raw / 1e6 / timed(
+                lambda: [plain.python_value(t) for t in texts])))
+        for name in sorted(compressors):
+            for level in sorted({compressors[name].level, 1}):
+                field = CompressedJSONField(
+                    compression=name, level=level, threshold=256)
+                field.name, field._constructor = 'body', bytes
+                stored = [field.db_value(d) for d in docs]
+                size = sum(len(s) for s in stored)
+                print('  {:<12} {:>8.0f} MB/s encode {:>8.0f} MB/s decode'
+                      ' {:>6.1%} of text'.format(
+                          '{} {}'.format(name, level),
+                          raw / 1e6 / timed(
+                              lambda: [field.db_value(d) for d in docs]),
+                          raw / 1e6 / timed(
+                              lambda: [field.python_value(s)
+                                       for s in stored]),
+                          size / raw))
+
+    docs = [document(rnd, 20) for _ in range(count)]
+    db.create_tables([Plain, Packed])
+    with db.atomic():
+        Plain.insert_many([{'body': d} for d in docs]).execute()
+        Packed.insert_many(
+            [{'body': d, 'blob': plain.db_value(d).encode()} for d in docs]
+        ).execute()
+    for title, func in (
+            ('JSONCharField', lambda: [r.body for r in Plain.select()]),
+            ('Compressed', lambda: [r.body for r in Packed.select()]),
+            ('unread', lambda: list(Packed.select()))):
+        print('{:<17} {:>8.0f} us/row'.format(
+            'SQLite ' + title, timed(func) / count * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""`DatetimeTZField` conversion vs the pendulum.instance/parse version.
+
+    PYTHONPATH=. python benchmarks/bench_datetime.py [rows]
+"""
+import datetime
+import sys
+import time
+
+import peewee as pw
+import pendulum
+
+from peeweext.fields import DatetimeTZField
+from peeweext.model import Model
+
+
+class LegacyDatetimeTZField(pw.Field):
+    field_type = 'DATETIME'
+
+    def python_value(self, value):
+        if isinstance(value, str):
+            return pendulum.parse(value)
+        if isinstance(value, datetime.datetime):
+            return pendulum.instance(value)
+        return value
+
+    def db_value(self, value):
+        if value is None:
+            return value
+        if not isinstance(value, datetime.datetime):
+            raise ValueError('datetime instance required')
+        if value.utcoffset() is None:
+            raise ValueError('timezone aware datetime required')
+        if isinstance(value, pendulum.DateTime):
+            value = datetime.datetime.fromtimestamp(
+                value.timestamp(), tz=value.timezone)
+        return value.astimezone(datetime.timezone.utc)
+
+
+db = pw.SqliteDatabase(':memory:')
+
+
+class Legacy(pw.Model):
+    created_at = LegacyDatetimeTZField()
+    updated_at = LegacyDatetimeTZField()
+
+    class Meta:
+        database = db
+        table_name = 'row'
+
+
+class Row(Model):
+    class Meta:
+        database = db
+        table_name = 'row'
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    start = datetime.datetime(2024, 1, 1, 8)
+    naive = [start + datetime.timedelta(seconds=i) for i in range(rows)]
+    columns = [
+        ('naive (MySQL)', naive),
+        ('aware (Postgres)',
+         [v.replace(tzinfo=datetime.timezone.utc) for v in naive]),
+        ('string (SQLite)',
+         [str(v.replace(tzinfo=datetime.timezone.utc)) for v in naive]),
+    ]
+    legacy = LegacyDatetimeTZField()
+    field = DatetimeTZField()
+    lightweight = DatetimeTZField(lightweight=True)
+    for title, values in columns:
+        cases = [
+            ('legacy', lambda: [legacy.python_value(v) for v in values]),
+            ('python_value', lambda: [field.python_value(v) for v in values]),
+            ('python_values', lambda: field.python_values(values)),
+            ('lightweight', lambda: lightweight.python_values(values)),
+        ]
+        for impl, func in cases:
+            print('{:<17} {:<14} {:>8.0f} ns/value'.format(
+                title, impl, timed(func) / rows * 1e9))
+
+    values = [pendulum.instance(v, tz='Asia/Shanghai') for v in naive]
+    for impl, db_value in (('legacy', legacy.db_value),
+                           ('new', field.db_value)):
+        print('{:<17} {:<14} {:>8.0f} ns/value'.format(
+            'db_value', impl,
+            timed(lambda: [db_value(v) for v in values]) / rows * 1e9))
+
+    db.create_tables([Row])
+    now = pendulum.now()
+    with db.atomic():
+        for batch in pw.chunked(range(rows), 300):
+            Row.insert_many(
+                [{'created_at': now, 'updated_at': now} for _ in batch]
+            ).execute()
+    for impl, func in (
+            ('legacy', lambda: list(Legacy.select().iterator())),
+            ('select', lambda: list(Row.select())),
+            ('iterator', lambda: list(Row.select().iterator()))):
+        print('{:<17} {:<14} {:>8.0f} ns/row'.format(
+            'SQLite rows', impl, timed(func) / rows * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Cost of `Model._filter_attrs` on a 50-field model, precomputed allow
+set vs the set difference per call.
+
+    PYTHONPATH=. python benchmarks/bench_filter_attrs.py [loops]
+"""
+import sys
+import timeit
+
+import peewee as pw
+
+from peeweext.model import Model
+
+
+def legacy_filter_attrs(cls, attrs):
+    if cls.__attr_whitelist__:
+        whitelist = cls.__attr_accessible__ - cls.__attr_protected__
+        return {k: v for k, v in attrs.items() if k in whitelist}
+    else:
+        blacklist = cls.__attr_protected__ - cls.__attr_accessible__
+        return {k: v for k, v in attrs.items() if k not in blacklist}
+
+
+names = ['f{}'.format(i) for i in range(50)]
+
+
+class Blacklist(Model):
+    __attr_protected__ = set(names[40:])
+
+    locals().update({name: pw.IntegerField(default=0) for name in names})
+
+
+class Whitelist(Model):
+    __attr_whitelist__ = True
+    __attr_accessible__ = set(names[:40])
+
+    locals().update({name: pw.IntegerField(default=0) for name in names})
+
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    cases = [
+        ('10 allowed keys', {name: 1 for name in names[:10]}),
+        ('40 allowed keys', {name: 1 for name in names[:40]}),
+        ('50 keys, 10 dropped', {name: 1 for name in names}),
+    ]
+    for model in (Blacklist, Whitelist):
+        for title, attrs in cases:
+            for impl, func in (
+                    ('legacy', lambda: legacy_filter_attrs(model, attrs)),
+                    ('new', lambda: model._filter_attrs(attrs))):
+                seconds = timeit.timeit(func, number=loops)
+                print('{:<10} {:<20} {:<7} {:>8.0f} ns/call'.format(
+                    model.__name__, title, impl, seconds / loops * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Rows per second of `ModelSelect.lite()` against model instances and
+peewee's tuples()/namedtuples().
+
+    PYTHONPATH=. python benchmarks/bench_lite.py [rows]
+"""
+import sys
+import time
+
+import peewee as pw
+import pendulum
+
+from peeweext.model import Model
+
+
+db = pw.SqliteDatabase(':memory:')
+
+
+class Note(Model):
+    message = pw.TextField()
+    rank = pw.IntegerField()
+    score = pw.FloatField(null=True)
+
+    class Meta:
+        database = db
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    db.create_tables([Note])
+    now = pendulum.now()
+    with db.atomic():
+        for batch in pw.chunked(range(rows), 300):
+            Note.insert_many([{
+                'message': 'note {}'.format(i), 'rank': i, 'score': i / 3,
+                'created_at': now, 'updated_at': now} for i in batch]
+            ).execute()
+    for title, func in (
+            ('models', lambda: list(Note.select())),
+            ('models iterator', lambda: list(Note.select().iterator())),
+            ('namedtuples', lambda: list(Note.select().namedtuples())),
+            ('tuples', lambda: list(Note.select().tuples())),
+            ('lite', lambda: list(Note.select().lite())),
+            ('lite iterator', lambda: list(Note.select().lite().iterator())),
+            ('lite, no dates', lambda: list(
+                Note.select(Note.id, Note.message, Note.rank, Note.score)
+                .lite()))):
+        print('{:<17} {:>10.0f} rows/s'.format(title, rows / timed(func)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Cost of the model telemetry on `save()`: off, histograms only, spans
+sampled at 10% and spans of every save.
+
+    PYTHONPATH=. python benchmarks/bench_otel.py [saves]
+"""
+import sys
+import time
+
+import peewee as pw
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+from opentelemetry.sdk.trace import TracerProvider
+
+from peeweext import otel, pool
+from peeweext.model import Model
+
+
+db = pool.connect('sqlite:///:memory:', mixins=(otel.TelemetryMixin,))
+
+
+class Note(Model):
+    message = pw.TextField()
+
+    class Meta:
+        database = db
+
+
+def timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main():
+    saves = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    db.create_tables([Note])
+    tracer_provider = TracerProvider()
+    meter_provider = MeterProvider(metric_readers=[InMemoryMetricReader()])
+    for title, options in (
+            ('off', None),
+            ('histograms', dict(spans=False)),
+            ('spans 10%', dict(metrics=False, sample_rate=0.1)),
+            ('spans', dict(metrics=False)),
+            ('spans, histograms', {})):
+        if options is None:
+            otel.uninstall()
+        else:
+            otel.install(tracer_provider, meter_provider, **options)
+        with db.atomic():
+            seconds = timed(lambda: [
+                Note(message='note {}'.format(i)).save()
+                for i in range(saves)])
+        print('{:<18} {:>6.1f} us/save'.format(title, seconds / saves * 1e6))
+    otel.uninstall()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""`SequenceMixin` reordering on SQLite: keyset neighbours and set-based
+renumbering vs the old COUNT + OFFSET lookup and per-row `save()`, and
+rows/s of threads appending with the allocator vs the largest key lookup.
+
+    PYTHONPATH=. python benchmarks/bench_sequence.py [size ...]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import peewee as pw
+from peewee import fn, SQL
+
+from peeweext.mixins import SequenceAllocator, SequenceCounter, \
+    SequenceMixin
+from peeweext.model import Model
+
+db = pw.SqliteDatabase(':memory:')
+
+
+class Item(SequenceMixin, Model):
+    id = pw.AutoField()
+    sequence = pw.DoubleField(null=True, index=True)
+
+    class Meta:
+        database = db
+
+
+def legacy_loosen(self):
+    # materialized: iterating the cursor while updating an indexed
+    # sequence column revisits the moved rows on SQLite
+    collection = list(
+        self._sequence_query().order_by(+self.__class__.sequence))
+    for index, instance in enumerate(collection):
+        instance.sequence = float(index + 1)
+        instance.save()
+
+
+def legacy_change_sequence(self, new_sequence):
+    with self._meta.database.atomic():
+        klass = self.__class__
+        current_sequence = self._sequence_query().where(
+            klass.sequence <= self.sequence).select(
+            fn.COUNT(SQL('*'))).scalar()
+        if current_sequence == new_sequence:
+            return
+        if new_sequence > 1:
+            instances = self._sequence_query().order_by(+klass.sequence)
+            if current_sequence > new_sequence:
+                start, end = new_sequence - 2, new_sequence
+            else:
+                start, end = new_sequence - 1, new_sequence + 1
+            instances = instances[start:end]
+            if len(instances) == 1:
+                prev_seq = instances[0].sequence
+                next_seq = prev_seq + 1
+            else:
+                prev_seq = instances[0].sequence
+                next_seq = instances[1].sequence
+        else:
+            prev_seq = 0
+            next_seq = self._sequence_query() \
+                .order_by(+klass.sequence).first().sequence
+        self.sequence = (prev_seq + next_seq) / 2
+        self.save()
+
+
+def fill(size):
+    Item.delete().execute()
+    with db.atomic():
+        for batch in pw.chunked(range(1, size + 1), 300):
+            Item.insert_many(
+                [{'id': i, 'sequence': float(i)} for i in batch]).execute()
+
+
+def timed(func, loops=1):
+    start = time.perf_counter()
+    for _ in range(loops):
+        func()
+    return (time.perf_counter() - start) / loops
+
+
+def appends(counter, threads=8, rows=200):
+    """rows/s of `threads` creating `rows` rows each on a WAL file"""
+    with tempfile.TemporaryDirectory() as path:
+        file_db = pw.SqliteDatabase(
+            os.path.join(path, 'seq.db'), pragmas={'journal_mode': 'wal'},
+            timeout=30)
+
+        class Ticket(SequenceMixin, Model):
+            __seq_allocator__ = SequenceAllocator()
+
+            id = pw.AutoField()
+            sequence = pw.DoubleField(null=True)
+
+            class Meta:
+                database = file_db
+
+        tables = [Ticket, SequenceCounter] if counter else [Ticket]
+        with file_db.bind_ctx([SequenceCounter]):
+            file_db.create_tables(tables)
+
+            def worker():
+                for _ in range(rows):
+                    Ticket.create()
+                file_db.close()
+
+            workers = [threading.Thread(target=worker)
+                       for _ in range(threads)]
+            start = time.perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            cost = time.perf_counter() - start
+            sequences = [s for s, in Ticket.select(Ticket.sequence).tuples()]
+        file_db.close()
+    return threads * rows / cost, len(set(sequences)) == len(sequences)
+
+
+def main():
+    sizes = [int(n) for n in sys.argv[1:]] or [100, 1000, 10000, 100000]
+    db.create_tables([Item])
+    for size in sizes:
+        fill(size)
+        # move rows from the tail to the middle and back
+        items = list(Item.select().order_by(-Item.id).limit(20))
+        moves = [(items[i], size // 2 if i % 2 else size - 1)
+                 for i in range(len(items))]
+        for impl, change in (('legacy', legacy_change_sequence),
+                             ('keyset', Item._change_sequence)):
+            cost = timed(lambda: [change(i, pos) for i, pos in moves])
+            print('{:>7} rows {:<7} change_sequence {:>9.3f} ms'.format(
+                size, impl, cost / len(moves) * 1e3))
+
+        item = Item.get_by_id(1)
+        for impl, loosen in (('legacy', legacy_loosen),
+                             ('set', Item._loosen)):
+            if impl == 'legacy' and size > 10000:
+                print('{:>7} rows {:<7} loosen          {:>9}'.format(
+                    size, impl, 'skipped'))
+                continue
+            cost = timed(lambda: loosen(item))
+            print('{:>7} rows {:<7} loosen          {:>9.3f} ms'.format(
+                size, impl, cost * 1e3))
+
+    for impl, counter in (('max key', False), ('allocator', True)):
+        rate, unique = appends(counter)
+        print('8 threads {:<9} append {:>9.0f} rows/s{}'.format(
+            impl, rate, '' if unique else ', duplicated'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Cost of `Model._validate` per save, compiled plan vs the old dict walk.
+
+    PYTHONPATH=. python benchmarks/bench_validate.py [loops]
+"""
+import sys
+import timeit
+
+import peewee as pw
+
+from peeweext import validation as val
+from peeweext.model import Model
+
+
+def legacy_validate(self, only=None):
+    errors = {}
+    if only:
+        items = []
+        for field in only:
+            if isinstance(field, pw.basestring):
+                name = field
+            else:
+                name = field.name
+            validator = self._validators.get(name)
+            if validator:
+                items.append((name, validator))
+    else:
+        items = self._validators.items()
+    for name, validator in items:
+        value = getattr(self, name)
+        try:
+            validator(self, value)
+        except val.ValidationError as e:
+            errors[name] = str(e)
+    return errors
+
+
+class Plain(Model):
+    name = pw.CharField()
+
+
+class Validated(Model):
+    name = pw.CharField()
+    email = pw.CharField()
+    age = pw.IntegerField()
+
+    @val.validates(val.LengthValidator(min_length=1, max_length=32))
+    def validate_name(self, value):
+        pass
+
+    @val.validates(val.ExclusionValidator('root@localhost'))
+    def validate_email(self, value):
+        pass
+
+    def validate_age(self, value):
+        if value < 0:
+            raise val.ValidationError('negative age')
+
+
+def main():
+    loops = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    cases = [
+        ('no validators', Plain(name='n'), None),
+        ('3 validators', Validated(name='n', email='e', age=1), None),
+        ('only=[name]', Validated(name='n', email='e', age=1), ['name']),
+    ]
+    for title, instance, only in cases:
+        for impl, func in (('legacy', legacy_validate),
+                           ('plan', type(instance)._validate)):
+            cost = timeit.timeit(
+                lambda: func(instance, only), number=loops) / loops
+            print('{:<14} {:<7} {:>8.0f} ns/save'.format(
+                title, impl, cost * 1e9))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,487 @@
+"""asyncio support for peeweext models.
+
+Queries are built and compiled by peewee as usual, then executed on an
+async DB-API driver (aiosqlite, aiomysql or aiopg) and hydrated by peewee's
+cursor wrappers, so field conversion stays the same as the blocking API.
+"""
+import asyncio
+import contextlib
+import contextvars
+import importlib
+import inspect
+import time
+
+import peewee as pw
+from playhouse import db_url
+
+from . import signals
+from .cache import _CachedCursor
+from .model import Model, ModelSelect, _bulk_converters, _convert_rows
+from .signals import pre_save, post_save, pre_delete, post_delete
+
+
+async def _maybe_await(result):
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
+def driver_connect(database):
+    """Coroutine function opening an async connection to `database`,
+    connections are in autocommit mode, see `AioDatabase.atomic`
+    """
+    params = database.connect_params
+    if isinstance(database, pw.SqliteDatabase):
+        import aiosqlite
+        return lambda: aiosqlite.connect(
+            database.database, isolation_level=None, **params)
+    if isinstance(database, pw.MySQLDatabase):
+        import aiomysql
+        return lambda: aiomysql.connect(
+            db=database.database, autocommit=True, **params)
+    if isinstance(database, pw.PostgresqlDatabase):
+        import aiopg
+        return lambda: aiopg.connect(dbname=database.database, **params)
+    raise RuntimeError(
+        'No async driver for {}'.format(type(database).__name__))
+
+
+class AioPool:
+    """Connection pool of one event loop, `connect` is a coroutine function
+    """
+
+    def __init__(self, connect=None, max_connections=20):
+        self._connect = connect
+        self.max_connections = max_connections
+        self._idle = []
+        self._in_use = 0
+        self._semaphore = None
+        self.checkouts = 0
+        self.wait_time = 0.0
+
+    async def acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        start = time.perf_counter()
+        await self._semaphore.acquire()
+        try:
+            conn = self._idle.pop() if self._idle else await self._connect()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        self._in_use += 1
+        self.checkouts += 1
+        self.wait_time += time.perf_counter() - start
+        return conn
+
+    async def release(self, conn, discard=False):
+        self._in_use -= 1
+        try:
+            if discard:
+                await _maybe_await(conn.close())
+            else:
+                self._idle.append(conn)
+        finally:
+            self._semaphore.release()
+
+    async def close(self):
+        """Close idle connections, in-use ones are closed when released"""
+        while self._idle:
+            await _maybe_await(self._idle.pop().close())
+
+    def stats(self):
+        return {
+            'size': self._in_use + len(self._idle),
+            'in_use': self._in_use,
+            'idle': len(self._idle),
+            'max_connections': self.max_connections,
+            'checkouts': self.checkouts,
+            'wait_time': self.wait_time,
+        }
+
+
+class _Scope:
+    __slots__ = ('conn', 'task', 'depth')
+
+    def __init__(self, conn, task):
+        self.conn = conn
+        self.task = task
+        self.depth = 0  # transaction nesting
+
+
+class AioDatabase:
+    """Execute peewee queries asynchronously.
+
+    database: the peewee database compiling the queries, it is never
+        connected by this class
+    statements outside `connection()` check out a pooled connection each
+    """
+
+    def __init__(self, database=None, max_connections=20):
+        self.database = None
+        self.pool = AioPool()
+        self._scope = contextvars.ContextVar(
+            'peeweext_aio_scope', default=None)
+        if database is not None:
+            self.init(database, max_connections)
+
+    def init(self, database, max_connections=20):
+        self.database = database
+        self.pool = AioPool(driver_connect(database), max_connections)
+
+    def _current(self):
+        # tasks copy the context of their parent, never share its connection
+        scope = self._scope.get()
+        if scope is not None and scope.task is asyncio.current_task():
+            return scope
+        return None
+
+    @contextlib.asynccontextmanager
+    async def _checkout(self):
+        scope = self._current()
+        if scope is not None:
+            yield scope.conn
+            return
+        conn = await self.pool.acquire()
+        try:
+            yield conn
+        except GeneratorExit:  # rows of `iterate` closed early
+            await self.pool.release(conn)
+            raise
+        except BaseException:
+            # a failed or cancelled statement may leave it mid-transaction
+            # or with unread rows, never hand it out again
+            await self.pool.release(conn, discard=True)
+            raise
+        await self.pool.release(conn)
+
+    @contextlib.asynccontextmanager
+    async def connection(self):
+        """Bind one connection to the current task until the block exits,
+        statements and transactions inside share it. Nested blocks reuse
+        the outer connection.
+        """
+        scope = self._current()
+        if scope is not None:
+            yield scope.conn
+            return
+        async with self._checkout() as conn:
+            token = self._scope.set(_Scope(conn, asyncio.current_task()))
+            try:
+                yield conn
+            finally:
+                self._scope.reset(token)
+
+    @contextlib.asynccontextmanager
+    async def atomic(self):
+        """Transaction of the current task, nested blocks use savepoints"""
+        async with self.connection() as conn:
+            scope = self._current()
+            depth = scope.depth
+            savepoint = 'peeweext_sp{}'.format(depth)
+            await self._run(
+                conn, 'SAVEPOINT ' + savepoint if depth else 'BEGIN')
+            scope.depth += 1
+            try:
+                yield
+            except BaseException:
+                scope.depth -= 1
+                await self._run(
+                    conn,
+                    'ROLLBACK TO SAVEPOINT ' + savepoint if depth
+                    else 'ROLLBACK')
+                raise
+            scope.depth -= 1
+            await self._run(
+                conn, 'RELEASE SAVEPOINT ' + savepoint if depth else 'COMMIT')
+
+    def in_transaction(self):
+        scope = self._current()
+        return scope is not None and scope.depth > 0
+
+    @staticmethod
+    async def _run(conn, sql, params=()):
+        cursor = await conn.cursor()
+        try:
+            await cursor.execute(sql, params)
+        finally:
+            await _maybe_await(cursor.close())
+
+    def _compile(self, query):
+        return self.database.get_sql_context().sql(query).query()
+
+    async def execute_sql(self, sql, params=()):
+        """return (description, rows, lastrowid, rowcount)"""
+        async with self._checkout() as conn:
+            cursor = await conn.cursor()
+            try:
+                await cursor.execute(sql, params)
+                rows = await cursor.fetchall() if cursor.description else []
+                return (cursor.description, rows,
+                        cursor.lastrowid, cursor.rowcount)
+            finally:
+                await _maybe_await(cursor.close())
+
+    async def execute(self, query):
+        """Async `query.execute()`: rows of a SELECT, the primary key of an
+        INSERT, and the number of affected rows for UPDATE and DELETE
+        """
+        if isinstance(query, pw.Insert) and query._returning is None \
+                and self.database.returning_clause \
+                and query.table._primary_key:
+            query = query.returning(query.table._primary_key)
+        description, rows, lastrowid, rowcount = \
+            await self.execute_sql(*self._compile(query))
+        if isinstance(query, pw.SelectBase):
+            wrapper = query._get_cursor_wrapper(
+                _CachedCursor(description, rows))
+            return list(wrapper)
+        if isinstance(query, pw.Insert):
+            return rows[0][0] if rows else lastrowid
+        return rowcount
+
+    def iterate(self, query, chunk_size=100):
+        """Hydrate the rows of a SELECT while fetching them in chunks, the
+        connection is held until the rows run out or the iterator is closed
+        """
+        return _Rows(self._iterate(query, chunk_size))
+
+    async def _iterate(self, query, chunk_size):
+        sql, params = self._compile(query)
+        async with self._checkout() as conn:
+            cursor = await conn.cursor()
+            try:
+                await cursor.execute(sql, params)
+                wrapper = query._get_cursor_wrapper(
+                    _CachedCursor(cursor.description, ()))
+                wrapper.initialize()
+                bulk = _bulk_converters(wrapper)
+                while True:
+                    rows = await cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for row in _convert_rows(rows, bulk):
+                        yield wrapper.process_row(row)
+            finally:
+                await _maybe_await(cursor.close())
+
+    async def close(self):
+        await self.pool.close()
+
+
+class _Rows:
+    """Rows of `AioDatabase.iterate`, leaving `async with` closes it and
+    releases the connection of a loop left early
+
+    async with query.aio_iterate() as rows:
+        async for row in rows:
+            break
+    """
+
+    def __init__(self, rows):
+        self._rows = rows
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self._rows.__anext__()
+
+    async def aclose(self):
+        await self._rows.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+
+class AioModelSelect(ModelSelect):
+    """`async for` iterates rows, `aio_*` methods execute asynchronously"""
+
+    def _aio_database(self):
+        return self.model._meta.aio_database
+
+    def __aiter__(self):
+        return self.aio_iterate()
+
+    def aio_iterate(self, chunk_size=100):
+        return self._aio_database().iterate(self, chunk_size)
+
+    async def aio_execute(self):
+        return await self._aio_database().execute(self)
+
+    async def aio_get(self):
+        clone = self.paginate(1, 1)
+        rows = await self._aio_database().execute(clone)
+        if rows:
+            return rows[0]
+        sql, params = clone.sql()
+        raise self.model.DoesNotExist(
+            '%s instance matching query does not exist:\nSQL: %s\n'
+            'Params: %s' % (clone.model, sql, params))
+
+
+class AioModel(Model):
+    """Model with async methods running on Meta.aio_database, validation,
+    mass assignment protection and signals behave like the blocking ones
+    and coroutine signal receivers are awaited.
+    """
+    _select_class = AioModelSelect
+
+    @classmethod
+    async def aio_get(cls, *query, **filters):
+        sq = cls.select()
+        if query:
+            if len(query) == 1 and isinstance(query[0], int):
+                sq = sq.where(cls._meta.primary_key == query[0])
+            else:
+                sq = sq.where(*query)
+        if filters:
+            sq = sq.filter(**filters)
+        return await sq.aio_get()
+
+    @classmethod
+    async def aio_get_by_id(cls, pk):
+        return await cls.aio_get(cls._meta.primary_key == pk)
+
+    @classmethod
+    async def aio_create(cls, **query):
+        """
+        secure create, mass assignment protected
+        """
+        instance = cls(**cls._filter_attrs(query))
+        await instance.aio_save(force_insert=True)
+        return instance
+
+    async def aio_update_with(self, **query):
+        """
+        secure update, mass assignment protected
+        """
+        for k, v in self._filter_attrs(query).items():
+            setattr(self, k, v)
+        return await self.aio_save()
+
+    async def aio_save(self, force_insert=False, only=None,
+                       skip_validation=False):
+        kwargs = {'force_insert': force_insert, 'only': only,
+                  'skip_validation': skip_validation}
+        created = self._prepare_save(kwargs)
+        if created is None:
+            return False
+        await signals.send_async(pre_save, type(self), self, created=created)
+        ret = await self._aio_save_row(
+            force_insert=force_insert, only=kwargs['only'])
+        await signals.send_async(
+            post_save, type(self), self, created=created)
+        return ret
+
+    async def _aio_save_row(self, force_insert=False, only=None):
+        """`peewee.Model.save` with the queries awaited, the async
+        `_save_row`, see `mixins.VersionedMixin`
+        """
+        database = self._meta.aio_database
+        field_dict = self.__data__.copy()
+        if self._meta.primary_key is not False:
+            pk_field = self._meta.primary_key
+            pk_value = self._pk
+        else:
+            pk_field = pk_value = None
+        if only is not None:
+            field_dict = self._prune_fields(field_dict, only)
+        elif self._meta.only_save_dirty and not force_insert:
+            field_dict = self._prune_fields(field_dict, self.dirty_fields)
+            if not field_dict:
+                self._dirty.clear()
+                return False
+
+        self._populate_unsaved_relations(field_dict)
+        rows = 1
+
+        if self._meta.auto_increment and pk_value is None:
+            field_dict.pop(pk_field.name, None)
+
+        if pk_value is not None and not force_insert:
+            if self._meta.composite_key:
+                for pk_part_name in pk_field.field_names:
+                    field_dict.pop(pk_part_name, None)
+            else:
+                field_dict.pop(pk_field.name, None)
+            if not field_dict:
+                raise ValueError('no data to save!')
+            rows = await database.execute(
+                self.update(**field_dict).where(self._pk_expr()))
+        elif pk_field is not None:
+            pk = await database.execute(self.insert(**field_dict))
+            if pk is not None and (self._meta.auto_increment or
+                                   pk_value is None):
+                self._pk = pk
+                self._dirty.discard(pk_field.name)
+        else:
+            await database.execute(self.insert(**field_dict))
+
+        self._dirty -= set(field_dict)
+        return rows
+
+    async def aio_delete_instance(self):
+        model = type(self)
+        await signals.send_async(pre_delete, model, self)
+        ret = await self._meta.aio_database.execute(
+            model.delete().where(self._pk_expr()))
+        await signals.send_async(post_delete, model, self)
+        return ret
+
+
+def _import_string(path):
+    module, _, name = path.rpartition('.')
+    return getattr(importlib.import_module(module), name)
+
+
+class Peeweext:
+    """Extension for asyncio services, e.g. ASGI or gRPC aio servers.
+
+    No per-request connection is opened: statements check out pooled
+    connections and `async with pwdb.connection():` binds one connection
+    to the current task.
+    """
+
+    def __init__(self, ns='PW_'):
+        self.ns = ns
+        self.database = pw.DatabaseProxy()  # blocking API and SQL compiling
+        self.aio_database = AioDatabase()
+        self._model = None
+
+    def init_app(self, app):
+        config = app.config.get_namespace(self.ns)
+        self.model_class = _import_string(
+            config.get('model', 'peeweext.aio.AioModel'))
+        conn_params = config.get('conn_params', {})
+        self.database.initialize(
+            db_url.connect(config['db_url'], **conn_params))
+        self.aio_database.init(
+            self.database.obj,
+            max_connections=config.get('pool_max_connections', 20))
+
+    @property
+    def Model(self):
+        if self._model is None:
+            class BaseModel(self.model_class):
+                class Meta:
+                    database = self.database
+                    aio_database = self.aio_database
+
+            self._model = BaseModel
+        return self._model
+
+    def connection(self):
+        return self.aio_database.connection()
+
+    def atomic(self):
+        return self.aio_database.atomic()
+
+    def pool_stats(self):
+        return self.aio_database.pool.stats()
+
+    async def close(self):
+        await self.aio_database.close()
@@ -0,0 +1,263 @@
+"""Caches for peeweext models"""
+import collections
+import copy
+import itertools
+import re
+import sys
+import threading
+import time
+
+from .signals import post_save, post_delete
+
+
+class LRUCache:
+    """In-process LRU cache with optional per-key ttl (seconds).
+
+    Any object with the same `get`, `set` and `delete` methods can be
+    used as a cache backend.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self._data = collections.OrderedDict()  # {key: (expire_at, value)}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                expire_at, value = self._data[key]
+            except KeyError:
+                return None
+            if expire_at is not None and expire_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expire_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (expire_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RowCache:
+    """Read-through cache of rows by primary key, enable it in Meta:
+
+    class Note(pwdb.Model):
+        class Meta:
+            row_cache = RowCache(ttl=60, max_size=10000)
+
+    `Note.get_by_id(pk)`, `Note.get(pk)` and `Note.get(id=pk)` are served
+    from the cache, rows are evicted by post_save and post_delete.
+    """
+
+    def __init__(self, backend=None, ttl=None, max_size=1024):
+        self.backend = backend if backend is not None else LRUCache(max_size)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(model, pk):
+        meta = model._meta
+        return 'peeweext:row:{}:{}'.format(
+            meta.table_name, meta.primary_key.db_value(pk))
+
+    def get(self, model, pk):
+        data = self.backend.get(self.key(model, pk))
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        data = dict(data)
+        # never share in-place mutable values with the cached copy
+        for name in model._mutable_fields & data.keys():
+            data[name] = copy.deepcopy(data[name])
+        instance = model(__no_default__=1, **data)
+        instance._dirty.clear()
+        return instance
+
+    def set(self, instance):
+        model = type(instance)
+        data = dict(instance.__data__)
+        for name in model._mutable_fields & data.keys():
+            data[name] = copy.deepcopy(data[name])
+        self.backend.set(self.key(model, instance._pk), data, self.ttl)
+
+    def delete(self, model, pk):
+        self.backend.delete(self.key(model, pk))
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+def evict_row(sender, instance, created=False):
+    if not created:
+        sender._meta.row_cache.delete(sender, instance._pk)
+
+
+def evict_rows(sender, instances, pks, **kwargs):
+    """rows of a delete batch, with or without instances"""
+    for pk in pks:
+        sender._meta.row_cache.delete(sender, pk)
+
+
+_TABLE = r'(?:[`"]?\w+[`"]?\.)?[`"]?\w+[`"]?(?:\s+AS\s+[`"]?\w+[`"]?)?'
+# [schema.]table [AS alias] after JOIN, or after FROM and the commas
+_tables_re = re.compile(
+    r'\b(?:FROM|JOIN)\s+({0}(?:\s*,\s*{0})*)'.format(_TABLE), re.IGNORECASE)
+_name_re = re.compile(r'(?:[`"]?\w+[`"]?\.)?[`"]?(\w+)')
+
+
+def _tables(sql):
+    return frozenset(
+        _name_re.match(table.strip()).group(1)
+        for tables in _tables_re.findall(sql)
+        for table in tables.split(','))
+
+
+class _CachedCursor:
+    """Replay cached rows through peewee's cursor wrappers"""
+
+    def __init__(self, description, rows):
+        self.description = description
+        self._rows = iter(rows)
+
+    def fetchone(self):
+        return next(self._rows, None)
+
+    def fetchmany(self, size):
+        return list(itertools.islice(self._rows, size))
+
+    def close(self):
+        pass
+
+
+class QueryCache:
+    """Cache of SELECT results keyed by compiled SQL and parameters.
+
+    Entries are evicted in LRU order beyond `max_size` entries or
+    `max_memory` bytes, and by table when a model of that table sends
+    post_save or post_delete. Disabled while `max_size` is 0.
+    """
+
+    def __init__(self, max_size=0, ttl=None, max_memory=None):
+        self._data = collections.OrderedDict()
+        self._tables = collections.defaultdict(set)  # {table: {key}}
+        self._generations = collections.Counter()  # {table: invalidations}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.memory = 0  # estimated bytes of cached rows
+        self.configure(max_size, ttl, max_memory)
+
+    def configure(self, max_size=0, ttl=None, max_memory=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_memory = max_memory
+        self.clear()
+        if self.enabled:
+            post_save.connect(self._invalidate_sender)
+            post_delete.connect(self._invalidate_sender)
+        else:
+            post_save.disconnect(self._invalidate_sender)
+            post_delete.disconnect(self._invalidate_sender)
+
+    @property
+    def enabled(self):
+        return bool(self.max_size)
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def cursor(self, query, database, ttl=None):
+        """Return a cursor of the query results, from cache if possible"""
+        sql, params = database.get_sql_context().sql(query).query()
+        key = (sql, tuple(params))
+        try:
+            hash(key)
+        except TypeError:
+            return database.execute_sql(sql, params)
+
+        now = time.monotonic()
+        tables = _tables(sql)
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (
+                    entry[0] is None or entry[0] >= now):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return _CachedCursor(entry[1], entry[2])
+            self.misses += 1
+            generations = [self._generations[table] for table in tables]
+
+        cursor = database.execute_sql(sql, params)
+        description, rows = cursor.description, cursor.fetchall()
+        cursor.close()
+
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = now + ttl if ttl else None
+        size = sys.getsizeof(sql) + sys.getsizeof(rows) + sum(
+            sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row)
+            for row in rows)
+        with self._lock:
+            # a table invalidated while the query ran, the rows may be stale
+            if generations != [self._generations[table] for table in tables]:
+                return _CachedCursor(description, rows)
+            self._pop(key)
+            self._data[key] = (expire_at, description, rows, tables, size)
+            self.memory += size
+            for table in tables:
+                self._tables[table].add(key)
+            while self._data and (
+                    len(self._data) > self.max_size or (
+                        self.max_memory and self.memory > self.max_memory)):
+                self._pop(next(iter(self._data)))
+        return _CachedCursor(description, rows)
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        self.memory -= entry[4]
+        for table in entry[3]:
+            keys = self._tables[table]
+            keys.discard(key)
+            if not keys:
+                del self._tables[table]
+
+    def invalidate(self, table):
+        with self._lock:
+            self._generations[table] += 1
+            for key in list(self._tables.get(table, ())):
+                self._pop(key)
+
+    def _invalidate_sender(self, sender, **kwargs):
+        self.invalidate(sender._meta.table_name)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tables.clear()
+            self.memory = 0
+
+    def __len__(self):
+        return len(self._data)
@@ -1,8 +1,24 @@
 import json
+import zlib
 import datetime
 import peewee as pw
 import pendulum
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
 
 def patch_datetime_type():
     pw.MySQLDatabase.field_types.update({'DATETIME': 'DATETIME(6)'})
@@ -12,43 +28,432 @@ def patch_datetime_type():
 patch_datetime_type()
 
 
+_UTC = datetime.timezone.utc
+_timezones = {}  # {fixed offset tzinfo: pendulum timezone}
+_parsed_timezones = {}  # {fixed offset tzinfo: pendulum.FixedTimezone}
+
+
+def _pendulum_tz(tzinfo, cache=_timezones):
+    try:
+        return cache[tzinfo]
+    except KeyError:
+        pass
+    if cache is _parsed_timezones:
+        offset = tzinfo.utcoffset(None)
+        tz = pendulum.FixedTimezone(int(offset.total_seconds()))
+    else:
+        tz = pendulum.instance(
+            datetime.datetime(2000, 1, 1, tzinfo=tzinfo)).tzinfo
+    cache[tzinfo] = tz
+    return tz
+
+
+def _to_pendulum(value, cache=_timezones):
+    """`pendulum.instance` without timezone lookups, naive values are UTC
+    """
+    tzinfo = value.tzinfo
+    if tzinfo is None:
+        tz = pendulum.UTC
+    elif isinstance(tzinfo, datetime.timezone):  # fixed offset, cacheable
+        tz = _pendulum_tz(tzinfo, cache)
+    else:
+        return pendulum.instance(value)
+    return pendulum.DateTime(
+        value.year, value.month, value.day, value.hour, value.minute,
+        value.second, value.microsecond, tzinfo=tz, fold=value.fold)
+
+
+def _to_stdlib(value):
+    if value.tzinfo is None:
+        return value.replace(tzinfo=_UTC)
+    if isinstance(value, pendulum.DateTime):
+        return datetime.datetime(
+            value.year, value.month, value.day, value.hour, value.minute,
+            value.second, value.microsecond,
+            tzinfo=datetime.timezone(value.utcoffset()), fold=value.fold)
+    return value
+
+
 class DatetimeTZField(pw.Field):
     field_type = 'DATETIME'
 
+    def __init__(self, lightweight=False, *args, **kwargs):
+        """
+        lightweight: read values as stdlib aware datetimes instead of
+            pendulum ones, naive values from the database are UTC
+        """
+        self.lightweight = lightweight
+        super(DatetimeTZField, self).__init__(*args, **kwargs)
+
     def python_value(self, value):
         if isinstance(value, str):
-            return pendulum.parse(value)
+            try:
+                value = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                value = pendulum.parse(value)
+                return _to_stdlib(value) if self.lightweight else value
+            if self.lightweight:
+                return _to_stdlib(value)
+            return _to_pendulum(value, _parsed_timezones)
         if isinstance(value, datetime.datetime):
-            return pendulum.instance(value)
+            if self.lightweight:
+                return _to_stdlib(value)
+            if isinstance(value, pendulum.DateTime):
+                return value
+            return _to_pendulum(value)
         return value
 
+    def python_values(self, values):
+        """
+        convert a column of values in one loop, the common naive, fixed
+        offset and ISO string values skip the generic path,
+        see `ModelSelect.iterator`
+        """
+        if self.lightweight:
+            return [_to_stdlib(v) if isinstance(v, datetime.datetime)
+                    else self.python_value(v) for v in values]
+        convert = self.python_value
+        fromisoformat = datetime.datetime.fromisoformat
+        new, utc = pendulum.DateTime, pendulum.UTC
+        result = []
+        append = result.append
+        for value in values:
+            kind = type(value)
+            if kind is str:
+                try:
+                    value = fromisoformat(value)
+                except ValueError:
+                    append(convert(value))
+                    continue
+                cache = _parsed_timezones
+            elif kind is datetime.datetime:
+                cache = _timezones
+            else:
+                append(convert(value))
+                continue
+            tzinfo = value.tzinfo
+            if tzinfo is None:
+                tz = utc
+            else:
+                tz = cache.get(tzinfo)
+                if tz is None:
+                    if not isinstance(tzinfo, datetime.timezone):
+                        append(pendulum.instance(value))
+                        continue
+                    tz = _pendulum_tz(tzinfo, cache)
+            append(new(value.year, value.month, value.day, value.hour,
+                       value.minute, value.second, value.microsecond,
+                       tzinfo=tz, fold=value.fold))
+        return result
+
     def db_value(self, value):
         if value is None:
             return value
         if not isinstance(value, datetime.datetime):
             raise ValueError('datetime instance required')
-        if value.utcoffset() is None:
+        offset = value.utcoffset()
+        if offset is None:
             raise ValueError('timezone aware datetime required')
-        if isinstance(value, pendulum.DateTime):
-            value = datetime.datetime.fromtimestamp(
-                value.timestamp(), tz=value.timezone)
-        return value.astimezone(datetime.timezone.utc)
+        if value.tzinfo is _UTC:
+            return value
+        # plain arithmetic, exact to the microsecond for pendulum values too
+        return datetime.datetime(
+            value.year, value.month, value.day, value.hour, value.minute,
+            value.second, value.microsecond, tzinfo=_UTC) - offset
+
+
+class JSONCodec:
+    """
+    `dumps(value, ensure_ascii)` returns str or UTF-8 bytes, `loads` takes
+    either. compact codecs write '{"a":1}' where stdlib json writes
+    '{"a": 1}', every codec reads both
+    """
+
+    def __init__(self, name, dumps, loads):
+        self.name = name
+        self.dumps = dumps
+        self.loads = loads
+
+
+def _json_dumps(value, ensure_ascii):
+    return json.dumps(value, ensure_ascii=ensure_ascii)
+
+
+json_codecs = {'json': JSONCodec('json', _json_dumps, json.loads)}
+
+if orjson is not None:
+    def _orjson_dumps(value, ensure_ascii):
+        try:
+            data = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:  # e.g. integers over 64 bits
+            return _json_dumps(value, ensure_ascii)
+        if ensure_ascii and not data.isascii():
+            return _json_dumps(value, ensure_ascii)
+        return data
+
+    def _orjson_loads(data):
+        try:
+            return orjson.loads(data)
+        except ValueError:  # NaN, integers over 64 bits
+            if isinstance(data, memoryview):
+                data = data.tobytes()
+            return json.loads(data)
+
+    json_codecs['orjson'] = JSONCodec('orjson', _orjson_dumps, _orjson_loads)
+
+if ujson is not None:
+    def _ujson_dumps(value, ensure_ascii):
+        try:
+            return ujson.dumps(value, ensure_ascii=ensure_ascii,
+                               escape_forward_slashes=False)
+        except (TypeError, ValueError, OverflowError):
+            return _json_dumps(value, ensure_ascii)
+
+    def _ujson_loads(data):
+        try:
+            return ujson.loads(data)
+        except ValueError:
+            return json.loads(data)
+
+    json_codecs['ujson'] = JSONCodec('ujson', _ujson_dumps, _ujson_loads)
+
+# the fastest codec installed
+json_codecs['auto'] = next(
+    json_codecs[name] for name in ('orjson', 'ujson', 'json')
+    if name in json_codecs)
+
+
+class RawJSON:
+    """JSON text loaded from the database, decoded on first access"""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class _LazyJSONAccessor(pw.FieldAccessor):
+    def __get__(self, instance, instance_type=None):
+        if instance is None:
+            return self.field
+        value = instance.__data__.get(self.name)
+        if isinstance(value, RawJSON):
+            value = instance.__data__[self.name] = \
+                self.field.python_value(value.data)
+        return value
 
 
 class JSONCharField(pw.CharField):
-    def __init__(self, ensure_ascii=True, *args, **kwargs):
+    # values can be changed in place, so Model.save() always writes them
+    # once they are decoded
+    mutable = True
+
+    def __init__(self, ensure_ascii=True, *args, codec=None, lazy=False,
+                 **kwargs):
+        """
+        codec: name in `json_codecs` or a `JSONCodec` to encode values,
+            default to stdlib json, which keeps the stored text (and
+            equality lookups on it) unchanged. values are always decoded
+            by the fastest codec installed
+        lazy: keep the text of loaded rows until the attribute is read
+        """
         self.ensure_ascii = ensure_ascii
+        if isinstance(codec, str):
+            codec = json_codecs[codec]
+        self.codec = codec or json_codecs['json']
+        self._loads = (codec or json_codecs['auto']).loads
+        self.lazy = lazy
+        if lazy:
+            self.accessor_class = _LazyJSONAccessor
         super(JSONCharField, self).__init__(*args, **kwargs)
 
     def db_value(self, value):
         if value is None:
             return value
-        data = json.dumps(value, ensure_ascii=self.ensure_ascii)
-        if len(data) > self.max_length:
+        if isinstance(value, RawJSON):  # never read, write back as is
+            return value.data
+        data = self.codec.dumps(value, self.ensure_ascii)
+        if isinstance(data, bytes):
+            # UTF-8 is never shorter than the text, count chars if over
+            text = data.decode()
+            too_long = len(data) > self.max_length \
+                and len(text) > self.max_length
+            data = text
+        else:
+            too_long = len(data) > self.max_length
+        if too_long:
             raise ValueError('Data too long for field {}.'.format(self.name))
         return data
 
     def python_value(self, value):
         if value is None:
             return value
-        return json.loads(value)
+        return self._loads(value)
+
+    def lazy_value(self, value):
+        """converter of model rows, see `ModelSelect`"""
+        if value is None:
+            return value
+        return RawJSON(value)
+
+
+class Compressor:
+    """
+    `compress(data, level)` and `decompress(buffer)`, `decompress` takes
+    any bytes-like object. `tag` is the header byte of stored payloads
+    """
+
+    def __init__(self, name, tag, compress, decompress, level=None):
+        self.name = name
+        self.tag = tag
+        self.compress = compress
+        self.decompress = decompress
+        self.level = level
+
+
+_RAW = 0  # header byte of payloads stored uncompressed
+
+compressors = {'zlib': Compressor('zlib', 1, zlib.compress, zlib.decompress,
+                                  level=6)}
+
+if lz4 is not None:
+    def _lz4_compress(data, level):
+        return lz4.frame.compress(data, compression_level=level)
+
+    compressors['lz4'] = Compressor(
+        'lz4', 2, _lz4_compress, lz4.frame.decompress, level=0)
+
+_compressor_tags = {c.tag: c for c in compressors.values()}
+
+
+class RawCompressed:
+    """payload loaded from the database, decompressed on first access"""
+    __slots__ = ('data',)
+
+    def __init__(self, data):
+        self.data = data
+
+
+class _LazyCompressedAccessor(pw.FieldAccessor):
+    def __get__(self, instance, instance_type=None):
+        if instance is None:
+            return self.field
+        value = instance.__data__.get(self.name)
+        if isinstance(value, RawCompressed):
+            value = instance.__data__[self.name] = \
+                self.field.python_value(value.data)
+        return value
+
+
+class CompressedBlobField(pw.BlobField):
+    """
+    bytes stored behind a one byte header, values of at least `threshold`
+    bytes are compressed when that makes them smaller. rows written by
+    any compressor are readable whatever the field is configured with
+    """
+
+    def __init__(self, compression='zlib', threshold=1024, level=None,
+                 lazy=True, *args, **kwargs):
+        """
+        compression: name in `compressors` ('zlib', or 'lz4' when the lz4
+            package is installed) or a `Compressor`
+        threshold: compress values of at least this many bytes
+        level: compression level, default to the compressor's
+        lazy: keep the payload of loaded rows until the attribute is read
+        """
+        if isinstance(compression, str):
+            try:
+                compression = compressors[compression]
+            except KeyError:
+                raise ValueError(
+                    'Unknown compression {!r}.'.format(compression))
+        self.compressor = compression
+        self.threshold = threshold
+        self.level = compression.level if level is None else level
+        self.lazy = lazy
+        if lazy:
+            self.accessor_class = _LazyCompressedAccessor
+        super(CompressedBlobField, self).__init__(*args, **kwargs)
+
+    def encode(self, value):
+        """the value to store as bytes"""
+        if isinstance(value, str):
+            value = value.encode('raw_unicode_escape')
+        return value
+
+    def decode(self, data):
+        """the value from a bytes-like object, `memoryview` if not copied"""
+        return bytes(data)
+
+    def compress(self, data):
+        """bytes to store, a header byte followed by the payload"""
+        compressor = self.compressor
+        if len(data) >= self.threshold:
+            payload = compressor.compress(data, self.level)
+            if len(payload) + 1 < len(data):
+                return bytes((compressor.tag,)) + payload
+        return b'\x00' + data
+
+    def decompress(self, value):
+        """the stored payload without copying it when uncompressed"""
+        view = memoryview(value)
+        tag = view[0]
+        if tag == _RAW:
+            return view[1:]
+        try:
+            compressor = _compressor_tags[tag]
+        except KeyError:
+            raise ValueError('Unknown compression tag {} in field {}.'.format(
+                tag, self.name))
+        return compressor.decompress(view[1:])
+
+    def db_value(self, value):
+        if value is None:
+            return value
+        if isinstance(value, RawCompressed):  # never read, write back as is
+            value = value.data
+        else:
+            value = self.compress(self.encode(value))
+        return self._constructor(value)
+
+    def python_value(self, value):
+        if value is None:
+            return value
+        return self.decode(self.decompress(value))
+
+    def lazy_value(self, value):
+        """converter of model rows, see `ModelSelect`"""
+        if value is None:
+            return value
+        return RawCompressed(value)
+
+
+class CompressedJSONField(CompressedBlobField):
+    """`JSONCharField` values stored as a `CompressedBlobField`"""
+    # values can be changed in place, so Model.save() always writes them
+    # once they are decoded
+    mutable = True
+
+    def __init__(self, compression='zlib', threshold=1024, level=None,
+                 lazy=True, *args, codec=None, **kwargs):
+        """
+        codec: name in `json_codecs` or a `JSONCodec` to encode values,
+            default to the fastest codec installed, the stored text is
+            never compared. values are always decoded by the fastest one
+        """
+        if isinstance(codec, str):
+            codec = json_codecs[codec]
+        self.codec = codec or json_codecs['auto']
+        self._loads = json_codecs['auto'].loads
+        super(CompressedJSONField, self).__init__(
+            compression, threshold, level, lazy, *args, **kwargs)
+
+    def encode(self, value):
+        data = self.codec.dumps(value, False)
+        if isinstance(data, str):
+            data = data.encode()
+        return data
+
+    def decode(self, data):
+        if orjson is None and isinstance(data, memoryview):
+            data = data.tobytes()  # only orjson reads buffers
+        return self._loads(data)
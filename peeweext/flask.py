@@ -1,7 +1,11 @@
+from flask import request
 from werkzeug.local import LocalProxy
 from werkzeug.utils import import_string, cached_property
-from playhouse import db_url
-from .otel import otel_instrument
+from .cache import QueryCache
+from .instrument import QueryRecorder, StatsMixin, query_stats
+from .otel import database_mixins, otel_instrument
+from .pool import PoolMixin, connect, get_pool_params
+from .replica import PrimaryMixin, ReplicaRouter
 
 
 class UninitializedException(Exception):
@@ -12,6 +16,9 @@ class Peeweext:
     def __init__(self, ns='PW_'):
         self.ns = ns
         self._database = None
+        self.query_cache = QueryCache()
+        self.router = ReplicaRouter()
+        self.recorder = QueryRecorder()
         # make a connection pool proxy
         self.database = LocalProxy(self._get_db)
 
@@ -20,10 +27,38 @@ class Peeweext:
         self.model_class = import_string(
             config.get('model', 'peeweext.model.Model'))
         conn_params = config.get('conn_params', {})
+        # connect on the first query instead of before every request
+        self.lazy_connect = config.get('lazy_connect', False)
+        if self.lazy_connect:
+            conn_params = dict(conn_params, autoconnect=True)
 
+        self.query_cache.configure(
+            max_size=config.get('query_cache_max_size', 0),
+            ttl=config.get('query_cache_ttl'),
+            max_memory=config.get('query_cache_max_memory'))
         otel_instrument(app)
         # initialize private connection pool
-        self._database = db_url.connect(config['db_url'], **conn_params)
+        pool_params = get_pool_params(config)
+        replica_urls = config.get('replica_urls', [])
+        # record the queries of each request, call or task
+        self.query_stats = config.get('query_stats', False)
+        self.stats_header = config.get('query_stats_header')
+        mixins = database_mixins(app)
+        if self.query_stats:
+            mixins += (StatsMixin,)
+        self._database = connect(
+            config['db_url'], pool_params,
+            mixins=mixins + (PrimaryMixin,) if replica_urls else mixins,
+            **conn_params)
+        replicas = [connect(url, pool_params, mixins=mixins, **conn_params)
+                    for url in replica_urls]
+        self.router.configure(
+            self._database, replicas,
+            strategy=config.get('replica_strategy', 'round_robin'),
+            sticky_seconds=config.get('replica_sticky_seconds', 0))
+        self.recorder.configure(
+            [self._database, *replicas],
+            threshold=config.get('n_plus_one_threshold', 0))
 
         self._register_handlers(app)
 
@@ -37,25 +72,61 @@ class Peeweext:
         class BaseModel(self.model_class):
             class Meta:
                 database = LocalProxy(self._get_db)
+                query_cache = self.query_cache
+                replica_router = self.router
 
         return BaseModel
 
+    def pool_stats(self):
+        """Pool size, in-use count and checkout time, None if not pooled"""
+        database = self._get_db()
+        if isinstance(database, PoolMixin):
+            return database.pool_stats()
+
     def connect_db(self):
         if self.database.is_closed():
             self.database.connect()
 
     def close_db(self, exc):
+        # pooled databases return the connection to the pool
         if not self.database.is_closed():
             self.database.close()
+        self.router.close()
+
+    def start_stats(self, name=None):
+        self.recorder.start(name or request.endpoint or request.path)
+
+    def add_stats_header(self, response):
+        stats = self.recorder.current()
+        if stats is not None and self.stats_header:
+            response.headers.add(self.stats_header, stats.server_timing())
+        return response
+
+    def finish_stats(self, exc=None):
+        stats = self.recorder.finish()
+        if stats is not None:
+            query_stats.send(self, stats=stats)
 
     def _register_handlers(self, app):
-        app.before_request(self.connect_db)
+        if not self.lazy_connect:
+            app.before_request(self.connect_db)
         app.teardown_request(self.close_db)
+        if self.query_stats:
+            app.before_request(self.start_stats)
+            app.after_request(self.add_stats_header)
+            app.teardown_request(self.finish_stats)
         try:
             from celery.signals import task_prerun, task_postrun
-            task_prerun.connect(
-                lambda *arg, **kw: self.connect_db(), weak=False)
+            if not self.lazy_connect:
+                task_prerun.connect(
+                    lambda *arg, **kw: self.connect_db(), weak=False)
             task_postrun.connect(
                 lambda *arg, **kw: self.close_db(None), weak=False)
+            if self.query_stats:
+                task_prerun.connect(
+                    lambda *arg, task=None, **kw: self.start_stats(task.name),
+                    weak=False)
+                task_postrun.connect(
+                    lambda *arg, **kw: self.finish_stats(), weak=False)
         except ImportError:
             pass
@@ -0,0 +1,137 @@
+"""Query count, time and repeated statements of each request"""
+import collections
+import contextlib
+import contextvars
+import logging
+import re
+import time
+
+from blinker import signal
+
+logger = logging.getLogger('peeweext')
+
+# sent by the extensions at the end of each request, gRPC call or Celery
+# task with the collected stats: (sender, stats)
+query_stats = signal('query_stats')
+
+_LITERALS = re.compile(
+    r"'(?:[^']|'')*'|\$\d+|%s|\?|\b\d+(?:\.\d+)?\b")
+_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_ROWS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_SPACES = re.compile(r'\s+')
+
+_fingerprints = {}  # {sql: fingerprint}
+_FINGERPRINTS_LIMIT = 1024
+
+
+def fingerprint(sql):
+    """Normalize `sql` so the same statement with other parameters,
+    `IN` lists or `VALUES` rows of other lengths compares equal.
+    """
+    result = _fingerprints.get(sql)
+    if result is None:
+        result = _LITERALS.sub('?', sql)
+        result = _LISTS.sub('(...)', result)
+        result = _ROWS.sub('(...)', result)
+        result = _SPACES.sub(' ', result).strip()
+        if len(_fingerprints) >= _FINGERPRINTS_LIMIT:
+            _fingerprints.clear()
+        _fingerprints[sql] = result
+    return result
+
+
+class QueryStats:
+    """Queries of one request, gRPC call or Celery task"""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.count = 0
+        self.duration = 0.0
+        # as reported by the driver, SQLite doesn't count SELECT rows
+        self.rows = 0
+        self.statements = collections.Counter()  # {fingerprint: count}
+
+    def record(self, sql, duration, rows):
+        self.count += 1
+        self.duration += duration
+        if rows > 0:
+            self.rows += rows
+        self.statements[fingerprint(sql)] += 1
+
+    def repeated(self, threshold=1):
+        """Statements run more than `threshold` times"""
+        return {sql: count for sql, count in self.statements.items()
+                if count > threshold}
+
+    def server_timing(self):
+        return 'db;dur={:.3f};desc="{} queries, {} rows"'.format(
+            self.duration * 1000, self.count, self.rows)
+
+    def __repr__(self):
+        return '<QueryStats {}: {} queries, {:.3f}ms, {} rows>'.format(
+            self.name, self.count, self.duration * 1000, self.rows)
+
+
+class StatsMixin:
+    """Record the queries of a database to its recorder"""
+    recorder = None
+
+    def execute_sql(self, sql, params=None, commit=None):
+        stats = self.recorder.current() if self.recorder else None
+        if stats is None:
+            return super().execute_sql(sql, params, commit)
+        start = time.perf_counter()
+        try:
+            cursor = super().execute_sql(sql, params, commit)
+        except Exception:
+            stats.record(sql, time.perf_counter() - start, 0)
+            raise
+        stats.record(sql, time.perf_counter() - start, cursor.rowcount)
+        return cursor
+
+
+class QueryRecorder:
+    """Collect the queries of the databases it is configured with.
+
+    Queries are only recorded between `start()` and `finish()` of the
+    same thread or task. `finish()` logs the statements run more than
+    `threshold` times as possible N+1 queries, 0 disables it.
+    """
+
+    def __init__(self):
+        self._stats = contextvars.ContextVar('peeweext_stats', default=None)
+        self.configure(())
+
+    def configure(self, databases, threshold=0):
+        self.threshold = threshold
+        for database in databases:
+            if isinstance(database, StatsMixin):
+                database.recorder = self
+
+    def current(self):
+        return self._stats.get()
+
+    def start(self, name=None):
+        stats = QueryStats(name)
+        self._stats.set(stats)
+        return stats
+
+    def finish(self):
+        stats = self._stats.get()
+        if stats is None:
+            return None
+        self._stats.set(None)
+        if self.threshold:
+            for sql, count in stats.repeated(self.threshold).items():
+                logger.warning('Possible N+1 query in %s, run %d times: %s',
+                               stats.name, count, sql)
+        return stats
+
+    @contextlib.contextmanager
+    def collect(self, name=None):
+        """Collect the queries of a block, outside of the extensions"""
+        token = self._stats.set(QueryStats(name))
+        try:
+            yield self._stats.get()
+        finally:
+            self._stats.reset(token)
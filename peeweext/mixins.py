@@ -1,16 +1,163 @@
-from peewee import fn, SQL
+import functools
+import random
+import sqlite3
+import threading
+import time
 
-from .model import pre_save
+import peewee as pw
+from peewee import Case, fn, PostgresqlDatabase, SqliteDatabase
 
+from .signals import pre_save_batch
 
-def _gen_sequence(sender, instance, created):
-    if issubclass(sender, SequenceMixin) and created:
-        model = sender
-        max_id_obj = model.select(model.id).order_by(-model.id).first()
-        instance.sequence = max_id_obj.id + 1 if max_id_obj else 1.0
 
+class SequenceCounter(pw.Model):
+    """
+    counter rows of `SequenceAllocator`, one per table,
+    create it along with the tables using `SequenceMixin`
+    """
+    name = pw.CharField(max_length=64, primary_key=True)
+    value = pw.BigIntegerField()
+
+    class Meta:
+        table_name = 'peeweext_sequence'
 
-pre_save.connect(_gen_sequence)
+
+class SequenceAllocator:
+    """
+    hi/lo allocator: a process reserves blocks of `block_size` values from
+    the counter row of a table, then hands them out from memory, so
+    concurrent writers get distinct values without a lookup per insert.
+
+    inside a transaction only the values needed are reserved, they are
+    rolled back together with the rows using them, but the counter row
+    stays locked until the transaction ends, so writers of the table
+    reserving in transactions wait for each other. without the counter
+    table every insert looks up the largest id and sequence instead
+
+    values are unique, but each process appends from its own block, so
+    rows of different processes interleave by block, not by insert time.
+    `block_size=1` keeps the insert order at one counter UPDATE per insert
+    """
+
+    def __init__(self, block_size=100):
+        self.block_size = block_size
+        self._blocks = {}  # {model: (next value, end of block)}
+        self._counters = {}  # {database: whether it has the counter table}
+        self._lock = threading.Lock()
+
+    def allocate(self, model, count=1):
+        with self._lock:
+            start, end = self._blocks.get(model, (0, 0))
+            taken = min(count, end - start)
+            self._blocks[model] = (start + taken, end)
+        values = list(range(start, start + taken))
+        missing = count - taken
+        if not missing:
+            return values
+
+        if not self._has_counter(model._meta.database):
+            first = _max_key(model) + 1
+        elif model._meta.database.in_transaction():
+            first = self._reserve(model, missing)
+        else:
+            size = max(missing, self.block_size)
+            first = self._reserve(model, size)
+            with self._lock:
+                self._blocks[model] = (first + missing, first + size)
+        values.extend(range(first, first + missing))
+        return values
+
+    def reserve(self, model, count):
+        """
+        first of `count` consecutive values, none of them handed out by
+        any process before
+        """
+        if not self._has_counter(model._meta.database):
+            return _max_key(model) + 1
+        first = self._reserve(model, count)
+        with self._lock:
+            # the held block is below the range now, appends go after it
+            self._blocks.pop(model, None)
+        return first
+
+    def advance(self, model, value):
+        """
+        hand out values above `value` only, a sequence written without
+        the allocator
+        """
+        value = int(value)
+        with self._lock:
+            start, end = self._blocks.get(model, (0, 0))
+            if start <= value:
+                self._blocks[model] = (min(value + 1, end), end)
+        if value >= end and self._has_counter(model._meta.database):
+            SequenceCounter.update(value=value).where(
+                (SequenceCounter.name == model._meta.table_name)
+                & (SequenceCounter.value < value)
+            ).execute(model._meta.database)
+
+    def clear(self):
+        """
+        forget the held blocks and whether databases have the counter
+        table, call it after creating the table
+        """
+        with self._lock:
+            self._blocks.clear()
+            self._counters.clear()
+
+    def _has_counter(self, database):
+        found = self._counters.get(database)
+        if found is None:
+            found = database.table_exists(SequenceCounter._meta.table_name)
+            self._counters[database] = found
+        return found
+
+    @staticmethod
+    def _reserve(model, size):
+        """
+        bump the counter of the table by `size`, return the first value
+        """
+        database = model._meta.database
+        name = model._meta.table_name
+        counter = SequenceCounter.name == name
+        bump = SequenceCounter.update(value=SequenceCounter.value + size) \
+            .where(counter)
+        with database.atomic():
+            # the UPDATE comes first, so the row lock is taken right away
+            if not bump.execute(database):
+                # start above the existing rows
+                SequenceCounter.insert(name=name, value=_max_key(model)) \
+                    .on_conflict_ignore().execute(database)
+                bump.execute(database)
+            value = SequenceCounter.select(SequenceCounter.value) \
+                .where(counter).scalar(database)
+        return value - size + 1
+
+
+def _max_key(model):
+    """largest id or sequence of the table"""
+    max_id, max_sequence = model.select(
+        fn.MAX(model.id), fn.MAX(model.sequence)
+    ).scalar(as_tuple=True)
+    return int(max(max_id or 0, max_sequence or 0))
+
+
+def _gen_sequence(sender, instances, created):
+    """
+    append new rows with values of `__seq_allocator__`,
+    rows with a sequence already set are kept in place
+    """
+    if not created:
+        return
+    allocator = sender.__seq_allocator__
+    preset = [ins.sequence for ins in instances if ins.sequence is not None]
+    if preset:
+        allocator.advance(sender, max(preset))
+    instances = [ins for ins in instances if ins.sequence is None]
+    if instances:
+        values = allocator.allocate(sender, len(instances))
+        for instance, value in zip(instances, values):
+            instance.sequence = float(value)
 
 
 class SequenceMixin:
@@ -25,6 +172,15 @@ class SequenceMixin:
     sequence = pw.DoubleField()
     """
     __seq_scope_field_name__ = None
+    # rows per UPDATE ... CASE when renumbering without UPDATE ... FROM
+    __seq_batch_size__ = 300
+    # sequences of new rows, shared by all models unless overridden
+    __seq_allocator__ = SequenceAllocator()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # connect per model, so models without sequence skip pre_save
+        pre_save_batch.connect(_gen_sequence, sender=cls)
 
     def _sequence_query(self):
         """
@@ -41,54 +197,100 @@ class SequenceMixin:
                 query = query.where(seq_scope_field == seq_scope_field_value)
         return query
 
+    def _neighbour_sequence(self, anchor, after):
+        """
+        sequence of the closest row before/after `anchor` by keyset lookup
+        on (sequence, id), so rows of equal sequences are not skipped
+        """
+        klass = self.__class__
+        query = self._sequence_query().where(klass.id != self.id)
+        if after:
+            query = query.where(
+                (klass.sequence > anchor.sequence)
+                | ((klass.sequence == anchor.sequence)
+                   & (klass.id > anchor.id))) \
+                .order_by(+klass.sequence, +klass.id)
+        else:
+            query = query.where(
+                (klass.sequence < anchor.sequence)
+                | ((klass.sequence == anchor.sequence)
+                   & (klass.id < anchor.id))) \
+                .order_by(-klass.sequence, -klass.id)
+        return query.select(klass.sequence).limit(1).scalar()
+
     def _loosen(self):
-        collection = self._sequence_query().order_by(+self.__class__.sequence)
-        for index, instance in enumerate(collection):
-            instance.sequence = float(index + 1)
-            instance.save()
+        """
+        renumber the scope to consecutive values of the allocator, so none
+        collides with values other processes still hold, by set-based
+        updates. rows are not saved one by one, so no validation or signals
+        """
+        klass = self.__class__
+        database = self._meta.database
+        base = self.__seq_allocator__.reserve(
+            klass, self._sequence_query().count()) - 1
+        if isinstance(database, PostgresqlDatabase) or (
+                isinstance(database, SqliteDatabase)
+                and sqlite3.sqlite_version_info >= (3, 33, 0)):
+            # one UPDATE ... FROM ranked rows
+            rank = fn.ROW_NUMBER().over(order_by=[klass.sequence, klass.id])
+            ranked = self._sequence_query() \
+                .select(klass.id, rank.alias('rank')).alias('ranked')
+            klass.update(sequence=ranked.c.rank + base).from_(ranked) \
+                .where(klass.id == ranked.c.id).execute()
+            self.sequence = float(klass.select(klass.sequence)
+                                  .where(klass.id == self.id).scalar())
+        else:
+            ids = [pk for pk, in self._sequence_query().select(klass.id)
+                   .order_by(+klass.sequence, +klass.id).tuples()]
+            batch_size = self.__seq_batch_size__
+            for start in range(0, len(ids), batch_size):
+                batch = ids[start:start + batch_size]
+                case = Case(klass.id, [
+                    (pk, float(base + start + index + 1))
+                    for index, pk in enumerate(batch)])
+                klass.update(sequence=case) \
+                    .where(klass.id.in_(batch)).execute()
+            self.sequence = float(base + ids.index(self.id) + 1)
+        self._dirty.discard('sequence')
 
     def _change_sequence(self, new_sequence):
         with self._meta.database.atomic():
             klass = self.__class__
-            current_sequence = self._sequence_query().where(
-                klass.sequence <= self.sequence).select(
-                fn.COUNT(SQL('*'))).scalar()
-            if current_sequence == new_sequence:
+            # the row at the target position, then its neighbour by keyset
+            anchor = self._sequence_query() \
+                .select(klass.id, klass.sequence) \
+                .order_by(+klass.sequence, +klass.id) \
+                .offset(new_sequence - 1).first()
+            if anchor is None:
+                raise ValueError("Sequence is not proper")
+            if anchor.id == self.id:
                 return
-            if new_sequence > 1:
-                instances = self._sequence_query() \
-                    .order_by(+klass.sequence)
-                # frontwards
-                if current_sequence > new_sequence:
-                    start = new_sequence - 2
-                    end = new_sequence
-                # backwards
-                else:
-                    start = new_sequence - 1
-                    end = new_sequence + 1
-                instances = instances[start:end]
-                if not len(instances):
-                    raise ValueError("Sequence is not proper")
-
-                if len(instances) == 1:
-                    prev_seq = instances[0].sequence
-                    next_seq = prev_seq + 1
-                else:
-                    prev_ins, next_ins = instances
-                    prev_seq = prev_ins.sequence
-                    next_seq = next_ins.sequence
+            # backwards
+            if (anchor.sequence, anchor.id) > (self.sequence, self.id):
+                prev_seq = anchor.sequence
+                next_seq = self._neighbour_sequence(anchor, after=True)
+                if next_seq is None:  # to the end, above the last row
+                    allocator = self.__seq_allocator__
+                    allocator.advance(klass, prev_seq)
+                    self.sequence = float(allocator.allocate(klass)[0])
+                    self.save()
+                    return
+            # frontwards
             else:
-                prev_seq = 0
-                next_seq = self._sequence_query() \
-                    .order_by(+klass.sequence).first().sequence
-
-            self.sequence = (prev_seq + next_seq) / 2
-            self.save()
+                next_seq = anchor.sequence
+                prev_seq = self._neighbour_sequence(anchor, after=False)
+                if prev_seq is None:
+                    prev_seq = 0
 
             # Sequence auto loosen
-            # regenerate all sequence when precision lost
+            # no room left between the neighbours, e.g. equal sequences:
+            # regenerate all sequence and look them up again
             if abs(prev_seq - next_seq) < 0.000001:
                 self._loosen()
+                return self._change_sequence(new_sequence)
+
+            self.sequence = (prev_seq + next_seq) / 2
+            self.save()
 
     def change_sequence(self, new_sequence):
         """
@@ -103,3 +305,201 @@ class SequenceMixin:
         if new_sequence < 1:
             raise ValueError("Sequence is not proper")  # pragma no cover
         self._change_sequence(new_sequence)
+
+    def _sequence_gap(self, position, exclude=()):
+        """
+        (prev, next) sequences around `position` of the scope, rows in
+        `exclude` (ids) are left out, next is None at the end. one query
+        """
+        if position < 1:
+            raise ValueError("Sequence is not proper")
+        klass = self.__class__
+        query = self._sequence_query().select(klass.sequence) \
+            .order_by(+klass.sequence, +klass.id)
+        if exclude:
+            query = query.where(klass.id.not_in(list(exclude)))
+        if position == 1:
+            keys = [seq for seq, in query.limit(1).tuples()]
+            return 0, keys[0] if keys else None
+        keys = [seq for seq, in query.offset(position - 2).limit(2).tuples()]
+        if not keys:
+            raise ValueError("Sequence is not proper")
+        if len(keys) == 1:  # append
+            return keys[0], None
+        return keys[0], keys[1]
+
+    @classmethod
+    def _place(cls, instances, position, exclude=()):
+        """
+        set evenly spaced sequences to put `instances` at `position`,
+        return whether the scope needs `_loosen` afterwards
+        """
+        prev_seq, next_seq = instances[0]._sequence_gap(position, exclude)
+        if next_seq is None:
+            # appended, with values of the allocator above the last row
+            cls.__seq_allocator__.advance(cls, prev_seq)
+            values = cls.__seq_allocator__.allocate(cls, len(instances))
+            for instance, value in zip(instances, values):
+                instance.sequence = float(value)
+            return False
+        step = (next_seq - prev_seq) / (len(instances) + 1)
+        for index, instance in enumerate(instances, 1):
+            instance.sequence = prev_seq + step * index
+        return step < 0.000001
+
+    @classmethod
+    def _loosen_many(cls, instances):
+        instances[0]._loosen()
+        sequences = dict(cls.select(cls.id, cls.sequence).where(
+            cls.id.in_([ins.id for ins in instances])).tuples())
+        for instance in instances:
+            instance.sequence = sequences[instance.id]
+            instance._dirty.discard('sequence')
+
+    @classmethod
+    def move_many(cls, instances, to_position):
+        """
+        :param instances: 同一排序范围内要移动的对象
+        :param to_position: 第一个对象要排到第几个
+
+        移动后 instances 按给定的顺序连续排列，所有新的 sequence
+        一次算出，并用一条 UPDATE 语句写入
+        """
+        if not instances:
+            return
+        with cls._meta.database.atomic():
+            loosen = cls._place(
+                instances, to_position, exclude=[ins.id for ins in instances])
+            cls.bulk_update(instances, [cls.sequence])
+            if loosen:
+                cls._loosen_many(instances)
+
+    @classmethod
+    def insert_many_at(cls, position, rows):
+        """
+        :param position: 第一行要排到第几个
+        :param rows: 同一排序范围内的 Model 实例或属性 dict，同 bulk_create
+
+        新行按给定的顺序连续排列，用一条 INSERT 语句写入，返回创建的实例
+        """
+        instances = [
+            row if isinstance(row, cls) else cls(**cls._filter_attrs(row))
+            for row in rows]
+        if not instances:
+            return instances
+        with cls._meta.database.atomic():
+            loosen = cls._place(instances, position)
+            cls.bulk_create(instances)
+            if loosen:
+                cls._loosen_many(instances)
+        return instances
+
+
+class VersionConflict(Exception):
+    """the row was changed by someone else since it was loaded"""
+
+
+class VersionedMixin:
+    """
+    Optimistic locking, put it before the model base class:
+
+    class Account(VersionedMixin, pwdb.Model):
+        balance = pw.IntegerField()
+
+    a `version` column (`__version_field__`) is added unless declared,
+    `save()` updates with `WHERE id = ? AND version = ?` and bumps it,
+    raising `VersionConflict` when the row has another version
+    """
+    __version_field__ = 'version'
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # peewee collects the fields of the class after this hook
+        if cls.__version_field__ not in cls.__dict__:
+            setattr(cls, cls.__version_field__, pw.IntegerField(default=1))
+
+    def _pk_expr(self):
+        expr = super()._pk_expr()
+        expected = getattr(self, '_expected_version', None)
+        if expected is not None:
+            field = self._meta.fields[self.__version_field__]
+            expr &= (field == expected)
+        return expr
+
+    def _save_row(self, *args, **kwargs):
+        state = self._bump_version(kwargs)
+        if state is None:
+            return super()._save_row(*args, **kwargs)
+        try:
+            rows = super()._save_row(*args, **kwargs)
+        except BaseException:
+            self._restore_version(state)
+            raise
+        return self._check_version(state, rows)
+
+    async def _aio_save_row(self, **kwargs):
+        """`_save_row` of `aio.AioModel.aio_save`"""
+        state = self._bump_version(kwargs)
+        if state is None:
+            return await super()._aio_save_row(**kwargs)
+        try:
+            rows = await super()._aio_save_row(**kwargs)
+        except BaseException:
+            self._restore_version(state)
+            raise
+        return self._check_version(state, rows)
+
+    def _bump_version(self, kwargs):
+        """
+        set the next version before an UPDATE, return the expected one and
+        the dirty fields to restore, None when the row is inserted
+        """
+        name = self.__version_field__
+        expected = getattr(self, name)
+        if kwargs.get('force_insert') or self._pk is None or expected is None:
+            return None
+        if kwargs.get('only') is not None:
+            kwargs['only'] = list(kwargs['only']) + [name]
+        dirty = set(self._dirty)
+        setattr(self, name, expected + 1)
+        self._expected_version = expected
+        return expected, dirty
+
+    def _restore_version(self, state):
+        setattr(self, self.__version_field__, state[0])
+        self._expected_version = None
+
+    def _check_version(self, state, rows):
+        expected, dirty = state
+        self._expected_version = None
+        if not rows:
+            # as before the save, nothing was written
+            setattr(self, self.__version_field__, expected)
+            self._dirty = dirty
+            raise VersionConflict(
+                '{} {} is not at version {}.'.format(
+                    type(self).__name__, self._pk, expected))
+        return rows
+
+
+def retry_on_conflict(retries=3, backoff=0.05, max_backoff=1.0):
+    """
+    decorator, call the function again after `VersionConflict`, at most
+    `retries` more times. it waits `backoff` seconds, doubled after every
+    conflict up to `max_backoff`, with full jitter so the writers spread
+    out. the function has to load the rows it changes, outside of a
+    transaction that would read the same snapshot again
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(retries + 1):
+                try:
+                    return func(*args, **kwargs)
+                except VersionConflict:
+                    if attempt == retries:
+                        raise
+                time.sleep(random.uniform(
+                    0, min(max_backoff, backoff * 2 ** attempt)))
+        return wrapper
+    return decorator
@@ -1,24 +1,52 @@
+import base64
+import datetime
+import decimal
+import functools
 import inspect
+import json
+import operator
 
 import peewee as pw
 import pendulum
-from blinker import signal
+from playhouse.pool import PooledDatabase
 
+from . import signals
+from .cache import evict_row, evict_rows
+from .signals import (
+    pre_save, post_save, pre_delete, post_delete, pre_init,
+    pre_delete_batch, post_delete_batch)
 from .validation import ValidationError
-from .fields import DatetimeTZField
+from .fields import DatetimeTZField, RawCompressed, RawJSON
 
-pre_save = signal('pre_save')
-post_save = signal('post_save')
-pre_delete = signal('pre_delete')
-post_delete = signal('post_delete')
-pre_init = signal('pre_init')
+# `otel.ModelTelemetry` once `otel.install()` turned it on
+telemetry = None
+
+
+def _traced(operation):
+    """Report the method as `operation` to the model telemetry"""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if telemetry is None:
+                return method(self, *args, **kwargs)
+            with telemetry.operation(self, operation):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _timed(phase, model, func, *args, **kwargs):
+    """Call `func`, timed as `phase` of the current model operation"""
+    if telemetry is None:
+        return func(*args, **kwargs)
+    return telemetry.timed(phase, model, func, *args, **kwargs)
 
 
 class ModelMeta(pw.ModelBase):
     """Model meta class, provide validation."""
 
     def __init__(cls, name, bases, attrs):
-        """Store validator."""
+        """Store validator and compile the validation plan."""
         super().__init__(name, bases, attrs)
         setattr(cls, '_validators', {})  # {'field_name': `callable`}
         # add validator by model`s validation method
@@ -27,22 +55,716 @@ class ModelMeta(pw.ModelBase):
                 fn = k[9:]  # 9 = len('validate_')
                 if fn in cls._meta.combined:
                     cls._validators[fn] = v
+        # (('field_name', (value validators...), method), ...)
+        cls._validation_plan = tuple(
+            (fn, *_unwrap_validator(v)) for fn, v in cls._validators.items())
+        cls._validation_plans = {}  # {tuple(only): subset of the plan}
+        cls._lite_row_classes = {}  # {columns: `LiteRow` subclass}
+        # names `_filter_attrs` lets through, see `Model.__attr_whitelist__`
+        cls._assignable = _assignable_names(cls)
+        # fields changed in place without assignment, always saved
+        cls._mutable_fields = frozenset(
+            name for name, field in cls._meta.fields.items()
+            if getattr(field, 'mutable', False))
+        if cls._meta.refs:  # new backrefs, see `_dependency_graph`
+            _dependency_graphs.clear()
+        # Meta.row_cache, see `cache.RowCache`
+        if getattr(cls._meta, 'row_cache', None) is not None:
+            post_save.connect(evict_row, sender=cls)
+            post_delete.connect(evict_row, sender=cls)
+            post_delete_batch.connect(evict_rows, sender=cls)
+
+    def _get_validation_plan(cls, only):
+        key = tuple(only)
+        try:
+            return cls._validation_plans[key]
+        except KeyError:
+            pass
+        names = {f if isinstance(f, pw.basestring) else f.name for f in only}
+        plan = tuple(
+            step for step in cls._validation_plan if step[0] in names)
+        # dirty fields of wide tables may come in many combinations
+        if len(cls._validation_plans) < 256:
+            cls._validation_plans[key] = plan
+        return plan
+
+
+def _assignable_names(model):
+    """fields and foreign key ids open to mass assignment"""
+    names = set(model._meta.fields)
+    names.update(fk.object_id_name for fk in model._meta.refs
+                 if fk.object_id_name)
+    accessible = set(model.__attr_accessible__)
+    protected = set(model.__attr_protected__)
+    if model.__attr_whitelist__:
+        return frozenset(names & (accessible - protected))
+    return frozenset(names - (protected - accessible))
+
+
+def _unwrap_validator(method):
+    """
+    split methods decorated by `validation.validates` into their validators
+    and the undecorated method, so they run without the wrapper closures
+    """
+    validators = []
+    # `functools.wraps` of other decorators copies `__validators__` too
+    while getattr(method, '__validates__', None) is method:
+        validators.extend(method.__validators__)
+        method = method.__wrapped__
+    return tuple(validators), method
+
+
+def _bulk_converters(wrapper):
+    """
+    take the converters of fields with `python_values` out of an
+    initialized cursor wrapper, return [(column index, python_values)]
+    """
+    bulk = []
+    for index, converter in enumerate(wrapper.converters):
+        field = getattr(converter, '__self__', None)
+        if isinstance(field, pw.Field) and hasattr(field, 'python_values') \
+                and converter == field.python_value:
+            bulk.append((index, field.python_values))
+            wrapper.converters[index] = None
+    return bulk
+
+
+def _convert_rows(rows, bulk):
+    if not bulk:
+        return rows
+    rows = [list(row) for row in rows]
+    for index, python_values in bulk:
+        column = python_values([row[index] for row in rows])
+        for row, value in zip(rows, column):
+            row[index] = value
+    return rows
+
+
+def _process_chunks(wrapper, chunk_size):
+    cursor = wrapper.cursor
+    wrapper.initialize()
+    bulk = _bulk_converters(wrapper)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            break
+        for row in _convert_rows(rows, bulk):
+            yield wrapper.process_row(row)
+
+
+def _iter_rows(wrapper, chunk_size):
+    try:
+        yield from _process_chunks(wrapper, chunk_size)
+    finally:
+        wrapper.cursor.close()
+
+
+def _supports_server_side(database):
+    return isinstance(database, (pw.MySQLDatabase, pw.PostgresqlDatabase))
+
+
+def _stream_server_side(query, database, chunk_size):
+    """
+    rows from an unbuffered (MySQL) or named (Postgres) cursor on a
+    connection of its own, the connection of the current request or task
+    stays free for other queries
+    """
+    postgres = isinstance(database, pw.PostgresqlDatabase)
+    conn = database._connect()  # checked out of the pool if pooled
+    completed = False
+    try:
+        database._initialize_connection(conn)
+        if postgres:
+            conn.autocommit = False  # named cursors live in a transaction
+            cursor = conn.cursor(name='peeweext_stream')
+            cursor.itersize = chunk_size
+        else:
+            cursor = conn.cursor(pw.mysql.cursors.SSCursor)
+        sql, params = database.get_sql_context().sql(query).query()
+        cursor.execute(sql, params)
+        yield from _process_chunks(query._get_cursor_wrapper(cursor),
+                                   chunk_size)
+        cursor.close()
+        if postgres:
+            conn.rollback()
+            conn.autocommit = True
+        completed = True
+    finally:
+        # an unfinished stream leaves unread rows on the connection,
+        # closing it is cheaper than draining them
+        if isinstance(database, PooledDatabase):
+            database._close(conn, close_conn=not completed)
+        else:
+            database._close(conn)
+
+
+def _stream_keyset(query, database, chunk_size):
+    """rows `chunk_size` at a time, in primary key order"""
+    pk = query.model._meta.primary_key
+    if isinstance(pk, pw.CompositeKey) or query._order_by \
+            or query._limit is not None or query._offset is not None:
+        raise ValueError(
+            'keyset streaming needs a single primary key to order by, '
+            'without order_by, limit or offset.')
+    try:
+        index = next(index for index, node in enumerate(query._returning)
+                     if node is pk)
+    except StopIteration:
+        raise ValueError('keyset streaming needs the primary key selected.')
+    return _keyset_pages(query, database, chunk_size, pk, index)
+
+
+def _keyset_pages(query, database, chunk_size, pk, index):
+    page = query.order_by(pk).limit(chunk_size)
+    while True:
+        cursor = database.execute(page)
+        try:
+            rows = cursor.fetchall()
+            wrapper = page._get_cursor_wrapper(cursor)
+            wrapper.initialize()
+            bulk = _bulk_converters(wrapper)
+        finally:
+            cursor.close()
+        if not rows:
+            break
+        last = rows[-1][index]
+        for row in _convert_rows(rows, bulk):
+            yield wrapper.process_row(row)
+        if len(rows) < chunk_size:
+            break
+        page = query.where(pk > last).order_by(pk).limit(chunk_size)
+
+
+class _ModelObjectCursorWrapper(pw.ModelObjectCursorWrapper):
+    """leave values of lazy fields (`lazy_value`) undecoded until read"""
+
+    def initialize(self):
+        super().initialize()
+        for index, field in enumerate(self.fields):
+            if getattr(field, 'lazy', False) \
+                    and self.converters[index] == field.python_value:
+                self.converters[index] = field.lazy_value
+
+
+ROW_LITE = 'lite'  # row type of `ModelSelect.lite()`, next to peewee's ROW
+
+
+class LiteRow(tuple):
+    """
+    read-only row of `ModelSelect.lite()`, a tuple whose columns are also
+    attributes, `_fields` are the column names
+    """
+    __slots__ = ()
+    _fields = ()
+    _model = None
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def __repr__(self):
+        return '<{} lite {}>'.format(self._model.__name__, ', '.join(
+            '{}={!r}'.format(name, value)
+            for name, value in zip(self._fields, self)))
+
+    def __reduce__(self):
+        return tuple, (tuple(self),)
+
+
+def _lite_row_class(model, columns):
+    key = tuple(columns)
+    try:
+        return model._lite_row_classes[key]
+    except KeyError:
+        pass
+    attrs = {'__slots__': (), '_fields': key, '_model': model}
+    for index, name in enumerate(columns):
+        attrs.setdefault(name, property(operator.itemgetter(index)))
+    row_class = type(model.__name__ + 'LiteRow', (LiteRow,), attrs)
+    if len(model._lite_row_classes) < 256:
+        model._lite_row_classes[key] = row_class
+    return row_class
+
+
+class _LiteCursorWrapper(pw.ModelTupleCursorWrapper):
+    def initialize(self):
+        super().initialize()
+        self.constructor = _lite_row_class(self.model, self.columns)
+        self._convert = None
+
+    def process_row(self, row):
+        # converters are collected on the first row, `ModelSelect.iterator`
+        # takes some of them out after `initialize`
+        convert = self._convert
+        if convert is None:
+            convert = self._convert = [
+                (index, converter)
+                for index, converter in enumerate(self.converters)
+                if converter is not None]
+        if convert:
+            row = list(row)
+            for index, converter in convert:
+                row[index] = converter(row[index])
+        return tuple.__new__(self.constructor, row)
+
+
+class ModelSelect(pw.ModelSelect):
+    _cached = False
+    _cache_ttl = None
+
+    @pw.Node.copy
+    def lite(self):
+        """
+        read-only rows for large reads, `LiteRow` tuples with the selected
+        columns as attributes. values are converted by the fields, but no
+        model instance is built, so there is no pre_init signal, lazy
+        decoding, dirty tracking or `save()`
+        """
+        self._row_type = ROW_LITE
+
+    @pw.Node.copy
+    def cached(self, ttl=None):
+        """
+        serve results from Meta.query_cache, see `cache.QueryCache`
+        ttl: seconds, default to the ttl of the query cache
+        """
+        self._cached = True
+        self._cache_ttl = ttl
+
+    def iterator(self, database=None, chunk_size=1000):
+        """
+        iterate without caching the rows, they are fetched and converted
+        `chunk_size` at a time. fields with `python_values`, such as
+        `DatetimeTZField`, convert a whole column of a chunk in one call
+        """
+        clone = self.clone()
+        clone._cursor_wrapper = None
+        return _iter_rows(clone.execute(database), chunk_size)
+
+    def _get_cursor_wrapper(self, cursor):
+        if self._row_type == ROW_LITE:
+            return _LiteCursorWrapper(cursor, self.model, self._returning)
+        return super()._get_cursor_wrapper(cursor)
+
+    def _get_model_cursor_wrapper(self, cursor):
+        if len(self._from_list) == 1 and not self._joins:
+            return _ModelObjectCursorWrapper(
+                cursor, self.model, self._returning, self.model)
+        return super()._get_model_cursor_wrapper(cursor)
+
+    def _execute(self, database):
+        router = getattr(self.model._meta, 'replica_router', None)
+        if self._for_update and router is not None \
+                and database in router.replicas:
+            database = router.primary
+        query_cache = getattr(self.model._meta, 'query_cache', None)
+        if self._cursor_wrapper is None and self._cached \
+                and query_cache is not None and query_cache.enabled:
+            cursor = query_cache.cursor(self, database, self._cache_ttl)
+            self._cursor_wrapper = self._get_cursor_wrapper(cursor)
+        return super()._execute(database)
+
+
+_dependency_graphs = {}  # {(model, delete_nullable): (deleted, nullified)}
+
+
+def _dependency_graph(model, delete_nullable):
+    """
+    the models losing rows along with `model` rows, parents first, each
+    with the foreign keys to deleted rows: ((model, (fk, ...)), ...), and
+    the nullable foreign keys set to NULL instead. cached until a model
+    with foreign keys is declared
+    """
+    key = (model, delete_nullable)
+    try:
+        return _dependency_graphs[key]
+    except KeyError:
+        pass
+    incoming, nullified = {model: []}, []
+    stack = [model]
+    while stack:
+        klass = stack.pop()
+        for fk, rel_model in klass._meta.backrefs.items():
+            if fk.null and not delete_nullable:
+                nullified.append(fk)
+                continue
+            if rel_model not in incoming:
+                incoming[rel_model] = []
+                stack.append(rel_model)
+            incoming[rel_model].append(fk)
+    deleted = tuple(
+        (klass, tuple(incoming[klass]))
+        for klass in pw.sort_models(incoming))
+    graph = _dependency_graphs[key] = (deleted, tuple(nullified))
+    return graph
+
+
+def _parent_keys(fk, selections):
+    """values of `fk.rel_field` in the rows deleted from `fk.rel_model`"""
+    parent = fk.rel_model
+    selection = selections[parent]
+    pk = parent._meta.primary_key
+    if fk.rel_field is not pk:
+        return parent.select(fk.rel_field).where(pk << selection)
+    if fk.model is parent and isinstance(selection, pw.SelectQuery):
+        # MySQL cannot read a table it deletes from, but a derived table
+        derived = selection.alias('peeweext_keys')
+        return pw.Select([derived], [getattr(derived.c, pk.column_name)])
+    return selection
+
+
+def _cascade_plan(model, pks, delete_nullable):
+    """
+    {model: condition} of the rows deleted along with `pks`, children
+    first, and [(model, fk, condition)] of the foreign keys set to NULL.
+    a model referencing itself loses the rows referencing its deleted
+    rows, one level deep
+    """
+    deleted, nullified = _dependency_graph(model, delete_nullable)
+    selections = {model: pks}  # primary keys of the deleted rows
+    conditions = {}
+    for klass, fks in deleted:
+        pk = klass._meta.primary_key
+        if klass is model:
+            where = [pk << pks]
+        else:
+            where = [fk << _parent_keys(fk, selections) for fk in fks
+                     if fk.rel_model is not klass
+                     and fk.rel_model in selections]
+            if not where:  # only reachable through a cycle
+                continue
+            selections[klass] = klass.select(pk).where(
+                functools.reduce(operator.or_, where))
+        where += [fk << _parent_keys(fk, selections) for fk in fks
+                  if fk.rel_model is klass]
+        condition = functools.reduce(operator.or_, where)
+        if klass is not model:
+            selections[klass] = klass.select(pk).where(condition)
+        conditions[klass] = condition
+    nullify = [(fk.model, fk, fk << _parent_keys(fk, selections))
+               for fk in nullified if fk.rel_model in selections]
+    return dict(reversed(list(conditions.items()))), nullify
+
+
+def _has_batch_receivers(model):
+    return signals.has_receivers(pre_delete_batch, model) \
+        or signals.has_receivers(post_delete_batch, model)
+
+
+def _invalidate_query_cache(model):
+    query_cache = getattr(model._meta, 'query_cache', None)
+    if query_cache is not None and query_cache.enabled:
+        query_cache.invalidate(model._meta.table_name)
+
+
+def _delete_rows(model, pks, recursive, delete_nullable, instances=None):
+    """
+    delete the rows of `pks`, and with `recursive` the rows depending on
+    them, by one statement per model. the rows given in `instances` get
+    pre_delete/post_delete and their batch signals; the other rows are
+    only reported by pre_delete_batch/post_delete_batch with `pks` and
+    `instances=None`, once per model, and their keys are only selected for
+    models with receivers of these. return the rows deleted from `model`
+    """
+    if recursive:
+        conditions, nullify = _cascade_plan(model, pks, delete_nullable)
+    else:
+        conditions, nullify = {model: model._meta.primary_key << pks}, []
+
+    deleted_pks = {}  # {model: primary keys}
+    for klass, condition in conditions.items():
+        if klass is model and instances is not None:
+            _timed('signals', klass,
+                   signals.send_many, pre_delete, klass, instances)
+        elif _has_batch_receivers(klass):
+            if klass is model:
+                deleted_pks[klass] = list(pks)
+            else:
+                query = klass.select(klass._meta.primary_key) \
+                    .where(condition)
+                deleted_pks[klass] = [value for value, in query.tuples()]
+    for klass, klass_pks in deleted_pks.items():
+        _timed('signals', klass,
+               pre_delete_batch.send, klass, instances=None, pks=klass_pks)
+
+    for klass, fk, condition in nullify:
+        klass.update({fk: None}).where(condition).execute()
+    rows = 0
+    for klass, condition in conditions.items():
+        count = klass.delete().where(condition).execute()
+        if klass is model:
+            rows = count
+        _invalidate_query_cache(klass)
+    for klass, _, _ in nullify:
+        _invalidate_query_cache(klass)
+
+    if instances is not None:
+        _timed('signals', model,
+               signals.send_many, post_delete, model, instances)
+    for klass, klass_pks in deleted_pks.items():
+        _timed('signals', klass,
+               post_delete_batch.send, klass, instances=None, pks=klass_pks)
+    return rows
+
+
+class Page(list):
+    """
+    rows of `Model.paginate_after`, `next_cursor` is the token of the
+    following page, None on the last one
+    """
+
+    def __init__(self, rows, next_cursor):
+        super().__init__(rows)
+        self.next_cursor = next_cursor
+
+
+def _seek_keys(model, order_by):
+    """
+    [(field, descending)] of an ordering, ended by the primary key so rows
+    are never tied
+    """
+    pk = model._meta.primary_key
+    if isinstance(pk, pw.CompositeKey):
+        raise ValueError('keyset pagination needs a single primary key.')
+    keys = []
+    for node in order_by or (pk,):
+        descending = False
+        if isinstance(node, pw.Ordering):
+            descending = node.direction.upper() == 'DESC'
+            node = node.node
+        if not isinstance(node, pw.Field) or node.model is not model:
+            raise ValueError(
+                'keyset pagination orders by fields of {}.'.format(
+                    model.__name__))
+        keys.append((node, descending))
+    if all(field is not pk for field, _ in keys):
+        keys.append((pk, keys[-1][1]))
+    return keys
+
+
+def _seek_signature(keys):
+    return ['-' + f.name if descending else f.name for f, descending in keys]
+
+
+def _seek_ordering(keys):
+    # NULL sorts as the smallest value on every database
+    return [
+        pw.Ordering(field, 'DESC' if descending else 'ASC',
+                    nulls=(('last' if descending else 'first')
+                           if field.null else None))
+        for field, descending in keys]
+
+
+def _seek_after(field, descending, value):
+    """rows strictly after `value` on one key, None if there are none"""
+    if value is None:
+        return None if descending else field.is_null(False)
+    if descending:
+        after = field < value
+        return (after | field.is_null()) if field.null else after
+    return field > value
+
+
+def _seek_predicate(keys, values):
+    """
+    (a, b) > (x, y) as a row value comparison when it can, otherwise
+    a > x OR (a = x AND b > y), with the directions and NULLs of the keys
+    """
+    if len(keys) > 1 and len({d for _, d in keys}) == 1 \
+            and None not in values \
+            and not any(field.null for field, _ in keys):
+        columns = pw.Tuple(*(field for field, _ in keys))
+        row = pw.Tuple(*(pw.Value(value, converter=field.db_value)
+                         for (field, _), value in zip(keys, values)))
+        return columns < row if keys[0][1] else columns > row
+    terms = []
+    for index, ((field, descending), value) in enumerate(zip(keys, values)):
+        after = _seek_after(field, descending, value)
+        if after is not None:
+            terms.append(functools.reduce(operator.and_, [
+                f.is_null() if v is None else f == v
+                for (f, _), v in zip(keys[:index], values)] + [after]))
+    if not terms:
+        return None
+    return functools.reduce(operator.or_, terms)
+
+
+def _encode_seek_value(value):
+    if isinstance(value, datetime.datetime):  # keeps the utc offset
+        return {'dt': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'d': value.isoformat()}
+    if isinstance(value, decimal.Decimal):
+        return {'dec': str(value)}
+    if isinstance(value, bytes):
+        return {'b': base64.b64encode(value).decode()}
+    if isinstance(value, (str, int, float, type(None))):
+        return value
+    return str(value)  # e.g. UUID
+
+
+def _decode_seek_value(value):
+    if isinstance(value, dict):
+        (kind, data), = value.items()
+        if kind == 'dt':
+            return datetime.datetime.fromisoformat(data)
+        if kind == 'd':
+            return datetime.date.fromisoformat(data)
+        if kind == 'dec':
+            return decimal.Decimal(data)
+        if kind == 'b':
+            return base64.b64decode(data)
+        raise ValueError(kind)
+    return value
+
+
+def _encode_cursor(keys, values):
+    data = json.dumps([_seek_signature(keys),
+                       [_encode_seek_value(v) for v in values]],
+                      separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode()).rstrip(b'=').decode()
+
+
+def _decode_cursor(keys, token):
+    """values of a token, ValueError if it is invalid or of another order"""
+    try:
+        data = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        signature, values = json.loads(data)
+        values = [_decode_seek_value(v) for v in values]
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid pagination cursor.') from e
+    if signature != _seek_signature(keys) or len(values) != len(keys):
+        raise ValueError('Pagination cursor of another ordering.')
+    return values
+
+
+class MassAssignmentError(ValidationError):
+    """keys rejected by a strict mass assignment filter, in `keys`"""
+
+    def __init__(self, keys):
+        self.keys = keys
+        super().__init__('Attributes not assignable: {}.'.format(
+            ', '.join(keys)))
 
 
 class Model(pw.Model, metaclass=ModelMeta):
+    _select_class = ModelSelect
+
     created_at = DatetimeTZField(default=pendulum.now)
     updated_at = DatetimeTZField(default=pendulum.now)
 
+    class Meta:
+        # save() only writes fields changed since the row was loaded
+        only_save_dirty = True
+
     __attr_whitelist__ = False
     __attr_accessible__ = set()
     __attr_protected__ = set()
+    # raise `MassAssignmentError` instead of dropping keys
+    __attr_strict__ = False
 
     def __init__(self, *args, **kwargs):
-        pre_init.send(type(self), instance=self)
+        signals.send(pre_init, type(self), self)
         self._validate_errors = {}  # eg: {'field_name': 'error information'}
         super().__init__(*args, **kwargs)
         self.delete = self._delete
 
+    @classmethod
+    def select(cls, *fields):
+        is_default = not fields
+        if not fields:
+            fields = cls._meta.sorted_fields
+        query = cls._select_class(cls, fields, is_default=is_default)
+        # Meta.replica_router, see `replica.ReplicaRouter`
+        router = getattr(cls._meta, 'replica_router', None)
+        if router is not None:
+            read_database = router.read_database()
+            if read_database is not None:
+                query = query.bind(read_database)
+        return query
+
+    @classmethod
+    def get(cls, *query, **filters):
+        """
+        served by Meta.row_cache when looking up the primary key only
+        """
+        if getattr(cls._meta, 'row_cache', None) is not None:
+            if len(query) == 1 and not filters \
+                    and isinstance(query[0], int):
+                return cls.get_by_id(query[0])
+            pk_name = cls._meta.primary_key.name
+            if not query and len(filters) == 1 and pk_name in filters:
+                return cls.get_by_id(filters[pk_name])
+        return super().get(*query, **filters)
+
+    @classmethod
+    def stream(cls, query=None, chunk_size=1000, server_side=None):
+        """
+        yield the rows of a select query with constant memory, as models,
+        dicts or whatever the query returns. MySQL and Postgres stream
+        from a server-side cursor on a connection of their own, checked
+        out for the life of the generator. other databases, or
+        `server_side=False`, read the primary key ordered pages of
+        `chunk_size` rows on the current connection
+        query: default to `cls.select()`
+        server_side: default to True when supported and not in a
+            transaction, the new connection would not see its changes
+        """
+        if query is None:
+            query = cls.select()
+        database = query._database or cls._meta.database
+        if server_side is None:
+            server_side = _supports_server_side(database) \
+                and not database.in_transaction()
+        elif server_side and not _supports_server_side(database):
+            raise ValueError(
+                'server-side cursors need MySQL or Postgres.')
+        if server_side:
+            return _stream_server_side(query, database, chunk_size)
+        return _stream_keyset(query, database, chunk_size)
+
+    @classmethod
+    def paginate_after(cls, cursor=None, order_by=None, limit=20,
+                       query=None):
+        """
+        a `Page` of rows after the `cursor` token of the previous page,
+        every page costs the same, however deep, with an index on the
+        ordering. tokens are opaque but not signed
+        order_by: fields, `field.desc()` for descending, default to the
+            primary key, which always ends the ordering to break ties.
+            NULL sorts first in ascending and last in descending order
+        query: a select of this model to page through, default to
+            `cls.select()`, without ordering, limit or offset
+        """
+        if query is None:
+            query = cls.select()
+        keys = _seek_keys(cls, order_by)
+        if cursor is not None:
+            predicate = _seek_predicate(keys, _decode_cursor(keys, cursor))
+            if predicate is None:
+                return Page([], None)
+            query = query.where(predicate)
+        rows = list(query.order_by(*_seek_ordering(keys)).limit(limit + 1))
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            last = rows[-1]
+            next_cursor = _encode_cursor(keys, [
+                last[f.name] if isinstance(last, dict)
+                else getattr(last, f.name) for f, _ in keys])
+        return Page(rows, next_cursor)
+
+    @classmethod
+    def get_by_id(cls, pk):
+        row_cache = getattr(cls._meta, 'row_cache', None)
+        # rows read in a transaction may be uncommitted, never cache them
+        if row_cache is None or cls._meta.database.in_transaction():
+            return super().get_by_id(pk)
+        instance = row_cache.get(cls, pk)
+        if instance is None:
+            instance = super().get(cls._meta.primary_key == pk)
+            row_cache.set(instance)
+        return instance
+
     @classmethod
     def create(cls, **query):
         """
@@ -68,48 +790,413 @@ class Model(pw.Model, metaclass=ModelMeta):
         else:
             only attr not in __attr_protected__ OR in __attr_accessible__
             will pass
+        and only fields (or foreign key ids) of the model pass, the names
+        are computed once per class by `ModelMeta`. with __attr_strict__
+        dropping any key raises `MassAssignmentError`
+        """
+        assignable = cls._assignable
+        if assignable.issuperset(attrs):  # nothing to drop, `attrs` itself
+            return attrs
+        dropped = attrs.keys() - assignable
+        if cls.__attr_strict__:
+            raise MassAssignmentError(sorted(dropped))
+        attrs = dict(attrs)
+        for key in dropped:
+            del attrs[key]
+        return attrs
+
+    @classmethod
+    def bulk_create(cls, model_list, batch_size=None, skip_validation=False):
+        """
+        secure bulk create, mass assignment protected
+
+        model_list: model instances or dicts of attributes, dicts are
+            filtered by `_filter_attrs` like `create`
+        every row is validated before anything is written, then each batch
+        is stamped with one `updated_at`, signals are sent around a single
+        multi-row INSERT. return the list of saved instances
+        """
+        instances = [
+            row if isinstance(row, cls) else cls(**cls._filter_attrs(row))
+            for row in model_list]
+        if not skip_validation:
+            cls._bulk_validate(instances)
+
+        with cls._meta.database.atomic():
+            for batch in cls._batches(instances, batch_size):
+                cls._insert_batch(batch)
+        return instances
+
+    @classmethod
+    def upsert(cls, *, conflict_target=None, **attrs):
         """
-        if cls.__attr_whitelist__:
-            whitelist = cls.__attr_accessible__ - cls.__attr_protected__
-            return {k: v for k, v in attrs.items() if k in whitelist}
+        insert a row, or update the row it conflicts with, in one
+        statement, see `upsert_many`. return (instance, created)
+        """
+        return cls.upsert_many([attrs], conflict_target)[0]
+
+    @classmethod
+    def upsert_many(cls, rows, conflict_target=None, batch_size=None,
+                    skip_validation=False):
+        """
+        insert rows, or update the rows they conflict with, by
+        INSERT ... ON CONFLICT (Postgres, SQLite) or ON DUPLICATE KEY
+        UPDATE (MySQL). on conflict the given attributes and `updated_at`
+        are written, `created_at` is kept
+
+        rows: dicts of attributes, filtered by `_filter_attrs` and
+            validated like `bulk_create`
+        conflict_target: fields of the unique key, default to the primary
+            key, or the first unique field or index given in the rows
+        return [(instance, created)], `created` is also sent with
+        post_save. pre_save gets created=None, it is unknown until written
+        """
+        groups = {}  # {columns: [(position, instance)]}
+        for position, row in enumerate(rows):
+            row = cls._filter_attrs(row)
+            groups.setdefault(frozenset(row), []).append(
+                (position, cls(**row)))
+        if not skip_validation:
+            for group in groups.values():
+                cls._bulk_validate([instance for _, instance in group])
+
+        results = [None] * len(rows)
+        with cls._meta.database.atomic():
+            for names, group in groups.items():
+                target = cls._conflict_fields(conflict_target, names)
+                for batch in cls._batches(group, batch_size):
+                    instances = [instance for _, instance in batch]
+                    created = cls._upsert_batch(instances, names, target)
+                    for (position, instance), flag in zip(batch, created):
+                        results[position] = (instance, flag)
+        return results
+
+    @classmethod
+    def _conflict_fields(cls, conflict_target, names):
+        meta = cls._meta
+        if conflict_target:
+            fields = [meta.fields[f] if isinstance(f, pw.basestring) else f
+                      for f in conflict_target]
         else:
-            blacklist = cls.__attr_protected__ - cls.__attr_accessible__
-            return {k: v for k, v in attrs.items() if k not in blacklist}
+            candidates = [(meta.primary_key,)]
+            candidates += [(f,) for f in meta.sorted_fields if f.unique]
+            candidates += [
+                tuple(meta.fields[name] for name in index_names)
+                for index_names, unique in meta.indexes
+                if unique and all(isinstance(n, pw.basestring)
+                                  for n in index_names)]
+            fields = next((list(key) for key in candidates
+                           if all(f.name in names for f in key)), None)
+            if fields is None:
+                raise ValueError(
+                    'upsert needs the fields of a unique key, '
+                    'or a conflict_target.')
+        if any(f.name not in names for f in fields):
+            raise ValueError('upsert rows miss their conflict_target.')
+        return fields
 
-    def save(self, *args, **kwargs):
-        skip_validation = kwargs.pop('skip_validation', False)
+    @classmethod
+    def _upsert_batch(cls, batch, names, target):
+        """
+        one INSERT ... ON CONFLICT for rows with attributes `names`,
+        return whether each row was created: told by `xmax` on Postgres,
+        elsewhere by the keys stored before, selected in the transaction
+        of `upsert_many` (locked by FOR UPDATE on MySQL)
+        """
+        meta = cls._meta
+        database = meta.database
+        pk = meta.primary_key
+        fields = [
+            field for field in meta.sorted_fields
+            if not (meta.auto_increment and field is pk
+                    and pk.name not in names)]
+        target_names = {field.name for field in target}
+        preserve = [
+            field for field in meta.sorted_fields
+            if field.name in names and field.name not in target_names
+            and field is not pk and field.name != 'created_at']
+        if 'updated_at' not in names:
+            preserve.append(cls.updated_at)
+
+        keys = [tuple(getattr(ins, f.name) for f in target) for ins in batch]
+        if len(target) == 1:
+            where = target[0] << [key[0] for key in keys]
+        else:
+            where = pw.Tuple(*target) << [
+                pw.Tuple(*(pw.Value(v, converter=f.db_value)
+                           for f, v in zip(target, key)))
+                for key in keys]
+        postgres = isinstance(database, pw.PostgresqlDatabase)
+        mysql = isinstance(database, pw.MySQLDatabase)
+        if not postgres:
+            query = cls.select(*target).where(where)
+            if mysql:  # the keys and their gaps stay locked until commit
+                query = query.for_update()
+            existing = set(query.tuples())
+
+        now = pendulum.now()
+        for instance in batch:
+            if 'created_at' not in names:
+                instance.created_at = now
+            instance.updated_at = now
+        signals.send_many(pre_save, cls, batch, created=None)
+
+        query = cls.insert_many(
+            [[ins.__data__.get(f.name) for f in fields] for ins in batch],
+            fields=fields)
+        if mysql:
+            query = query.on_conflict(preserve=preserve)
+        else:
+            query = query.on_conflict(conflict_target=target,
+                                      preserve=preserve)
+        columns = [pk, cls.created_at, *target]
+        if postgres:
+            # xmax is 0 for the rows inserted by the statement
+            stored = query.returning(
+                *columns, pw.SQL('(xmax = 0)')).tuples().execute()
+            stored = {tuple(row[2:-1]): (row[0], row[1], row[-1])
+                      for row in stored}
+        else:
+            if database.returning_clause:
+                stored = list(query.returning(*columns).tuples().execute())
+            else:
+                query.execute()
+                stored = list(cls.select(*columns).where(where).tuples())
+            stored = {
+                tuple(row[2:]): (*row[:2], tuple(row[2:]) not in existing)
+                for row in stored}
+
+        created = []
+        for instance, key in zip(batch, keys):
+            try:
+                pk_value, created_at, is_created = stored[key]
+            except KeyError:
+                # MySQL updated the row of another unique key
+                raise ValueError(
+                    'upsert of {!r} conflicted on a unique key other than '
+                    'its conflict_target.'.format(dict(zip(
+                        (f.name for f in target), key)))) from None
+            instance._pk = pk_value
+            if not is_created:
+                instance.created_at = created_at
+            instance._dirty.clear()
+            created.append(is_created)
+        for flag in (True, False):
+            instances = [ins for ins, c in zip(batch, created) if c is flag]
+            if instances:
+                signals.send_many(post_save, cls, instances, created=flag)
+        return created
+
+    @classmethod
+    def bulk_update(cls, model_list, fields, batch_size=None,
+                    skip_validation=False):
+        """
+        update `fields` of saved instances with one UPDATE ... CASE
+        statement per batch, `updated_at` is always written
+        return the number of updated rows
+        """
+        fields = [
+            cls._meta.fields[f] if isinstance(f, pw.basestring) else f
+            for f in fields]
+        if 'updated_at' not in {field.name for field in fields}:
+            fields.append(cls.updated_at)
         if not skip_validation:
-            errors = self._validate(only=kwargs.get("only"))
+            cls._bulk_validate(model_list, only=fields)
+
+        rows = 0
+        with cls._meta.database.atomic():
+            for batch in cls._batches(model_list, batch_size):
+                now = pendulum.now()
+                for instance in batch:
+                    instance.updated_at = now
+                signals.send_many(pre_save, cls, batch, created=False)
+                rows += super().bulk_update(batch, fields)
+                names = {field.name for field in fields}
+                for instance in batch:
+                    instance._dirty -= names
+                signals.send_many(post_save, cls, batch, created=False)
+        return rows
+
+    @classmethod
+    def bulk_save(cls, model_list, batch_size=None, skip_validation=False):
+        """
+        bulk version of `save`, unsaved instances are inserted by
+        `bulk_create`, the changed ones are updated by `bulk_update`
+        """
+        created = [ins for ins in model_list if not bool(ins._pk)]
+        updated = [ins for ins in model_list if bool(ins._pk)]
+        if cls._meta.only_save_dirty:
+            # one statement per batch, so write the union of changed fields
+            updated = [ins for ins in updated if ins.is_dirty()]
+            names = set().union(*(ins._dirty_names() for ins in updated))
+        else:
+            names = set(cls._meta.fields)
+
+        with cls._meta.database.atomic():
+            if created:
+                cls.bulk_create(created, batch_size, skip_validation)
+            if updated:
+                names.discard(cls._meta.primary_key.name)
+                fields = [
+                    f for f in cls._meta.sorted_fields if f.name in names]
+                cls.bulk_update(updated, fields, batch_size, skip_validation)
+
+    @staticmethod
+    def _batches(model_list, batch_size):
+        if batch_size is None:
+            return [model_list]
+        return pw.chunked(model_list, batch_size)
+
+    @classmethod
+    def _bulk_validate(cls, model_list, only=None):
+        for instance in model_list:
+            errors = instance._validate(only=only)
             if errors:
                 raise ValidationError(str(errors))
 
+    @classmethod
+    def _insert_batch(cls, batch):
+        meta = cls._meta
+        fields = [
+            field for field in meta.sorted_fields
+            if not (meta.auto_increment and field is meta.primary_key)]
+
+        now = pendulum.now()
+        for instance in batch:
+            instance.updated_at = now
+        signals.send_many(pre_save, cls, batch, created=True)
+
+        rows = [[ins.__data__.get(f.name) for f in fields] for ins in batch]
+        res = cls.insert_many(rows, fields=fields).execute()
+        if meta.auto_increment and res is not None:
+            cls._fill_bulk_pks(batch, res)
+
+        for instance in batch:
+            instance._dirty.clear()
+        signals.send_many(post_save, cls, batch, created=True)
+
+    @classmethod
+    def _fill_bulk_pks(cls, batch, res):
+        """
+        set auto increment primary keys after a multi-row INSERT:
+        RETURNING rows when the backend supports it, otherwise the ids are
+        consecutive and the cursor gives the first (MySQL) or last (SQLite)
+        """
+        database = cls._meta.database
+        if database.returning_clause:
+            for row, instance in zip(res, batch):
+                instance._pk = row[0]
+            return
+        if isinstance(database, pw.MySQLDatabase):
+            first_id = res
+        else:
+            first_id = res - len(batch) + 1
+        for index, instance in enumerate(batch):
+            instance._pk = first_id + index
+
+    def _dirty_names(self):
+        data = self.__data__
+        # None and values still undecoded (`fields.RawJSON`,
+        # `fields.RawCompressed`) cannot have been changed in place
+        return self._dirty | {
+            name for name in self._mutable_fields & data.keys()
+            if data[name] is not None
+            and not isinstance(data[name], (RawJSON, RawCompressed))}
+
+    @property
+    def dirty_fields(self):
+        names = self._dirty_names()
+        return [f for f in self._meta.sorted_fields if f.name in names]
+
+    def is_dirty(self):
+        return bool(self._dirty_names())
+
+    @_traced('save')
+    def save(self, *args, **kwargs):
+        model = type(self)
+        created = self._prepare_save(kwargs)
+        if created is None:
+            return False
+        _timed('signals', model,
+               signals.send, pre_save, model, self, created=created)
+        ret = self._save_row(*args, **kwargs)
+        _timed('signals', model,
+               signals.send, post_save, model, self, created=created)
+        return ret
+
+    def _save_row(self, *args, **kwargs):
+        """write the row with peewee's save, see `mixins.VersionedMixin`"""
+        return super().save(*args, **kwargs)
+
+    def _prepare_save(self, kwargs):
+        """
+        validate and stamp `updated_at`, `kwargs` of `save` are normalized
+        in place. return whether the row is created, None if nothing changed
+        """
+        skip_validation = kwargs.pop('skip_validation', False)
         pk_value = self._pk
         created = kwargs.get('force_insert', False) or not bool(pk_value)
+        only = kwargs.get("only")
+        if not created and only is None and self._meta.only_save_dirty:
+            # nothing changed since loaded, skip the UPDATE
+            only = self.dirty_fields
+            if not only:
+                return None
+
+        if not skip_validation:
+            errors = _timed(
+                'validation', type(self), self._validate, only=only)
+            if errors:
+                raise ValidationError(str(errors))
+
         if not created and kwargs.get("only"):
             # update `updated_at` field implicitly when using the `only` option
-            kwargs["only"].append("updated_at")
-        pre_save.send(type(self), instance=self, created=created)
-        ret = super().save(*args, **kwargs)
-        post_save.send(type(self), instance=self, created=created)
-        return ret
+            kwargs["only"] = list(kwargs["only"]) + ["updated_at"]
+        self.updated_at = pendulum.now()
+        return created
 
+    @_traced('delete_instance')
     def delete_instance(self, *args, **kwargs):
         model = type(self)
-        pre_delete.send(model, instance=self)
         recursive = kwargs.get('recursive', False)
         delete_nullable = kwargs.get('delete_nullable', False)
         if recursive:
-            dependencies = self.dependencies(delete_nullable)
-            for query, fk in reversed(list(dependencies)):
-                fk_model = fk.model
-                if fk.null and not delete_nullable:
-                    fk_model.update(**{fk.name: None}).where(query).execute()
-                else:
-                    fk_model.delete().where(query).execute()
+            with model._meta.database.atomic():
+                return _delete_rows(
+                    model, [self._pk], True, delete_nullable, [self])
+        _timed('signals', model, signals.send, pre_delete, model, self)
         ret = model.delete().where(self._pk_expr()).execute()
-        post_delete.send(model, instance=self)
+        _timed('signals', model, signals.send, post_delete, model, self)
         return ret
 
+    @classmethod
+    def delete_many(cls, query=None, recursive=False, delete_nullable=False,
+                    batch_size=1000):
+        """
+        delete the rows of a select query or a where expression, default
+        to all rows. with `recursive` the rows referencing them are
+        deleted too, or their nullable foreign keys set to NULL unless
+        `delete_nullable`, by one set-based statement per foreign key.
+        the deleted rows are reported by pre_delete_batch/post_delete_batch
+        with `pks` and `instances=None`, once per model and batch
+        batch_size: rows per batch of primary keys, None for one batch
+        return the number of rows deleted
+        """
+        pk = cls._meta.primary_key
+        if query is None:
+            query = cls.select()
+        elif not isinstance(query, pw.SelectQuery):
+            query = cls.select().where(query)
+        with cls._meta.database.atomic():
+            pks = [value for value, in query.select(pk).tuples()]
+            if batch_size is None:
+                batches = [pks] if pks else []
+            else:
+                batches = pw.chunked(pks, batch_size)
+            return sum(
+                _delete_rows(cls, list(batch), recursive, delete_nullable)
+                for batch in batches)
+
     def _delete(self, *args, **kwargs):
         raise UserWarning(
             "Use delete() in instance is forbidden! Try to use "
@@ -119,35 +1206,22 @@ class Model(pw.Model, metaclass=ModelMeta):
     def _validate(self, only=None):
         """Validate model data and save errors
         """
-        errors = {}
-
         if only:
-            items = []
-            for field in only:
-                if isinstance(field, pw.basestring):
-                    name = field
-                else:
-                    name = field.name
-                validator = self._validators.get(name)
-                if validator:
-                    items.append((name, validator))
+            plan = type(self)._get_validation_plan(only)
         else:
-            items = self._validators.items()
+            plan = self._validation_plan
+        if not plan:
+            return {}
 
-        for name, validator in items:
+        errors = {}
+        for name, validators, method in plan:
             value = getattr(self, name)
 
             try:
-                validator(self, value)
+                for validator in validators:
+                    validator(value)
+                method(self, value)
             except ValidationError as e:
                 errors[name] = str(e)
 
         return errors
-
-
-def _touch_model(sender, instance, created):
-    if issubclass(sender, Model):
-        instance.updated_at = pendulum.now()
-
-
-pre_save.connect(_touch_model)
@@ -1,5 +1,14 @@
+import contextlib
+import contextvars
+import random
+import time
 from enum import Enum
+
 from opentelemetry import trace
+from opentelemetry.metrics import get_meter
+
+from . import model
+from .instrument import fingerprint
 
 mysql_connector = None
 
@@ -34,12 +43,184 @@ def sync_once(func):
     return wrapper
 
 
+# distinct statement fingerprints attached to one span
+MAX_FINGERPRINTS = 16
+
+
+class _Operation:
+    __slots__ = ('span', 'queries', 'query_time', 'phases', 'fingerprints')
+
+    def __init__(self, span):
+        self.span = span
+        self.queries = 0
+        self.query_time = 0.0
+        self.phases = {}
+        self.fingerprints = {}
+
+
+class ModelTelemetry:
+    """Spans of `save`/`delete_instance` with the time spent in queries,
+    validation and signals, and histograms of models and statements.
+
+    One span per model operation, not per query: statements are reported
+    as their fingerprints on the span, and their durations aggregated by
+    the `peeweext.query.duration` histogram. Only `sample_rate` of the
+    outermost operations are traced, never those below an unsampled span,
+    nested operations follow the outermost one. Histograms see every call.
+    """
+
+    def __init__(self, tracer_provider=None, meter_provider=None,
+                 spans=True, metrics=True, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.tracer = trace.get_tracer(
+            'peeweext', tracer_provider=tracer_provider) if spans else None
+        if metrics:
+            meter = get_meter('peeweext', meter_provider=meter_provider)
+            self.model_duration = meter.create_histogram(
+                'peeweext.model.duration', unit='s',
+                description='Duration of model operations and their phases')
+            self.query_duration = meter.create_histogram(
+                'peeweext.query.duration', unit='s',
+                description='Duration of statements by fingerprint')
+        else:
+            self.model_duration = self.query_duration = None
+        self._operation = contextvars.ContextVar(
+            'peeweext_operation', default=None)
+        self._sampled = contextvars.ContextVar(
+            'peeweext_sampled', default=None)
+
+    def _sample(self):
+        sampled = self._sampled.get()
+        if sampled is not None:
+            return sampled, None
+        parent = trace.get_current_span().get_span_context()
+        if parent.is_valid and not parent.trace_flags.sampled:
+            sampled = False
+        else:
+            sampled = random.random() < self.sample_rate
+        return sampled, self._sampled.set(sampled)
+
+    @contextlib.contextmanager
+    def operation(self, instance, name):
+        model_name = type(instance).__name__
+        attributes = {'peeweext.model': model_name, 'peeweext.operation': name}
+        sampled, token = self._sample() if self.tracer else (False, None)
+        start = time.perf_counter()
+        with self.tracer.start_as_current_span(
+                '{}.{}'.format(model_name, name), attributes=attributes) \
+                if sampled else contextlib.nullcontext() as span:
+            op = _Operation(span)
+            op_token = self._operation.set(op)
+            try:
+                yield
+            finally:
+                self._operation.reset(op_token)
+                if token is not None:
+                    self._sampled.reset(token)
+                if span is not None:
+                    self._finish_span(op)
+                if self.model_duration is not None:
+                    self._record_durations(
+                        op, attributes, time.perf_counter() - start)
+
+    @staticmethod
+    def _finish_span(op):
+        op.span.set_attributes({
+            'peeweext.queries': op.queries,
+            'peeweext.query_ms': op.query_time * 1000,
+            **{'peeweext.{}_ms'.format(phase): seconds * 1000
+               for phase, seconds in op.phases.items()},
+        })
+        if op.fingerprints:
+            op.span.set_attribute(
+                'db.statement.fingerprints', list(op.fingerprints))
+
+    def _record_durations(self, op, attributes, duration):
+        # phases are summed over the operation, one data point each
+        self.model_duration.record(duration, attributes)
+        for phase, seconds in op.phases.items():
+            self.model_duration.record(
+                seconds, dict(attributes, **{'peeweext.operation': phase}))
+
+    def timed(self, phase, model_class, func, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            op = self._operation.get()
+            if op is not None:
+                op.phases[phase] = op.phases.get(phase, 0) + elapsed
+            elif self.model_duration is not None:
+                self.model_duration.record(
+                    elapsed, {'peeweext.model': model_class.__name__,
+                              'peeweext.operation': phase})
+
+    def record_query(self, sql, duration):
+        op = self._operation.get()
+        if op is None and self.query_duration is None:
+            return
+        statement = fingerprint(sql)
+        if op is not None:
+            op.queries += 1
+            op.query_time += duration
+            if op.span is not None \
+                    and len(op.fingerprints) < MAX_FINGERPRINTS:
+                op.fingerprints[statement] = None
+        if self.query_duration is not None:
+            self.query_duration.record(
+                duration, {'db.statement.fingerprint': statement})
+
+
+class TelemetryMixin:
+    """Report the statements of a database to the model telemetry"""
+
+    def execute_sql(self, sql, params=None, commit=None):
+        telemetry = model.telemetry
+        if telemetry is None:
+            return super().execute_sql(sql, params, commit)
+        start = time.perf_counter()
+        try:
+            return super().execute_sql(sql, params, commit)
+        finally:
+            telemetry.record_query(sql, time.perf_counter() - start)
+
+
+def install(tracer_provider=None, meter_provider=None, spans=True,
+            metrics=True, sample_rate=1.0):
+    """Turn on the model telemetry, the statements are only seen on
+    databases with `TelemetryMixin`"""
+    model.telemetry = ModelTelemetry(
+        tracer_provider, meter_provider, spans, metrics, sample_rate)
+    return model.telemetry
+
+
+def uninstall():
+    model.telemetry = None
+
+
+def database_mixins(app):
+    """Mixins of the databases of an extension for the OTEL_ config"""
+    config = app.config.get_namespace("OTEL_")
+    if config.get("enable", False) and (
+            config.get("model_spans", False) or config.get("metrics", False)):
+        return (TelemetryMixin,)
+    return ()
+
+
 @sync_once
 def otel_instrument(app=None):
-    if app is not None and not app.config.get_namespace("OTEL_").get("enable", False):
+    config = app.config.get_namespace("OTEL_") if app is not None else {}
+    if app is not None and not config.get("enable", False):
         return
 
     tp = trace.get_tracer_provider()
+    if config.get("model_spans", False) or config.get("metrics", False):
+        install(tp, spans=config.get("model_spans", False),
+                metrics=config.get("metrics", False),
+                sample_rate=config.get("sample_rate", 1.0))
+    if not config.get("driver_spans", True):
+        return
     if mysql_connector == MySQLConnector.mysqldb:
         MySQLClientInstrumentor().instrument(tracer_provider=tp)
     elif mysql_connector == MySQLConnector.pymysql:
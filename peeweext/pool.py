@@ -0,0 +1,112 @@
+"""Connection pool support for the extensions"""
+import functools
+import threading
+import time
+from urllib.parse import urlparse
+
+from playhouse import db_url
+from playhouse.pool import PooledDatabase, PooledMySQLDatabase
+
+# {config key: PooledDatabase argument}, eg: PW_POOL_MAX_CONNECTIONS
+POOL_OPTIONS = {
+    'pool_max_connections': 'max_connections',
+    'pool_stale_timeout': 'stale_timeout',
+    'pool_wait_timeout': 'timeout',
+    'pool_pre_ping': 'pre_ping',
+}
+
+
+class PoolMixin:
+    """Pre-ping on checkout and statistics for `PooledDatabase`"""
+
+    def __init__(self, *args, pre_ping=False, **kwargs):
+        self.pre_ping = pre_ping
+        self.checkouts = 0
+        self.wait_time = 0.0  # seconds spent waiting for a free connection
+        self._attempt = threading.local()
+        super().__init__(*args, **kwargs)
+
+    def connect(self, reuse_if_open=False):
+        self._attempt.start = start = time.perf_counter()
+        try:
+            return super().connect(reuse_if_open)
+        finally:
+            self.checkouts += 1
+            # until the last attempt, opening a new connection isn't waiting
+            self.wait_time += self._attempt.start - start
+
+    def _connect(self):
+        self._attempt.start = time.perf_counter()
+        return super()._connect()
+
+    def _is_closed(self, conn):
+        if super()._is_closed(conn):
+            return True
+        # MySQL pools ping in `_is_closed` already
+        if self.pre_ping and not isinstance(self, PooledMySQLDatabase):
+            try:
+                self._ping(conn)
+            except Exception:
+                return True
+        return False
+
+    @staticmethod
+    def _ping(conn):
+        if hasattr(conn, 'ping'):
+            conn.ping()
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def pool_stats(self):
+        with self._pool_lock:
+            in_use = len(self._in_use)
+            idle = len(self._connections)
+        return {
+            'size': in_use + idle,
+            'in_use': in_use,
+            'idle': idle,
+            'max_connections': self._max_connections,
+            'checkouts': self.checkouts,
+            'wait_time': self.wait_time,
+        }
+
+
+@functools.lru_cache(maxsize=None)
+def _database_class(database_class, mixins):
+    return type(database_class.__name__, (*mixins, database_class), {})
+
+
+def get_pool_params(config):
+    """Collect pool arguments from `PW_POOL_*` configs"""
+    return {
+        name: config[key] for key, name in POOL_OPTIONS.items()
+        if key in config}
+
+
+def connect(url, pool_params=None, mixins=(), **connect_params):
+    """`playhouse.db_url.connect` with pool support,
+    a non-empty `pool_params` switches the url to its `+pool` scheme,
+    `mixins` are added to the database class
+    """
+    parsed = urlparse(url)
+    scheme = parsed.scheme
+    if pool_params and not scheme.endswith('+pool'):
+        scheme += '+pool'
+    database_class = db_url.schemes.get(scheme)
+    if database_class is None:
+        raise RuntimeError(
+            'Unrecognized or unsupported scheme: "%s".' % scheme)
+
+    connect_kwargs = db_url.parseresult_to_dict(parsed)
+    if issubclass(database_class, PooledDatabase):
+        mixins = (*mixins, PoolMixin)
+        connect_kwargs.update(pool_params or {})
+    if mixins:
+        database_class = _database_class(database_class, tuple(mixins))
+    connect_kwargs.update(connect_params)
+    return database_class(**connect_kwargs)
@@ -0,0 +1,73 @@
+"""Read/write splitting for the extensions"""
+import contextvars
+import itertools
+import time
+
+import peewee as pw
+from playhouse.pool import PooledDatabase
+
+STRATEGIES = ('round_robin', 'least_connections')
+
+
+class PrimaryMixin:
+    """Report writes on the primary database to its router"""
+    router = None
+
+    def execute(self, query, commit=None, **context_options):
+        if self.router is not None \
+                and isinstance(query, (pw.Insert, pw.Update, pw.Delete)):
+            self.router.mark_write()
+        return super().execute(query, commit, **context_options)
+
+
+def _connections_in_use(database):
+    if isinstance(database, PooledDatabase):
+        return len(database._in_use)
+    return 0
+
+
+class ReplicaRouter:
+    """Route SELECTs of models to replicas.
+
+    Reads stay on the primary inside transactions and during
+    `sticky_seconds` after a write of the same thread or task, so they
+    see their own writes. `least_connections` compares the connections
+    checked out from pooled replicas, ties are taken in turn.
+    """
+
+    def __init__(self):
+        self._sticky_until = contextvars.ContextVar(
+            'peeweext_sticky_until', default=0)
+        self.configure(None)
+
+    def configure(self, primary, replicas=(), strategy='round_robin',
+                  sticky_seconds=0):
+        if strategy not in STRATEGIES:
+            raise ValueError('Unknown replica strategy {}'.format(strategy))
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.strategy = strategy
+        self.sticky_seconds = sticky_seconds
+        self._counter = itertools.count()
+        if isinstance(primary, PrimaryMixin):
+            primary.router = self
+
+    def mark_write(self):
+        if self.sticky_seconds:
+            self._sticky_until.set(time.monotonic() + self.sticky_seconds)
+
+    def read_database(self):
+        """Return a replica to read from, None for the primary"""
+        if not self.replicas or self.primary.in_transaction() \
+                or self._sticky_until.get() > time.monotonic():
+            return None
+        start = next(self._counter) % len(self.replicas)
+        replicas = self.replicas[start:] + self.replicas[:start]
+        if self.strategy == 'least_connections':
+            return min(replicas, key=_connections_in_use)
+        return replicas[0]
+
+    def close(self):
+        for database in self.replicas:
+            if not database.is_closed():
+                database.close()
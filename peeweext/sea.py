@@ -2,24 +2,57 @@ from sea.utils import import_string, cached_property
 from sea.local import Proxy
 from sea.middleware import BaseMiddleware
 from sea.pb2 import default_pb2
-from playhouse import db_url
 from peewee import DoesNotExist, DataError
 import grpc
-from .otel import otel_instrument
+from .cache import QueryCache
+from .instrument import QueryRecorder, StatsMixin, query_stats
+from .otel import database_mixins, otel_instrument
+from .pool import PoolMixin, connect, get_pool_params
+from .replica import PrimaryMixin, ReplicaRouter
 from .validation import ValidationError
 
 
 class Peeweext:
     def __init__(self, ns='PW_'):
         self.ns = ns
+        self.query_cache = QueryCache()
+        self.router = ReplicaRouter()
+        self.recorder = QueryRecorder()
 
     def init_app(self, app):
         config = app.config.get_namespace(self.ns)
         self.model_class = import_string(
             config.get('model', 'peeweext.model.Model'))
         conn_params = config.get('conn_params', {})
+        # connect on the first query instead of before every call
+        self.lazy_connect = config.get('lazy_connect', False)
+        if self.lazy_connect:
+            conn_params = dict(conn_params, autoconnect=True)
+        self.query_cache.configure(
+            max_size=config.get('query_cache_max_size', 0),
+            ttl=config.get('query_cache_ttl'),
+            max_memory=config.get('query_cache_max_memory'))
         otel_instrument(app)
-        self.database = db_url.connect(config['db_url'], **conn_params)
+        pool_params = get_pool_params(config)
+        replica_urls = config.get('replica_urls', [])
+        # record the queries of each request, call or task
+        self.query_stats = config.get('query_stats', False)
+        mixins = database_mixins(app)
+        if self.query_stats:
+            mixins += (StatsMixin,)
+        self.database = connect(
+            config['db_url'], pool_params,
+            mixins=mixins + (PrimaryMixin,) if replica_urls else mixins,
+            **conn_params)
+        replicas = [connect(url, pool_params, mixins=mixins, **conn_params)
+                    for url in replica_urls]
+        self.router.configure(
+            self.database, replicas,
+            strategy=config.get('replica_strategy', 'round_robin'),
+            sticky_seconds=config.get('replica_sticky_seconds', 0))
+        self.recorder.configure(
+            [self.database, *replicas],
+            threshold=config.get('n_plus_one_threshold', 0))
         self._try_setup_celery()
 
     def _get_db(self):
@@ -30,24 +63,49 @@ class Peeweext:
         class BaseModel(self.model_class):
             class Meta:
                 database = Proxy(self._get_db)
+                query_cache = self.query_cache
+                replica_router = self.router
 
         return BaseModel
 
+    def pool_stats(self):
+        """Pool size, in-use count and checkout time, None if not pooled"""
+        if isinstance(self.database, PoolMixin):
+            return self.database.pool_stats()
+
     def connect_db(self):
         if self.database.is_closed():
             self.database.connect()
 
     def close_db(self):
+        # pooled databases return the connection to the pool
         if not self.database.is_closed():
             self.database.close()
+        self.router.close()
+
+    def start_stats(self, name=None):
+        if self.query_stats:
+            self.recorder.start(name)
+
+    def finish_stats(self):
+        stats = self.recorder.finish()
+        if stats is not None:
+            query_stats.send(self, stats=stats)
 
     def _try_setup_celery(self):
         try:
             from celery.signals import task_prerun, task_postrun
-            task_prerun.connect(
-                lambda *arg, **kw: self.connect_db(), weak=False)
+            if not self.lazy_connect:
+                task_prerun.connect(
+                    lambda *arg, **kw: self.connect_db(), weak=False)
             task_postrun.connect(
                 lambda *arg, **kw: self.close_db(), weak=False)
+            if self.query_stats:
+                task_prerun.connect(
+                    lambda *arg, task=None, **kw: self.start_stats(task.name),
+                    weak=False)
+                task_postrun.connect(
+                    lambda *arg, **kw: self.finish_stats(), weak=False)
         except ImportError:
             pass
 
@@ -62,14 +120,18 @@ class PeeweextMiddleware(BaseMiddleware):
 
     def connect_db(self):
         for pwx in self.pwxs:
-            pwx.connect_db()
+            if not pwx.lazy_connect:
+                pwx.connect_db()
 
     def close_db(self):
         for pwx in self.pwxs:
             pwx.close_db()
+            pwx.finish_stats()
 
     def __call__(self, servicer, request, context):
         try:
+            for pwx in self.pwxs:
+                pwx.start_stats(self.origin_handler.__name__)
             self.connect_db()
             return self.handler(servicer, request, context)
         except DoesNotExist:
@@ -0,0 +1,157 @@
+"""Signals of peeweext models"""
+import contextlib
+import contextvars
+import inspect
+
+from blinker import signal
+
+pre_save = signal('pre_save')
+post_save = signal('post_save')
+pre_delete = signal('pre_delete')
+post_delete = signal('post_delete')
+pre_init = signal('pre_init')
+
+# receive all instances of one sender at once: (sender, instances, **kwargs),
+# delete batches also carry the primary keys `pks`, and `instances=None`
+# for rows deleted without instances (`Model.delete_many`, cascades)
+pre_save_batch = signal('pre_save_batch')
+post_save_batch = signal('post_save_batch')
+pre_delete_batch = signal('pre_delete_batch')
+post_delete_batch = signal('post_delete_batch')
+
+_batch_signals = {
+    pre_save: pre_save_batch,
+    post_save: post_save_batch,
+    pre_delete: pre_delete_batch,
+    post_delete: post_delete_batch,
+}
+# sent before the rows are written, never delayed by `batched()`
+_pre_batch_signals = frozenset((pre_save_batch, pre_delete_batch))
+_delete_batch_signals = frozenset((pre_delete_batch, post_delete_batch))
+
+_receivers_cache = {}  # {(signal, sender): has receivers}
+_batch_queue = contextvars.ContextVar('peeweext_batch_queue', default=None)
+
+
+def _clear_receivers_cache(*args, **kwargs):
+    _receivers_cache.clear()
+
+
+for _signal in (pre_init, *_batch_signals, *_batch_signals.values()):
+    _signal.receiver_connected.connect(_clear_receivers_cache, weak=False)
+    _signal.receiver_disconnected.connect(_clear_receivers_cache, weak=False)
+
+
+def has_receivers(sig, sender):
+    """Cached receivers lookup, reset whenever a receiver (dis)connects
+    """
+    key = (sig, sender)
+    try:
+        return _receivers_cache[key]
+    except KeyError:
+        ret = _receivers_cache[key] = any(sig.receivers_for(sender))
+        return ret
+
+
+def _batch_payload(batch_sig, instances):
+    payload = {'instances': list(instances)}
+    if batch_sig in _delete_batch_signals:
+        payload['pks'] = [instance._pk for instance in instances]
+    return payload
+
+
+def send(sig, sender, instance, **kwargs):
+    send_many(sig, sender, [instance], **kwargs)
+
+
+def send_many(sig, sender, instances, **kwargs):
+    """Send `sig` for every instance, and its batch signal once,
+    nothing is sent to a signal without receivers.
+    pre_* batch signals come first, so their receivers can prepare all rows
+    at once; post_* batch signals come last, and inside `batched()` they
+    are delayed until the block exits.
+    """
+    batch_sig = _batch_signals.get(sig)
+    if batch_sig is not None and not has_receivers(batch_sig, sender):
+        batch_sig = None
+    if batch_sig in _pre_batch_signals:
+        batch_sig.send(
+            sender, **_batch_payload(batch_sig, instances), **kwargs)
+
+    if has_receivers(sig, sender):
+        for instance in instances:
+            sig.send(sender, instance=instance, **kwargs)
+
+    if batch_sig is None or batch_sig in _pre_batch_signals:
+        return
+    queue = _batch_queue.get()
+    if queue is None:
+        batch_sig.send(
+            sender, **_batch_payload(batch_sig, instances), **kwargs)
+    else:
+        key = (batch_sig, sender, tuple(sorted(kwargs.items())))
+        queue.setdefault(key, []).extend(instances)
+
+
+async def send_async(sig, sender, instance, **kwargs):
+    await send_many_async(sig, sender, [instance], **kwargs)
+
+
+async def send_many_async(sig, sender, instances, **kwargs):
+    """`send_many` for asyncio code, receivers may be coroutine functions.
+    Batch signals delayed by `batched()` are still delivered synchronously.
+    """
+    batch_sig = _batch_signals.get(sig)
+    if batch_sig is not None and not has_receivers(batch_sig, sender):
+        batch_sig = None
+    if batch_sig in _pre_batch_signals:
+        await _send_async(
+            batch_sig, sender, **_batch_payload(batch_sig, instances),
+            **kwargs)
+
+    if has_receivers(sig, sender):
+        for instance in instances:
+            await _send_async(sig, sender, instance=instance, **kwargs)
+
+    if batch_sig is None or batch_sig in _pre_batch_signals:
+        return
+    queue = _batch_queue.get()
+    if queue is None:
+        await _send_async(
+            batch_sig, sender, **_batch_payload(batch_sig, instances),
+            **kwargs)
+    else:
+        key = (batch_sig, sender, tuple(sorted(kwargs.items())))
+        queue.setdefault(key, []).extend(instances)
+
+
+async def _send_async(sig, sender, **kwargs):
+    for receiver in sig.receivers_for(sender):
+        result = receiver(sender, **kwargs)
+        if inspect.isawaitable(result):
+            await result
+
+
+@contextlib.contextmanager
+def batched():
+    """Collect post_* batch signals and deliver them as one list per signal and
+    sender when the block exits, events of a failed block are dropped.
+
+    with batched():
+        for note in notes:
+            note.save()
+    # post_save_batch receivers get all the notes in one call
+    """
+    if _batch_queue.get() is not None:  # nested, the outermost delivers
+        yield
+        return
+
+    queue = {}
+    token = _batch_queue.set(queue)
+    try:
+        yield
+    finally:
+        _batch_queue.reset(token)
+    for (batch_sig, sender, kwargs), instances in queue.items():
+        batch_sig.send(
+            sender, **_batch_payload(batch_sig, instances), **dict(kwargs))
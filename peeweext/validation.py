@@ -179,4 +179,8 @@ class validates:
                 validator(value)
             return func(instance, value)
 
+        # let Model compile validators without calling through the wrapper,
+        # `__validates__` tells it apart from decorators copying its dict
+        wrapper.__validators__ = tuple(self.validators)
+        wrapper.__validates__ = wrapper
         return wrapper
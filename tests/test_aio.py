@@ -0,0 +1,168 @@
+import asyncio
+import os
+import tempfile
+
+import flask
+import peewee
+import pytest
+
+from peeweext import signals
+from peeweext.aio import Peeweext
+from peeweext.mixins import VersionConflict, VersionedMixin
+from peeweext.validation import ValidationError
+
+app = flask.Flask(__name__)
+app.config['PW_DB_URL'] = 'sqlite:///{}'.format(
+    os.path.join(tempfile.mkdtemp(), 'aio.db'))
+app.config['PW_POOL_MAX_CONNECTIONS'] = 2
+pwdb = Peeweext()
+pwdb.init_app(app)
+
+
+class AioNote(pwdb.Model):
+    message = peewee.TextField()
+    secret = peewee.CharField(default='')
+
+    __attr_protected__ = {'secret'}
+
+    def validate_message(self, value):
+        if value == 'raise error':
+            raise ValidationError
+
+
+class AioAccount(VersionedMixin, pwdb.Model):
+    balance = peewee.IntegerField(default=0)
+
+
+@pytest.fixture
+def aio_db():
+    AioNote.create_table()
+    AioAccount.create_table()
+    yield pwdb
+    AioNote.drop_table()
+    AioAccount.drop_table()
+    pwdb.database.close()
+
+
+def run(coro):
+    async def main():
+        try:
+            return await coro
+        finally:
+            await pwdb.close()
+    return asyncio.run(main())
+
+
+def test_aio_model(aio_db):
+    received = []
+
+    async def post_save(sender, instance, created):
+        await asyncio.sleep(0)
+        received.append((instance.message, created))
+
+    def post_delete(sender, instance):
+        received.append((instance.message, None))
+
+    signals.post_save.connect(post_save, sender=AioNote)
+    signals.post_delete.connect(post_delete, sender=AioNote)
+
+    async def main():
+        note = await AioNote.aio_create(message='hello', secret='x')
+        assert note.id == 1
+        assert note.secret == ''
+        with pytest.raises(ValidationError):
+            await AioNote.aio_create(message='raise error')
+
+        assert await note.aio_save() is False  # nothing changed
+        await note.aio_update_with(message='world')
+        note = await AioNote.aio_get(AioNote.message == 'world')
+        assert (await AioNote.aio_get_by_id(note.id)).id == note.id
+        assert note.created_at is not None
+
+        await AioNote.aio_create(message='again')
+        messages = [n.message async for n in AioNote.select()]
+        assert messages == ['world', 'again']
+
+        assert await note.aio_delete_instance() == 1
+        with pytest.raises(AioNote.DoesNotExist):
+            await AioNote.aio_get(1)
+
+    try:
+        run(main())
+    finally:
+        signals.post_save.disconnect(post_save, sender=AioNote)
+        signals.post_delete.disconnect(post_delete, sender=AioNote)
+    assert received == [
+        ('hello', True), ('world', False), ('again', True), ('world', None)]
+    # the blocking API shares the database
+    assert AioNote.select().count() == 1
+
+
+def test_aio_release(aio_db):
+    async def main():
+        for message in 'abc':
+            await AioNote.aio_create(message=message)
+        for _ in range(3):  # more early breaks than connections
+            async with AioNote.select().aio_iterate(chunk_size=1) as notes:
+                async for note in notes:
+                    break
+            assert pwdb.pool_stats()['in_use'] == 0
+        assert note.message == 'a'
+
+        # the connection of a failed statement is not reused
+        assert pwdb.pool_stats()['idle'] == 1
+        with pytest.raises(Exception):
+            await pwdb.aio_database.execute_sql('SELECT * FROM missing')
+        return pwdb.pool_stats()
+
+    stats = run(main())
+    assert (stats['in_use'], stats['idle']) == (0, 0)
+
+
+def test_aio_versioned(aio_db):
+    async def main():
+        account = await AioAccount.aio_create(balance=1)
+        stale = await AioAccount.aio_get_by_id(account.id)
+        account.balance = 2
+        await account.aio_save()
+        assert account.version == 2
+
+        stale.balance = 3
+        with pytest.raises(VersionConflict):
+            await stale.aio_save()
+        assert stale.version == 1
+        assert stale.is_dirty()
+
+    run(main())
+    assert AioAccount.get_by_id(1).balance == 2
+
+
+def test_aio_connection_scope(aio_db):
+    async def create(message):
+        await AioNote.aio_create(message=message)
+
+    async def main():
+        async with pwdb.connection() as conn:
+            async with pwdb.connection() as inner:
+                assert inner is conn
+            assert pwdb.pool_stats()['in_use'] == 1
+            # tasks never share the connection of their parent
+            await asyncio.gather(create('a'), create('b'))
+            assert pwdb.pool_stats()['size'] == 2
+
+        with pytest.raises(RuntimeError):
+            async with pwdb.atomic():
+                await create('c')
+                async with pwdb.atomic():
+                    await create('d')
+                raise RuntimeError
+        async with pwdb.atomic():
+            await create('e')
+            with pytest.raises(RuntimeError):
+                async with pwdb.atomic():
+                    await create('f')
+                    raise RuntimeError
+        return sorted(n.message for n in await AioNote.select().aio_execute())
+
+    assert run(main()) == ['a', 'b', 'e']
+    assert pwdb.pool_stats()['in_use'] == 0
@@ -0,0 +1,155 @@
+import time
+
+import peewee
+import pytest
+
+from peeweext.cache import LRUCache, QueryCache, RowCache
+from peeweext.fields import JSONCharField
+from tests.flaskapp import pwdb
+
+
+class DictBackend:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ttl=None):
+        self.data[key] = value
+
+    def delete(self, key):
+        self.data.pop(key, None)
+
+
+class CachedNote(pwdb.Model):
+    message = peewee.TextField()
+    extra = JSONCharField(max_length=128, default={})
+
+    class Meta:
+        row_cache = RowCache(ttl=60, max_size=16)
+
+
+class RemoteNote(pwdb.Model):
+    message = peewee.TextField()
+
+    class Meta:
+        row_cache = RowCache(backend=DictBackend())
+
+
+@pytest.fixture
+def table():
+    CachedNote.create_table()
+    RemoteNote.create_table()
+    yield
+    CachedNote.drop_table()
+    RemoteNote.drop_table()
+    CachedNote._meta.row_cache.backend.clear()
+    RemoteNote._meta.row_cache.backend.data.clear()
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert len(cache) == 2
+    cache.delete('a')
+    assert cache.get('a') is None
+
+    cache.set('d', 4, ttl=0.01)
+    time.sleep(0.02)
+    assert cache.get('d') is None
+    cache.clear()
+    assert len(cache) == 0
+
+
+@pytest.mark.parametrize('model', [CachedNote, RemoteNote])
+def test_row_cache(table, model):
+    row_cache = model._meta.row_cache
+    row_cache.hits = row_cache.misses = 0
+    note = model.create(message='hello')
+
+    assert model.get_by_id(note.id).message == 'hello'
+    assert (row_cache.hits, row_cache.misses) == (0, 1)
+    assert model.get_by_id(note.id).message == 'hello'
+    assert model.get(id=note.id).message == 'hello'
+    assert model.get(note.id).message == 'hello'
+    assert model.get_or_none(id=note.id).message == 'hello'
+    assert (row_cache.hits, row_cache.misses) == (4, 1)
+    assert row_cache.hit_ratio == 0.8
+
+    # evicted by save
+    note.message = 'changed'
+    note.save()
+    assert model.get_by_id(note.id).message == 'changed'
+    assert row_cache.misses == 2
+    assert model.get_by_id(note.id)._dirty == set()
+
+    # not by other lookups
+    assert model.get(model.message == 'changed').id == note.id
+    assert row_cache.hits == 5
+
+    note.delete_instance()
+    with pytest.raises(model.DoesNotExist):
+        model.get_by_id(note.id)
+    assert model.get_or_none(id=note.id) is None
+
+    # evicted by the keys of delete_many
+    note = model.create(message='hello')
+    assert model.get_by_id(note.id).message == 'hello'
+    model.delete_many(model.id == note.id)
+    assert model.get_or_none(id=note.id) is None
+
+
+def test_row_cache_in_transaction(table):
+    row_cache = CachedNote._meta.row_cache
+    note = CachedNote.create(message='hello')
+    database = CachedNote._meta.database
+    with database.atomic() as transaction:
+        note.message = 'uncommitted'
+        note.save()
+        misses = row_cache.misses
+        assert CachedNote.get_by_id(note.id).message == 'uncommitted'
+        assert row_cache.misses == misses  # the cache is bypassed
+        transaction.rollback()
+    assert CachedNote.get_by_id(note.id).message == 'hello'
+
+
+def test_row_cache_mutable_values(table):
+    note = CachedNote.create(message='hello', extra={'a': 1})
+    CachedNote.get_by_id(note.id).extra['b'] = 2
+    CachedNote.get_by_id(note.id).extra['c'] = 3
+    assert CachedNote.get_by_id(note.id).extra == {'a': 1}
+
+
+def test_query_cache_tables(table, monkeypatch):
+    query_cache = QueryCache(max_size=16)
+    database = CachedNote._meta.database
+    CachedNote.create(message='hello')
+    # every table of a FROM list invalidates the entry
+    query = CachedNote.select(CachedNote.message) \
+        .from_(CachedNote, RemoteNote)
+    query_cache.cursor(query, database)
+    assert len(query_cache) == 1
+    query_cache.invalidate(RemoteNote._meta.table_name)
+    assert len(query_cache) == 0
+
+    # nothing is stored when the table is invalidated while the query runs
+    execute_sql = database.execute_sql
+
+    def write_while_reading(sql, *args):
+        cursor = execute_sql(sql, *args)
+        query_cache.invalidate(CachedNote._meta.table_name)
+        return cursor
+
+    monkeypatch.setattr(database, 'execute_sql', write_while_reading)
+    query = CachedNote.select(CachedNote.message)
+    assert query_cache.cursor(query, database).fetchone() == ('hello',)
+    assert len(query_cache) == 0
+    monkeypatch.undo()
+    query_cache.cursor(query, database)
+    assert len(query_cache) == 1
+    query_cache.configure(max_size=0)
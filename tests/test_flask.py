@@ -3,8 +3,9 @@ import pytest
 from flask import Flask
 
 import peeweext.flask
+import peeweext.pool
 from peeweext.flask import Peeweext
-from .flaskapp import app, pwmysql, PW_MYSQL_DB_URL
+from .flaskapp import app, pwdb, pwmysql, PW_MYSQL_DB_URL
 
 
 class Comment(pwmysql.Model):
@@ -66,3 +67,285 @@ def test_flask_module_load_not_cache_pool():
 
     with pytest.raises(peeweext.flask.UninitializedException) as e:
         pwu.database.execute_sql("select 1")
+
+
+def test_query_cache():
+    app1 = Flask("cached app")
+    app1.config.update(
+        PW_CACHED_DB_URL='sqlite:///:memory:',
+        PW_CACHED_QUERY_CACHE_MAX_SIZE=2,
+        PW_CACHED_QUERY_CACHE_TTL=60)
+    pwc = Peeweext(ns='PW_CACHED_')
+    pwc.init_app(app1)
+
+    class Article(pwc.Model):
+        title = peewee.TextField()
+
+    query_cache = pwc.query_cache
+    Article.create_table()
+    try:
+        Article.create(title='a')
+        query = Article.select().order_by(Article.id).cached()
+        assert [a.title for a in query] == ['a']
+        assert [a.title for a in query.clone()] == ['a']
+        assert query.clone().dicts()[0]['title'] == 'a'
+        assert (query_cache.hits, query_cache.misses) == (2, 1)
+        assert query_cache.hit_ratio == 2 / 3
+        assert query_cache.memory > 0
+
+        # not cached without .cached()
+        Article.insert(title='b').execute()
+        assert len(list(Article.select())) == 2
+        assert [a.title for a in query.clone()] == ['a']
+
+        # invalidated by signals
+        Article.create(title='c')
+        assert [a.title for a in query.clone()] == ['a', 'b', 'c']
+        assert len(query_cache) == 1
+
+        # bounded by max_size
+        for title in 'abc':
+            Article.select().where(Article.title == title).cached().get()
+        assert len(query_cache) == 2
+
+        query_cache.configure(max_size=0)
+        assert len(query_cache) == 0
+        assert [a.title for a in query.clone()] == ['a', 'b', 'c']
+        assert query_cache.misses == 5
+    finally:
+        Article.drop_table()
+
+
+def test_pool(tmp_path, monkeypatch):
+    import threading
+    import time
+    from playhouse.pool import MaxConnectionsExceeded, PooledMySQLDatabase
+    from peeweext.pool import PoolMixin
+
+    app1 = Flask("pooled app")
+    app1.config.update(
+        PW_POOLED_DB_URL='sqlite:///{}'.format(tmp_path / 'pool.db'),
+        PW_POOLED_POOL_MAX_CONNECTIONS=1,
+        PW_POOLED_POOL_WAIT_TIMEOUT=1,
+        PW_POOLED_POOL_PRE_PING=True)
+    pwp = Peeweext(ns='PW_POOLED_')
+    pwp.init_app(app1)
+    database = pwp.database
+    assert isinstance(database._get_current_object(), PoolMixin)
+    assert pwp.pool_stats()['size'] == 0
+
+    pwp.connect_db()
+    database.execute_sql('select 1')
+    assert pwp.pool_stats()['in_use'] == 1
+    pwp.close_db(None)
+    stats = pwp.pool_stats()
+    assert (stats['size'], stats['in_use'], stats['idle']) == (1, 0, 1)
+
+    # connection is reused
+    pwp.connect_db()
+    pwp.close_db(None)
+    assert pwp.pool_stats()['size'] == 1
+
+    # wait for a free connection
+    pwp.connect_db()
+    errors = []
+
+    def checkout():
+        try:
+            database.connect()
+        except MaxConnectionsExceeded as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=checkout)
+    thread.start()
+    thread.join()
+    pwp.close_db(None)
+    assert len(errors) == 1
+    assert 0.8 <= pwp.pool_stats()['wait_time'] < 1.5
+    assert pwp.pool_stats()['checkouts'] == 4
+
+    # opening a new connection is not waiting, reused ones are pinged once
+    wait_time = pwp.pool_stats()['wait_time']
+    pings = []
+    monkeypatch.setattr(PoolMixin, '_ping', staticmethod(pings.append))
+    sqlite_connect = peewee.SqliteDatabase._connect
+    monkeypatch.setattr(peewee.SqliteDatabase, '_connect', lambda self: (
+        time.sleep(0.2), sqlite_connect(self))[1])
+    database.close_all()
+    pwp.connect_db()
+    pwp.close_db(None)
+    assert pings == []
+    pwp.connect_db()
+    pwp.close_db(None)
+    assert len(pings) == 1
+    assert pwp.pool_stats()['wait_time'] - wait_time < 0.1
+
+    class Connection:
+        def ping(self, *args):
+            pings.append(self)
+
+    mysql_class = peeweext.pool._database_class(
+        PooledMySQLDatabase, (PoolMixin,))
+    mysql = mysql_class('peeweext', pre_ping=True)
+    mysql.server_version = (8, 0, 0)
+    pings.clear()
+    assert not mysql._is_closed(Connection())
+    assert len(pings) == 1
+
+    assert pwdb.pool_stats() is None
+    with pytest.raises(RuntimeError):
+        peeweext.pool.connect('unknown://', {'max_connections': 1})
+
+
+def test_lazy_connect():
+    app1 = Flask("lazy app")
+    app1.config.update(
+        PW_LAZY_DB_URL='sqlite:///:memory:',
+        PW_LAZY_LAZY_CONNECT=True,
+        PW_LAZY_CONN_PARAMS={'autoconnect': False})
+    pwl = Peeweext(ns='PW_LAZY_')
+    pwl.init_app(app1)
+    used = []
+
+    @app1.route('/health')
+    def health():
+        used.append(not pwl.database.is_closed())
+        return 'ok'
+
+    @app1.route('/query')
+    def query():
+        pwl.database.execute_sql('select 1')
+        used.append(not pwl.database.is_closed())
+        return 'ok'
+
+    client = app1.test_client()
+    assert client.get('/health').status_code == 200
+    assert client.get('/query').status_code == 200
+    assert used == [False, True]
+    assert pwl.database.is_closed()
+
+
+def test_replica_routing(tmp_path):
+    urls = ['sqlite:///{}'.format(tmp_path / name)
+            for name in ('primary.db', 'r1.db', 'r2.db')]
+    app1 = Flask("replica app")
+    app1.config.update(
+        PW_RO_DB_URL=urls[0],
+        PW_RO_REPLICA_URLS=urls[1:],
+        PW_RO_REPLICA_STICKY_SECONDS=60)
+    pwr = Peeweext(ns='PW_RO_')
+    pwr.init_app(app1)
+
+    class Article(pwr.Model):
+        title = peewee.TextField()
+
+    Article.create_table()
+    replicas = pwr.router.replicas
+    for i, replica in enumerate(replicas):
+        with replica.bind_ctx([Article]):
+            Article.create_table()
+            Article.create(title='replica%d' % i)
+
+    pwr.router.sticky_seconds = 0
+    assert Article.get().title == 'replica0'
+    assert Article.get().title == 'replica1'
+    assert [a.title for a in Article.select()] == ['replica0']
+    assert Article.select().count() == 1
+
+    # writes and transactions go to the primary
+    with pwr.database.atomic():
+        Article.create(title='primary')
+        assert Article.get().title == 'primary'
+
+    # sticky primary after writes
+    pwr.router.sticky_seconds = 60
+    assert Article.get().title == 'replica0'
+    Article.update(title='primary!').execute()
+    assert Article.get().title == 'primary!'
+    assert Article.get().title == 'primary!'
+
+    pwr.close_db(None)
+    assert all(replica.is_closed() for replica in replicas)
+    with pytest.raises(ValueError):
+        pwr.router.configure(None, strategy='random')
+
+
+def test_replica_least_connections(tmp_path):
+    urls = ['sqlite+pool:///{}'.format(tmp_path / name)
+            for name in ('primary.db', 'r1.db', 'r2.db')]
+    app1 = Flask("replica app")
+    app1.config.update(
+        PW_RO_DB_URL=urls[0],
+        PW_RO_REPLICA_URLS=urls[1:],
+        PW_RO_REPLICA_STRATEGY='least_connections')
+    pwr = Peeweext(ns='PW_RO_')
+    pwr.init_app(app1)
+    r1, r2 = pwr.router.replicas
+
+    r1.connect()
+    assert pwr.router.read_database() is r2
+    assert pwr.router.read_database() is r2
+    r1.close()
+    assert pwr.router.read_database() is r1
+
+
+def test_query_stats(tmp_path, caplog):
+    from peeweext.instrument import fingerprint, query_stats
+
+    app1 = Flask("stats app")
+    app1.config.update(
+        PW_STATS_DB_URL='sqlite:///{}'.format(tmp_path / 'stats.db'),
+        PW_STATS_QUERY_STATS=True,
+        PW_STATS_QUERY_STATS_HEADER='Server-Timing',
+        PW_STATS_N_PLUS_ONE_THRESHOLD=2)
+    pws = Peeweext(ns='PW_STATS_')
+    pws.init_app(app1)
+
+    class Article(pws.Model):
+        title = peewee.TextField()
+
+    Article.create_table()
+    Article.insert_many(
+        [{'title': t} for t in 'abc'], fields=[Article.title]).execute()
+
+    @app1.route('/articles')
+    def articles():
+        for pk in range(1, 4):
+            Article.get_by_id(pk)
+        Article.update(title='x').execute()
+        return 'ok'
+
+    collected = []
+
+    def receiver(sender, stats):
+        collected.append(stats)
+
+    query_stats.connect(receiver, sender=pws)
+    try:
+        rv = app1.test_client().get('/articles')
+    finally:
+        query_stats.disconnect(receiver, sender=pws)
+    assert rv.status_code == 200
+    assert rv.headers['Server-Timing'].startswith('db;dur=')
+    assert '"4 queries, 3 rows"' in rv.headers['Server-Timing']
+
+    stats, = collected
+    assert (stats.name, stats.count, stats.rows) == ('articles', 4, 3)
+    assert stats.duration > 0
+    select, = stats.repeated(2)
+    assert stats.statements[select] == 3
+    assert 'Possible N+1 query in articles, run 3 times' in caplog.text
+    assert pws.recorder.current() is None
+
+    # not recorded outside of requests, or within collect()
+    Article.get_by_id(1)
+    with pws.recorder.collect('block') as stats:
+        Article.select().where(Article.id.in_([1, 2])).count()
+        Article.select().where(Article.id.in_([1, 2, 3])).count()
+    assert stats.count == 2 and len(stats.statements) == 1
+
+    assert fingerprint(
+        "SELECT * FROM t1 WHERE a = 'it''s' AND b IN (1, 2.5, $3)") == \
+        'SELECT * FROM t1 WHERE a = ? AND b IN (...)'
+    assert fingerprint('INSERT INTO t (a, b) VALUES (?, ?), (?, ?)') == \
+        'INSERT INTO t (a, b) VALUES (...)'
@@ -1,7 +1,12 @@
+import sqlite3
+import threading
+
 import pytest
 import peewee as pw
 
-from peeweext.mixins import SequenceMixin
+from peeweext.mixins import (
+    SequenceAllocator, SequenceCounter, SequenceMixin, VersionConflict,
+    VersionedMixin, retry_on_conflict)
 from tests.flaskapp import pwdb
 
 db = pwdb.database
@@ -38,7 +43,12 @@ def table():
     Author.create_table()
     Course.create_table()
     Book.create_table()
+    with db.bind_ctx([SequenceCounter]):
+        SequenceCounter.create_table()
     yield
+    with db.bind_ctx([SequenceCounter]):
+        SequenceCounter.drop_table()
+    SequenceMixin.__seq_allocator__.clear()
     Category.drop_table()
     Author.drop_table()
     Course.drop_table()
@@ -105,3 +115,283 @@ def test_sequence_auto_loosen(table):
         c.change_sequence(new_sequence=2)
         ac = Course.select().order_by(+Course.sequence)[1]
         assert ac.id == c.id
+
+
+@pytest.mark.parametrize('update_from', [True, False])
+def test_change_sequence_positions(table, monkeypatch, update_from):
+    if not update_from:  # fall back to UPDATE ... CASE batches
+        monkeypatch.setattr(sqlite3, 'sqlite_version_info', (3, 8, 0))
+        monkeypatch.setattr(Book, '__seq_batch_size__', 3)
+    books = [Book.create() for _ in range(8)]
+    expected = [b.id for b in books]
+    for book, position in [(books[0], 5), (books[7], 1), (books[3], 8),
+                           (books[5], 3), (books[2], 3)]:
+        book.change_sequence(position)
+        expected.remove(book.id)
+        expected.insert(position - 1, book.id)
+        ordered = Book.select(Book.id).order_by(Book.sequence)
+        assert [b.id for b in ordered] == expected
+
+    # renumbered above the block the allocator holds
+    books[0]._loosen()
+    ordered = Book.select().order_by(Book.sequence)
+    assert [(b.id, b.sequence) for b in ordered] == [
+        (pk, float(101 + i)) for i, pk in enumerate(expected)]
+    assert books[0].sequence == expected.index(books[0].id) + 101
+    # the held block is dropped, new rows still go last
+    assert Book.create().sequence == 109.0
+    assert [b.id for b in Book.select().order_by(Book.sequence)][-1] == 9
+
+
+def test_change_sequence_equal_sequences(table):
+    # equal sequences are ordered by id, as the baseline allows them
+    books = [Book.create(sequence=seq) for seq in (1.0, 2.0, 2.0, 2.0, 3.0)]
+    expected = [b.id for b in books]
+
+    def ordered():
+        return [b.id for b in Book.select(Book.id)
+                .order_by(Book.sequence, Book.id)]
+
+    for book, position in [(books[0], 3), (books[4], 2), (books[3], 1),
+                           (books[1], 4)]:
+        # loaded again, moves renumber the scope
+        Book.get_by_id(book.id).change_sequence(position)
+        expected.remove(book.id)
+        expected.insert(position - 1, book.id)
+        assert ordered() == expected
+
+
+def test_move_many_and_insert_many_at(table):
+    books = Book.bulk_create([{} for _ in range(6)])
+    # one max id lookup per batch, no duplicates
+    assert [b.sequence for b in books] == [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]
+
+    def ordered():
+        return [b.id for b in Book.select(Book.id).order_by(Book.sequence)]
+
+    Book.move_many([books[4], books[0]], 2)
+    assert ordered() == [2, 5, 1, 3, 4, 6]
+    Book.move_many([books[1], books[2]], 5)
+    assert ordered() == [5, 1, 4, 6, 2, 3]
+    Book.move_many([books[3]], 1)
+    assert ordered() == [4, 5, 1, 6, 2, 3]
+    with pytest.raises(ValueError):
+        Book.move_many([books[3]], 7)
+
+    new = Book.insert_many_at(3, [{}, Book()])
+    assert ordered() == [4, 5, 7, 8, 1, 6, 2, 3]
+    new += Book.insert_many_at(9, [{}])
+    assert ordered()[-1] == new[-1].id
+    with pytest.raises(ValueError):
+        Book.insert_many_at(11, [{}])
+
+    # loosen when the gap runs out of precision
+    for _ in range(20):
+        new = Book.insert_many_at(2, [{}, {}])
+        assert ordered()[1:3] == [new[0].id, new[1].id]
+        if new[0].sequence.is_integer():
+            break
+    assert new[0].sequence.is_integer()
+    assert new[1].sequence == new[0].sequence + 1
+
+
+def test_sequence_keys_written_outside_allocator(table):
+    Book.bulk_create([{} for _ in range(3)])
+    appended, = Book.insert_many_at(4, [{}])
+    assert appended.sequence == 4.0
+    assert Book.create().sequence == 5.0
+
+    book = Book.create(sequence=50.0)
+    assert Book.create().sequence == 51.0
+    Book.get_by_id(1).change_sequence(7)
+    assert Book.get_by_id(1).sequence == 52.0
+    sequences = [seq for seq, in Book.select(Book.sequence).tuples()]
+    assert len(set(sequences)) == len(sequences)
+    assert book.sequence == 50.0
+
+
+def test_sequence_without_counter_table(table, monkeypatch):
+    # deployed before the counter table: the largest key per insert
+    with db.bind_ctx([SequenceCounter]):
+        SequenceCounter.drop_table()
+    SequenceMixin.__seq_allocator__.clear()
+    lookups = []
+    table_exists = db.table_exists
+    monkeypatch.setattr(
+        db, 'table_exists',
+        lambda name: lookups.append(name) or table_exists(name))
+    books = Book.bulk_create([{} for _ in range(3)])
+    assert [b.sequence for b in books] == [1.0, 2.0, 3.0]
+    assert Book.create().sequence == 4.0
+    books[0].change_sequence(4)
+    assert books[0].sequence == 5.0
+    assert len(lookups) == 1  # the missing table is remembered
+
+    with db.bind_ctx([SequenceCounter]):
+        SequenceCounter.create_table()
+    assert Book.create().sequence == 6.0
+    SequenceMixin.__seq_allocator__.clear()
+    assert Book.create().sequence == 7.0
+    assert len(lookups) == 2
+    assert SequenceCounter.select().bind(db).count() == 1
+
+
+def test_sequence_allocator_in_transaction(table):
+    Book.create()
+    with pytest.raises(RuntimeError):
+        with db.atomic():
+            Book.bulk_create([{} for _ in range(150)])
+            raise RuntimeError
+    # values of the block are skipped, the extra ones are rolled back
+    assert Book.create().sequence == 101.0
+    with db.atomic():
+        books = Book.bulk_create([{} for _ in range(150)])
+    assert len({b.sequence for b in books}) == 150
+    assert min(b.sequence for b in books) == 102.0
+
+
+def test_sequence_allocator_threads(tmp_path):
+    threads, rows = 8, 100
+    sqlite_db = pw.SqliteDatabase(
+        str(tmp_path / 'seq.db'), pragmas={'journal_mode': 'wal'},
+        timeout=30)
+
+    class Ticket(SequenceMixin, pwdb.model_class):
+        __seq_allocator__ = SequenceAllocator(block_size=10)
+
+        id = pw.AutoField()
+        sequence = pw.DoubleField(null=True)
+
+        class Meta:
+            database = sqlite_db
+
+    SequenceCounter.bind(sqlite_db)
+    try:
+        sqlite_db.create_tables([Ticket, SequenceCounter])
+
+        def worker():
+            for _ in range(rows):
+                Ticket.create()
+            sqlite_db.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        sequences = [seq for seq, in Ticket.select(Ticket.sequence).tuples()]
+        assert len(sequences) == threads * rows
+        assert len(set(sequences)) == len(sequences)
+    finally:
+        SequenceCounter.bind(None)
+        sqlite_db.close()
+
+
+class Account(VersionedMixin, pwdb.Model):
+    balance = pw.IntegerField(default=0)
+
+
+@pytest.fixture
+def account_table():
+    Account.create_table()
+    yield
+    Account.drop_table()
+
+
+def test_versioned_mixin(account_table):
+    account = Account.create()
+    assert account.version == 1
+    first, second = Account.get_by_id(account.id), Account.get_by_id(
+        account.id)
+    first.balance = 10
+    first.save()
+    assert first.version == 2
+    assert first.save() is False  # nothing changed, no version bump
+
+    second.balance = 20
+    with pytest.raises(VersionConflict):
+        second.save()
+    assert second.version == 1 and second.is_dirty()
+    assert Account.get_by_id(account.id).balance == 10
+
+    first.balance = 30
+    first.save(only=[Account.balance])
+    assert Account.get_by_id(account.id).version == 3
+
+
+def test_retry_on_conflict(account_table):
+    account = Account.create()
+    calls = []
+
+    @retry_on_conflict(retries=2, backoff=0.001)
+    def deposit(amount):
+        row = Account.get_by_id(account.id)
+        calls.append(amount)
+        if len(calls) == 1:  # another writer gets in first
+            Account.get_by_id(account.id).update_with(balance=100)
+        row.balance += amount
+        row.save()
+        return row
+
+    assert deposit(5).balance == 105
+    assert len(calls) == 2
+
+    @retry_on_conflict(retries=1, backoff=0.001)
+    def always_conflict():
+        calls.append(None)
+        raise VersionConflict()
+
+    with pytest.raises(VersionConflict):
+        always_conflict()
+    assert calls[2:] == [None, None]
+
+
+def test_versioned_threads(tmp_path):
+    threads, deposits = 8, 20
+    sqlite_db = pw.SqliteDatabase(
+        str(tmp_path / 'account.db'), pragmas={'journal_mode': 'wal'},
+        timeout=30)
+
+    class Wallet(VersionedMixin, pwdb.model_class):
+        balance = pw.IntegerField(default=0)
+
+        class Meta:
+            database = sqlite_db
+
+    attempts, conflicts = [], []
+
+    @retry_on_conflict(retries=100, backoff=0.001, max_backoff=0.01)
+    def deposit(wallet_id):
+        attempts.append(wallet_id)
+        wallet = Wallet.get_by_id(wallet_id)
+        wallet.balance += 1
+        try:
+            wallet.save()
+        except VersionConflict:
+            conflicts.append(wallet_id)
+            raise
+
+    try:
+        sqlite_db.create_tables([Wallet])
+        wallet = Wallet.create()
+
+        def worker():
+            for _ in range(deposits):
+                deposit(wallet.id)
+            sqlite_db.close()
+
+        workers = [threading.Thread(target=worker) for _ in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+
+        wallet = Wallet.get_by_id(wallet.id)
+        # no update is lost, though writers raced without row locks
+        assert wallet.balance == threads * deposits
+        assert wallet.version == threads * deposits + 1
+        # every conflict was retried once, every other attempt succeeded
+        assert len(attempts) == threads * deposits + len(conflicts)
+    finally:
+        sqlite_db.close()
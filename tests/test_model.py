@@ -3,6 +3,7 @@ import peewee
 import peeweext
 import pendulum
 import datetime
+import functools
 from io import StringIO
 import inspect
 import json
@@ -55,6 +56,17 @@ class Category(pwdb.Model):
     title = JSONCharField(max_length=128, null=True, ensure_ascii=False)
 
 
+class LazyCategory(pwdb.Model):
+    id = peewee.AutoField()
+    content = JSONCharField(max_length=128, default={}, lazy=True)
+    remark = JSONCharField(max_length=128, null=True, lazy=True)
+    title = JSONCharField(max_length=128, null=True, ensure_ascii=False,
+                          lazy=True)
+
+    class Meta:
+        table_name = 'category'
+
+
 class MyCategory(pwmysql.Model):
     id = peewee.AutoField()
     content = JSONCharField(max_length=128, default={})
@@ -391,3 +403,676 @@ def test_massassignment(massassignment_models):
     assert m2.f1 == 20
     assert m2.f3 == 20
     assert m2.f4 == 30
+
+
+@pytest.fixture
+def note_table():
+    Note.create_table()
+    yield
+    Note.drop_table()
+
+
+def test_bulk_create(note_table):
+    received = []
+
+    def pre_save(sender, instance, created):
+        received.append(('pre_save', instance.id, created))
+
+    def post_save(sender, instance, created):
+        received.append(('post_save', instance.id, created))
+
+    peeweext.model.pre_save.connect(pre_save, sender=Note)
+    peeweext.model.post_save.connect(post_save, sender=Note)
+    try:
+        notes = Note.bulk_create(
+            [Note(message='n1'), {'message': 'n2'}, {'message': 'n3'}],
+            batch_size=2)
+    finally:
+        peeweext.model.pre_save.disconnect(pre_save, sender=Note)
+        peeweext.model.post_save.disconnect(post_save, sender=Note)
+
+    assert [n.message for n in notes] == ['n1', 'n2', 'n3']
+    assert Note.select().count() == 3
+    assert [n.id for n in notes] == [
+        n.id for n in Note.select().order_by(Note.id)]
+    # one timestamp per batch
+    assert notes[0].updated_at == notes[1].updated_at
+    assert notes[1].updated_at != notes[2].updated_at
+    assert received[:2] == [('pre_save', None, True)] * 2
+    assert received[2:4] == [
+        ('post_save', notes[0].id, True), ('post_save', notes[1].id, True)]
+    assert len(received) == 6
+
+    with pytest.raises(val.ValidationError):
+        Note.bulk_create([{'message': 'ok'}, {'message': 'raise error'}])
+    assert Note.select().count() == 3
+
+
+def test_bulk_update_and_save(note_table):
+    notes = Note.bulk_create([{'message': 'n%d' % i} for i in range(3)])
+    old_updated_at = notes[0].updated_at
+
+    for note in notes:
+        note.message += '!'
+    only = ['message']
+    assert Note.bulk_update(notes, only) == 3
+    assert only == ['message']
+    assert [n.message for n in Note.select().order_by(Note.id)] == [
+        'n0!', 'n1!', 'n2!']
+    assert Note.get_by_id(notes[0].id).updated_at > old_updated_at
+
+    notes[0].message = 'raise error'
+    with pytest.raises(val.ValidationError):
+        Note.bulk_update(notes, [Note.message])
+
+    notes[0].message = 'saved'
+    Note.bulk_save(notes + [Note(message='new')])
+    assert Note.select().count() == 4
+    assert Note.get_by_id(notes[0].id).message == 'saved'
+
+
+class PlanNote(pwdb.Model):
+    message = peewee.TextField()
+    title = peewee.TextField(default='title')
+
+    @val.validates(val.LengthValidator(min_length=1, max_length=8))
+    @val.validates(val.ExclusionValidator('raise'))
+    def validate_message(self, value):
+        if value == 'hello':
+            raise val.ValidationError('no hello')
+
+
+def test_validation_plan():
+    assert Category._validation_plan == ()
+    assert Category()._validate() == {}
+
+    (name, validators, method), = PlanNote._validation_plan
+    assert name == 'message'
+    assert len(validators) == 2
+    assert method.__name__ == 'validate_message'
+
+    note = PlanNote(message='raise')
+    assert note._validate() == {'message': 'value raise is in (\'raise\',)'}
+    note.message = 'too long message'
+    assert 'length' in note._validate()['message']
+    note.message = 'hello'
+    assert note._validate() == {'message': 'no hello'}
+    assert note._validate(only=['title']) == {}
+    assert note._validate(only=[PlanNote.message]) == {'message': 'no hello'}
+    assert PlanNote._validation_plans[('title',)] == ()
+    note.message = 'ok'
+    assert note._validate() == {}
+
+
+calls = []
+
+
+class CountingValidator(val.BaseValidator):
+    def validate(self, value):
+        calls.append(('validator', value))
+
+
+def logged(func):
+    @functools.wraps(func)  # copies `__validators__` of the inner wrapper
+    def wrapper(self, value):
+        calls.append(('logged', value))
+        return func(self, value)
+    return wrapper
+
+
+class WrappedNote(pwdb.Model):
+    message = peewee.TextField()
+
+    @logged
+    @val.validates(CountingValidator())
+    def validate_message(self, value):
+        calls.append(('method', value))
+
+
+def test_validation_plan_other_decorators():
+    (_, validators, method), = WrappedNote._validation_plan
+    assert validators == ()  # run by the outer decorator
+    calls.clear()
+    assert WrappedNote(message='a')._validate() == {}
+    assert calls == [('logged', 'a'), ('validator', 'a'), ('method', 'a')]
+
+
+def test_save_dirty_fields(note_table, caplog):
+    note = Note.create(message='hello')
+    note = Note.get_by_id(note.id)
+    saved = []
+
+    def post_save(sender, instance, created):
+        saved.append(instance)
+
+    peeweext.model.post_save.connect(post_save, sender=Note)
+    try:
+        assert not note.is_dirty()
+        assert note.save() is False
+        assert saved == []
+
+        note.message = 'changed'
+        with caplog.at_level('DEBUG', logger='peewee'):
+            assert note.save() == 1
+        sql = caplog.records[-1].msg[0]
+        assert sql.startswith('UPDATE')
+        assert '"message"' in sql and '"updated_at"' in sql
+        assert '"published_at"' not in sql and '"created_at"' not in sql
+        assert saved == [note]
+        assert not note.is_dirty()
+
+        # only validators of changed fields run
+        Note.update(message='raise error').where(
+            Note.id == note.id).execute()
+        note = Note.get_by_id(note.id)
+        note.published_at = pendulum.now()
+        note.save()
+
+        only = [Note.published_at]
+        note.save(only=only)
+        assert only == [Note.published_at]
+    finally:
+        peeweext.model.post_save.disconnect(post_save, sender=Note)
+
+
+@pytest.fixture
+def category_table():
+    Category.create_table()
+    yield
+    Category.drop_table()
+
+
+def test_save_mutable_fields(category_table):
+    category = Category.create(content={'a': 1})
+    category = Category.get_by_id(category.id)
+    category.content['b'] = 2
+    category.save()
+    assert Category.get_by_id(category.id).content == {'a': 1, 'b': 2}
+
+
+def test_datetime_conversion():
+    field = peeweext.fields.DatetimeTZField()
+    lightweight = peeweext.fields.DatetimeTZField(lightweight=True)
+    naive = datetime.datetime(2024, 1, 2, 3, 4, 5, 678901)
+    aware = naive.replace(
+        tzinfo=datetime.timezone(datetime.timedelta(hours=8)))
+    for value, expected in [
+            (naive, pendulum.instance(naive)),
+            (aware, pendulum.instance(aware)),
+            (str(aware), pendulum.parse(str(aware))),
+            ('2024-01-02', pendulum.parse('2024-01-02'))]:
+        converted = field.python_value(value)
+        assert isinstance(converted, pendulum.DateTime)
+        assert converted == expected
+        assert converted.utcoffset() == expected.utcoffset()
+        converted = lightweight.python_value(value)
+        assert type(converted) is datetime.datetime
+        assert converted == expected
+    assert field.python_values([naive, None, str(aware)]) == [
+        pendulum.instance(naive), None, aware]
+    assert lightweight.python_values([naive]) == [
+        naive.replace(tzinfo=datetime.timezone.utc)]
+
+    now = pendulum.now('Asia/Shanghai')
+    assert field.db_value(now) == now
+    assert field.db_value(now).tzinfo is datetime.timezone.utc
+    with pytest.raises(ValueError):
+        field.db_value(naive)
+
+
+def test_iterator(note_table):
+    published_at = pendulum.datetime(2024, 1, 2, tz='Asia/Shanghai')
+    Note.bulk_create([
+        {'message': str(i), 'published_at': published_at}
+        for i in range(5)])
+    notes = list(Note.select().order_by(Note.id).iterator(chunk_size=2))
+    assert [n.message for n in notes] == ['0', '1', '2', '3', '4']
+    assert all(n.published_at == published_at for n in notes)
+    assert isinstance(notes[0].created_at, pendulum.DateTime)
+    rows = list(Note.select(Note.published_at).tuples().iterator())
+    assert rows == [(published_at,)] * 5
+
+
+@pytest.mark.parametrize('name', sorted(peeweext.fields.json_codecs))
+def test_json_codecs(name):
+    codec = peeweext.fields.json_codecs[name]
+    value = {'a': [1, 2.5, None, True], 'b': '测试/"x"', 'c': {'d': 2 ** 70}}
+    for ensure_ascii in (True, False):
+        data = codec.dumps(value, ensure_ascii)
+        if isinstance(data, bytes):
+            data = data.decode()
+        # stdlib json reads the new format, the codec reads the old one
+        assert json.loads(data) == value
+        assert codec.loads(json.dumps(value, ensure_ascii=ensure_ascii)) \
+            == value
+        if ensure_ascii:
+            assert data.isascii()
+    assert codec.loads('{"nan": NaN}')['nan'] != 0
+
+    field = JSONCharField(max_length=4, codec=codec, ensure_ascii=False)
+    field.name = 'content'
+    assert json.loads(field.db_value('测试')) == '测试'  # 4 chars, 8 bytes
+    with pytest.raises(ValueError):
+        field.db_value('测试测')
+
+
+def test_json_eager_by_default(category_table):
+    from playhouse.shortcuts import model_to_dict
+
+    Category.create(content={'a': 1}, title=['t'])
+    assert model_to_dict(Category.get())['content'] == {'a': 1}
+    assert not isinstance(
+        Category.get().__data__['content'], peeweext.fields.RawJSON)
+
+
+def test_json_lazy(category_table):
+    category = LazyCategory.create(content={'a': 1}, title=['t'])
+    category = LazyCategory.get_by_id(category.id)
+    assert isinstance(
+        category.__data__['content'], peeweext.fields.RawJSON)
+    assert not category.is_dirty()
+    assert category.save() is False  # unread JSON is never written
+    category.remark = [1]
+    category.save()
+    assert isinstance(
+        category.__data__['content'], peeweext.fields.RawJSON)
+
+    category = LazyCategory.get_by_id(category.id)
+    assert category.content == {'a': 1}
+    assert category.remark == [1]
+    assert LazyCategory.select(LazyCategory.title).dicts().get() == \
+        {'title': ['t']}
+    category.content['b'] = 2
+    category.save()
+    assert LazyCategory.get_by_id(category.id).content == {'a': 1, 'b': 2}
+
+
+class Document(pwdb.Model):
+    body = peeweext.fields.CompressedJSONField(threshold=64, null=True)
+    blob = peeweext.fields.CompressedBlobField(threshold=64, null=True)
+
+
+@pytest.fixture
+def document_table():
+    Document.create_table()
+    yield
+    Document.drop_table()
+
+
+@pytest.mark.parametrize('name', sorted(peeweext.fields.compressors))
+def test_compressed_fields(name):
+    field = peeweext.fields.CompressedBlobField(
+        compression=name, threshold=64)
+    field.name, field._constructor = 'blob', bytes
+    small, large = b'x' * 10, b'x' * 1000
+    assert field.db_value(small) == b'\x00' + small
+    stored = field.db_value(large)
+    assert stored[0] == peeweext.fields.compressors[name].tag
+    assert len(stored) < 100
+    # rows are readable whatever the field is configured with
+    other = peeweext.fields.CompressedBlobField(threshold=10 ** 6)
+    assert other.python_value(stored) == large
+    assert other.python_value(memoryview(field.db_value(small))) == small
+    noise = bytes(range(256))  # incompressible, kept as is
+    assert field.db_value(noise) == b'\x00' + noise
+    with pytest.raises(ValueError):
+        field.python_value(b'\xffabc')
+
+
+def test_compressed_json_lazy(document_table):
+    body = {'items': [{'id': i, 'name': 'item'} for i in range(100)]}
+    doc = Document.create(body=body, blob=b'y' * 100)
+    assert Document.select(Document.body).dicts().get()['body'] == body
+    doc = Document.get_by_id(doc.id)
+    assert isinstance(
+        doc.__data__['body'], peeweext.fields.RawCompressed)
+    assert not doc.is_dirty()
+    assert doc.save() is False
+    assert doc.blob == b'y' * 100
+    doc.body['items'].append({'id': 100})
+    doc.save()
+    assert len(Document.get_by_id(doc.id).body['items']) == 101
+
+
+def test_lite_rows(note_table):
+    published_at = pendulum.datetime(2024, 1, 1, tz='Asia/Shanghai')
+    Note.create(message='a', published_at=published_at)
+    Note.create(message='b')
+    received = []
+
+    def on_init(sender, instance):
+        received.append(instance)
+
+    peeweext.signals.pre_init.connect(on_init, sender=Note)
+    try:
+        rows = list(Note.select().order_by(Note.id).lite())
+        assert list(Note.select(Note.message).lite().iterator(
+            chunk_size=1)) == [('a',), ('b',)]
+    finally:
+        peeweext.signals.pre_init.disconnect(on_init, sender=Note)
+    assert not received
+    row = rows[0]
+    assert isinstance(row, peeweext.model.LiteRow)
+    assert row.message == 'a' and row.published_at == published_at
+    assert isinstance(row.published_at, pendulum.DateTime)
+    assert rows[1].published_at is None
+    assert row._asdict()['id'] == row.id
+    assert type(row) is type(Note.select().lite().get())
+    with pytest.raises(AttributeError):
+        row.message = 'b'
+
+
+def test_stream(note_table):
+    import tracemalloc
+
+    message = 'x' * 200
+    with db.atomic():
+        Note.insert_many(
+            [{'message': message}] * 5000, fields=[Note.message]).execute()
+    ids = [note.id for note in Note.stream(chunk_size=300)]
+    assert ids == list(range(1, 5001))
+    assert [row['id'] for row in Note.stream(
+        Note.select(Note.id).where(Note.id > 4990).dicts(),
+        chunk_size=3)] == list(range(4991, 5001))
+    with pytest.raises(ValueError):
+        Note.stream(Note.select().order_by(Note.message))
+    with pytest.raises(ValueError):
+        Note.stream(server_side=True)
+
+    def peak(rows):
+        tracemalloc.start()
+        try:
+            for _ in rows():
+                pass
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    # memory stays flat, no matter how many rows are streamed
+    def stream():
+        return Note.stream(chunk_size=100)
+
+    streamed = peak(stream)
+    assert streamed < peak(lambda: list(Note.select())) / 10
+    with db.atomic():
+        Note.insert_many(
+            [{'message': message}] * 5000, fields=[Note.message]).execute()
+    assert peak(stream) < streamed * 1.5
+
+
+def test_stream_mysql(table):
+    for message in ('a', 'b', 'c'):
+        MyNote.create(message=message)
+    rows = MyNote.stream(chunk_size=2)
+    assert next(rows).message == 'a'
+    # the request connection is free while the stream is open
+    assert MyNote.select().count() == 3
+    assert [note.message for note in rows] == ['b', 'c']
+
+
+@pytest.mark.parametrize('order_by', [
+    None,
+    (Note.message,),
+    (Note.message.desc(),),
+    (Note.published_at, Note.id),
+    (Note.published_at.desc(), Note.message),
+    (Note.message.desc(), Note.published_at),
+])
+def test_paginate_after(note_table, order_by):
+    base = pendulum.datetime(2024, 1, 1, tz='Asia/Shanghai')
+    for i in range(23):
+        Note.create(
+            message='m{}'.format(i % 4),  # ties
+            published_at=None if i % 5 == 0
+            else base.add(minutes=i % 3, microseconds=i % 2))
+
+    def key(node):
+        descending = isinstance(node, peewee.Ordering)
+        name = (node.node if descending else node).name
+
+        def value(note):
+            # NULL first in ascending, last in descending order
+            value = getattr(note, name)
+            return (False,) if value is None else (True, value)
+        return value
+
+    order = list(order_by or ())
+    # the primary key breaks ties, in the direction of the last field
+    expected = sorted(Note.select(), key=lambda n: n.id, reverse=bool(
+        order and isinstance(order[-1], peewee.Ordering)))
+    for node in reversed(order):
+        expected.sort(key=key(node),
+                      reverse=isinstance(node, peewee.Ordering))
+    ids = []
+    cursor = None
+    while True:
+        page = Note.paginate_after(cursor, order_by=order_by, limit=4)
+        assert len(page) <= 4
+        ids.extend(note.id for note in page)
+        cursor = page.next_cursor
+        if cursor is None:
+            break
+    assert ids == [note.id for note in expected]
+
+
+def test_paginate_after_cursor(note_table):
+    published_at = pendulum.datetime(
+        2024, 1, 1, 8, 30, 0, 500, tz=pendulum.FixedTimezone(8 * 3600))
+    for _ in range(3):
+        Note.create(message='a', published_at=published_at)
+    page = Note.paginate_after(order_by=(Note.published_at,), limit=1)
+    token = page.next_cursor
+    assert isinstance(token, str) and token.isascii()
+    assert [n.id for n in Note.paginate_after(
+        token, order_by=(Note.published_at,), limit=5)] == [2, 3]
+    with pytest.raises(ValueError):
+        Note.paginate_after(token, order_by=(Note.message,))
+    with pytest.raises(ValueError):
+        Note.paginate_after('not a cursor')
+
+
+class Shelf(pwdb.Model):
+    name = peewee.CharField()
+
+
+class Volume(pwdb.Model):
+    shelf = peewee.ForeignKeyField(Shelf, backref='volumes')
+    donor = peewee.ForeignKeyField(Shelf, null=True, backref='donations')
+    sequel = peewee.ForeignKeyField('self', null=True, backref='prequels')
+
+
+class Leaf(pwdb.Model):
+    volume = peewee.ForeignKeyField(Volume, backref='leaves')
+
+
+@pytest.fixture
+def shelf_tables():
+    db.create_tables([Shelf, Volume, Leaf])
+    shelves = [Shelf.create(name=name) for name in 'abc']
+    for index, shelf in enumerate(shelves):
+        first = None
+        for _ in range(2):
+            first = Volume.create(
+                shelf=shelf, donor=shelves[index - 1], sequel=first)
+            Leaf.create(volume=first)
+            Leaf.create(volume=first)
+    yield shelves
+    db.drop_tables([Shelf, Volume, Leaf])
+
+
+def test_delete_many(shelf_tables, monkeypatch):
+    a, b, c = shelf_tables
+    received = []
+
+    def on_volumes(sender, instances, pks):
+        assert instances is None
+        received.append(('volumes', sorted(pks)))
+
+    def on_deleted(sender, instance):
+        received.append(('instance', instance))
+
+    statements = []
+    execute_sql = db.execute_sql
+    monkeypatch.setattr(db, 'execute_sql', lambda sql, *args: (
+        statements.append(sql), execute_sql(sql, *args))[1])
+    peeweext.signals.pre_delete_batch.connect(on_volumes, sender=Volume)
+    # like QueryCache, a receiver of any sender
+    peeweext.signals.post_delete.connect(on_deleted)
+    try:
+        assert Shelf.delete_many(
+            Shelf.name << ['a', 'b'], recursive=True) == 2
+    finally:
+        peeweext.signals.pre_delete_batch.disconnect(on_volumes, sender=Volume)
+        peeweext.signals.post_delete.disconnect(on_deleted)
+        monkeypatch.undo()
+    assert [s.name for s in Shelf.select()] == ['c']
+    # one batch of keys for the volumes, nothing per row
+    assert received == [('volumes', [1, 2, 3, 4])]
+    # keys are only selected for models with batch receivers
+    assert not [sql for sql in statements
+                if sql.startswith('SELECT') and 'FROM "leaf"' in sql
+                and 'DELETE' not in sql]
+    volumes = list(Volume.select().order_by(Volume.id))
+    assert [v.shelf_id for v in volumes] == [c.id, c.id]
+    assert [v.donor_id for v in volumes] == [None, None]  # was b
+    assert Leaf.select().count() == 4
+
+    # nullable references are deleted too, and so are their dependents
+    assert Shelf.delete_many(recursive=True, delete_nullable=True,
+                             batch_size=1) == 1
+    assert Volume.select().count() == Leaf.select().count() == 0
+
+
+def test_delete_batch_payload(shelf_tables):
+    a, b, c = shelf_tables
+    received = []
+
+    # the documented batch signature, for instances and delete_many alike
+    def receiver(sender, instances, **kwargs):
+        received.append((instances and [i.name for i in instances],
+                         kwargs['pks']))
+
+    peeweext.signals.pre_delete_batch.connect(receiver, sender=Shelf)
+    peeweext.signals.post_delete_batch.connect(receiver, sender=Shelf)
+    try:
+        a.delete_instance(recursive=True)
+        Shelf.delete_many(Shelf.name == 'b', recursive=True)
+    finally:
+        peeweext.signals.pre_delete_batch.disconnect(receiver, sender=Shelf)
+        peeweext.signals.post_delete_batch.disconnect(receiver, sender=Shelf)
+    assert received == [(['a'], [a.id]), (['a'], [a.id]),
+                        (None, [b.id]), (None, [b.id])]
+
+
+def test_delete_instance_recursive(shelf_tables):
+    a, b, c = shelf_tables
+    volume = Volume.get(Volume.shelf == a, Volume.sequel.is_null(False))
+    assert a.delete_instance(recursive=True) == 1
+    assert Volume.select().where(Volume.shelf == a).count() == 0
+    assert Volume.select().where(Volume.donor == a).count() == 0
+    assert Leaf.select().where(Leaf.volume == volume).count() == 0
+
+
+def test_filter_attrs():
+    assert MassAssignment1._assignable == {'f1', 'f2'}
+    attrs = {'f1': 1, 'f2': 2}
+    assert MassAssignment1._filter_attrs(attrs) is attrs
+    # keys which are not fields never pass
+    assert MassAssignment2._filter_attrs(
+        {'f1': 1, 'f4': 4, 'unknown': 0, 'id': 5}) == {'f1': 1, 'id': 5}
+    assert 'shelf_id' in Volume._assignable
+
+    class Strict(MassAssignment2):
+        __attr_strict__ = True
+
+    with pytest.raises(val.ValidationError) as e:
+        Strict._filter_attrs({'f1': 1, 'f4': 4, 'unknown': 0})
+    assert e.value.keys == ['f4', 'unknown']
+
+
+class Profile(pwdb.Model):
+    __attr_protected__ = {'karma'}
+
+    email = peewee.CharField(unique=True)
+    name = peewee.CharField(null=True)
+    karma = peewee.IntegerField(default=0)
+
+    def validate_name(self, value):
+        if value == 'invalid':
+            raise val.ValidationError('invalid name')
+
+
+@pytest.fixture
+def profile_table():
+    Profile.create_table()
+    yield
+    Profile.drop_table()
+
+
+@pytest.mark.parametrize('returning', [True, False])
+def test_upsert(profile_table, monkeypatch, returning):
+    # without RETURNING, as on MySQL, the rows are selected back
+    monkeypatch.setattr(db, 'returning_clause', returning)
+    received = []
+
+    def post_save(sender, instance, created):
+        received.append((instance.email, created))
+
+    peeweext.signals.post_save.connect(post_save, sender=Profile)
+    try:
+        profile, created = Profile.upsert(email='a@x.com', name='a')
+        assert created and profile.id == 1
+        created_at = Profile.get_by_id(1).created_at
+
+        profile, created = Profile.upsert(
+            email='a@x.com', name='b', karma=100)
+        assert not created and profile.id == 1
+        assert profile.created_at == created_at
+
+        results = Profile.upsert_many([
+            {'email': 'b@x.com', 'name': 'b'},
+            {'email': 'a@x.com', 'name': 'c'},
+            {'email': 'c@x.com'},
+        ], batch_size=1)
+    finally:
+        peeweext.signals.post_save.disconnect(post_save, sender=Profile)
+    assert [(p.email, c) for p, c in results] == [
+        ('b@x.com', True), ('a@x.com', False), ('c@x.com', True)]
+    assert received == [('a@x.com', True), ('a@x.com', False),
+                        ('b@x.com', True), ('a@x.com', False),
+                        ('c@x.com', True)]
+    a = Profile.get(Profile.email == 'a@x.com')
+    assert (a.name, a.karma, a.created_at) == ('c', 0, created_at)
+    assert a.updated_at > created_at
+    assert Profile.select().count() == 3
+
+    with pytest.raises(val.ValidationError):
+        Profile.upsert(email='d@x.com', name='invalid')
+    with pytest.raises(ValueError):
+        Profile.upsert(name='no key')
+    # an explicit target, the columns not given are kept
+    Profile.update(karma=5).execute()
+    profile, created = Profile.upsert(
+        conflict_target=(Profile.id,), id=a.id, email='e@x.com', name='d')
+    assert not created
+    a = Profile.get_by_id(a.id)
+    assert (a.email, a.name, a.karma) == ('e@x.com', 'd', 5)
+    # updated_at given in the row is updated once
+    statements = []
+    execute_sql = db.execute_sql
+    monkeypatch.setattr(db, 'execute_sql', lambda sql, *args: (
+        statements.append(sql), execute_sql(sql, *args))[1])
+    profile, created = Profile.upsert(
+        email='e@x.com', name='e', updated_at=pendulum.now())
+    assert not created
+    insert, = [sql for sql in statements if sql.startswith('INSERT')]
+    assert insert.count('"updated_at" = EXCLUDED') == 1
+    monkeypatch.undo()
+
+    # created_at given, an update writing the same value is no insert
+    stamp = pendulum.now()
+    profile, created = Profile.upsert(email='f@x.com', created_at=stamp)
+    assert created
+    profile, created = Profile.upsert(
+        email='f@x.com', name='f', created_at=stamp)
+    assert not created
@@ -0,0 +1,122 @@
+import peewee
+import pytest
+from flask import Flask
+from opentelemetry import trace
+from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import \
+    InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ALWAYS_OFF
+
+from peeweext import otel, pool
+from peeweext.model import Model
+from peeweext.signals import post_save
+from peeweext.validation import ValidationError
+
+db = pool.connect('sqlite:///:memory:', mixins=(otel.TelemetryMixin,))
+
+
+class Note(Model):
+    message = peewee.TextField()
+
+    class Meta:
+        database = db
+
+    def validate_message(self, value):
+        if not value:
+            raise ValidationError('empty')
+
+
+@pytest.fixture
+def telemetry():
+    exporter = InMemorySpanExporter()
+    tracer_provider = TracerProvider()
+    tracer_provider.add_span_processor(SimpleSpanProcessor(exporter))
+    reader = InMemoryMetricReader()
+    telemetry = otel.install(
+        tracer_provider, MeterProvider(metric_readers=[reader]))
+    db.create_tables([Note])
+    try:
+        yield telemetry, exporter, reader
+    finally:
+        otel.uninstall()
+        db.drop_tables([Note])
+
+
+def histograms(reader):
+    result = {}
+    for resource in reader.get_metrics_data().resource_metrics:
+        for scope in resource.scope_metrics:
+            for metric in scope.metrics:
+                for point in metric.data.data_points:
+                    result[metric.name, tuple(sorted(
+                        point.attributes.items()))] = point.count
+    return result
+
+
+def test_model_spans(telemetry):
+    _, exporter, reader = telemetry
+
+    def receiver(sender, instance, created):
+        if created and instance.message == 'a':
+            Note.create(message='child of ' + instance.message)
+
+    post_save.connect(receiver, sender=Note)
+    try:
+        note = Note.create(message='a')
+    finally:
+        post_save.disconnect(receiver, sender=Note)
+    note.delete_instance()
+    with pytest.raises(ValidationError):
+        Note.create(message='')
+
+    child, parent, delete, failed = exporter.get_finished_spans()
+    assert [s.name for s in (parent, delete, failed)] == \
+        ['Note.save', 'Note.delete_instance', 'Note.save']
+    assert child.parent.span_id == parent.context.span_id
+    assert parent.attributes['peeweext.model'] == 'Note'
+    assert parent.attributes['peeweext.queries'] == 1
+    assert parent.attributes['peeweext.signals_ms'] > \
+        child.attributes['peeweext.query_ms']
+    assert 'peeweext.validation_ms' in parent.attributes
+    fingerprint, = parent.attributes['db.statement.fingerprints']
+    assert fingerprint.startswith('INSERT INTO "note"')
+    assert delete.attributes['db.statement.fingerprints'][0] == \
+        'DELETE FROM "note" WHERE ("note"."id" = ?)'
+    assert not failed.status.is_ok
+    assert failed.attributes['peeweext.queries'] == 0
+
+    counts = histograms(reader)
+    assert counts['peeweext.model.duration', (
+        ('peeweext.model', 'Note'), ('peeweext.operation', 'save'))] == 3
+    assert counts['peeweext.model.duration', (
+        ('peeweext.model', 'Note'), ('peeweext.operation', 'validation'))] \
+        == 3
+    assert counts['peeweext.query.duration', (
+        ('db.statement.fingerprint', fingerprint),)] == 2
+
+
+def test_head_sampling(telemetry):
+    telemetry, exporter, reader = telemetry
+    telemetry.sample_rate = 0
+    Note.create(message='a')
+    assert exporter.get_finished_spans() == ()
+    assert histograms(reader)
+
+    telemetry.sample_rate = 1
+    tracer = trace.get_tracer('test', tracer_provider=TracerProvider(
+        sampler=ALWAYS_OFF))
+    with tracer.start_as_current_span('request'):
+        Note.create(message='b')
+    assert exporter.get_finished_spans() == ()
+    Note.create(message='c')
+    assert len(exporter.get_finished_spans()) == 1
+
+
+def test_otel_config():
+    app = Flask('otel app')
+    assert otel.database_mixins(app) == ()
+    app.config.update(OTEL_ENABLE=True, OTEL_METRICS=True)
+    assert otel.database_mixins(app) == (otel.TelemetryMixin,)
@@ -27,4 +27,54 @@ def test_sea():
 
     assert pwx.database.is_closed()
 
+    # connect on the first query only
+    pwx.lazy_connect = True
+    try:
+        assert not stub.return_normal(None)
+    finally:
+        pwx.lazy_connect = False
+
     Note.drop_table()
+
+
+def test_sea_replica_routing(tmp_path):
+    import peewee
+    from peeweext.sea import Peeweext
+
+    urls = ['sqlite:///{}'.format(tmp_path / name)
+            for name in ('primary.db', 'replica.db')]
+    _app.config.update(PW_RO_DB_URL=urls[0], PW_RO_REPLICA_URLS=urls[1:])
+    pwr = Peeweext(ns='PW_RO_')
+    pwr.init_app(_app)
+
+    class Article(pwr.Model):
+        title = peewee.TextField()
+
+    Article.create_table()
+    replica, = pwr.router.replicas
+    with replica.bind_ctx([Article]):
+        Article.create_table()
+        Article.create(title='replica')
+
+    Article.create(title='primary')
+    assert Article.get().title == 'replica'
+    with pwr.database.atomic():
+        assert Article.get().title == 'primary'
+    pwr.close_db()
+    assert replica.is_closed()
+
+
+def test_sea_query_stats():
+    from peeweext.sea import Peeweext
+
+    _app.config.update(PW_STATS_DB_URL='sqlite:///:memory:',
+                       PW_STATS_QUERY_STATS=True)
+    pws = Peeweext(ns='PW_STATS_')
+    pws.init_app(_app)
+
+    pws.start_stats('return_normal')
+    pws.database.execute_sql('select 1')
+    stats = pws.recorder.current()
+    pws.finish_stats()
+    assert (stats.name, stats.count) == ('return_normal', 1)
+    assert pws.recorder.current() is None
@@ -0,0 +1,90 @@
+import peewee
+import pytest
+
+from peeweext import signals
+from tests.flaskapp import pwdb
+
+
+class Event(pwdb.Model):
+    name = peewee.CharField()
+
+
+@pytest.fixture
+def table():
+    Event.create_table()
+    yield
+    Event.drop_table()
+
+
+def test_receivers_cache():
+    def handler(sender, instance, created):
+        pass
+
+    assert not signals.has_receivers(signals.post_save, Event)
+    signals.post_save.connect(handler, sender=Event)
+    assert signals.has_receivers(signals.post_save, Event)
+    signals.post_save.disconnect(handler, sender=Event)
+    assert not signals.has_receivers(signals.post_save, Event)
+
+
+def test_batch_signals(table):
+    received = []
+
+    def post_save(sender, instances, created):
+        received.append(([i.name for i in instances], created))
+
+    def post_delete(sender, instances, pks):
+        assert pks == [i.id for i in instances]
+        received.append(([i.name for i in instances], None))
+
+    signals.post_save_batch.connect(post_save, sender=Event)
+    signals.post_delete_batch.connect(post_delete, sender=Event)
+    try:
+        # delivered at once without batched()
+        e = Event.create(name='e0')
+        assert received == [(['e0'], True)]
+        received.clear()
+
+        with signals.batched():
+            Event.create(name='e1')
+            with signals.batched():
+                Event.create(name='e2')
+            e.name = 'e0!'
+            e.save()
+            e.delete_instance()
+            assert received == []
+        assert received == [
+            (['e1', 'e2'], True), (['e0!'], False), (['e0!'], None)]
+        received.clear()
+
+        with pytest.raises(RuntimeError):
+            with signals.batched():
+                Event.create(name='e3')
+                raise RuntimeError
+        assert received == []
+
+        Event.bulk_create([{'name': 'e4'}, {'name': 'e5'}])
+        assert received == [(['e4', 'e5'], True)]
+    finally:
+        signals.post_save_batch.disconnect(post_save, sender=Event)
+        signals.post_delete_batch.disconnect(post_delete, sender=Event)
+
+
+def test_pre_batch_signals(table):
+    received = []
+
+    def pre_save_batch(sender, instances, created):
+        received.append([i.name for i in instances])
+
+    def pre_save(sender, instance, created):
+        received.append(instance.name)
+
+    signals.pre_save_batch.connect(pre_save_batch, sender=Event)
+    signals.pre_save.connect(pre_save, sender=Event)
+    try:
+        with signals.batched():  # pre_* batches are never delayed
+            Event.bulk_create([{'name': 'e0'}, {'name': 'e1'}])
+            assert received == [['e0', 'e1'], 'e0', 'e1']
+    finally:
+        signals.pre_save_batch.disconnect(pre_save_batch, sender=Event)
+        signals.pre_save.disconnect(pre_save, sender=Event)